@@ -1,52 +1,169 @@
-import requests
-import json
+import asyncio
+import httpx
 import logging
-from requests.exceptions import ConnectTimeout
+import time
+from metrics import SLACK_CALL_SECONDS, SLACK_RETRIES, SLACK_RATE_LIMITED
+from rate_limiter import SlackRateLimiter, retry_after_seconds
+from retry_policy import RetryPolicy, CircuitBreakers
+from response_cache import ResponseCache, FileCacheBackend, CACHEABLE_METHODS, cache_key
 
 
-#A class responsible for making api call via request library
+# Raised when slack could not be reached: connection and read failures once retries are exhausted, or an open circuit breaker
+class SlackUnavailableError(Exception):
+    pass
+
+
+
+# Build the shared, pooled http client used for every call made to slack.
+# Connections are kept alive between calls so we only pay the TCP+TLS handshake once per host.
+def create_http_client(settings):
+    limits = httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=settings.HTTP2_ENABLED)
+
+
+
+# Build the app-lifetime rate limiter shared by every call made to slack
+def create_rate_limiter(settings):
+    return SlackRateLimiter(burst_seconds=settings.RATE_LIMIT_BURST_SECONDS, max_retries=settings.RATE_LIMIT_MAX_RETRIES)
+
+
+
+# Build the app-lifetime retry policy shared by every call made to slack
+def create_retry_policy(settings):
+    return RetryPolicy(
+        max_attempts=settings.RETRY_MAX_ATTEMPTS,
+        base_delay=settings.RETRY_BASE_DELAY,
+        max_delay=settings.RETRY_MAX_DELAY,
+        budget_ratio=settings.RETRY_BUDGET_RATIO,
+    )
+
+
+
+# Build the app-lifetime circuit breakers, one per slack endpoint
+def create_circuit_breakers(settings):
+    return CircuitBreakers(failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD, reset_timeout=settings.CIRCUIT_RESET_TIMEOUT)
+
+
+
+# Build the app-lifetime response cache, or None when caching is disabled
+def create_response_cache(settings):
+    if not settings.CACHE_ENABLED:
+        return None
+    # Entries past their stale window are never served again, so their files are deleted
+    backend = None if not settings.CACHE_BACKEND_DIR else FileCacheBackend(
+        settings.CACHE_BACKEND_DIR, max_age=settings.CACHE_TTL + settings.CACHE_STALE_TTL, max_entries=settings.CACHE_MAX_ENTRIES
+    )
+    return ResponseCache(max_entries=settings.CACHE_MAX_ENTRIES, ttl=settings.CACHE_TTL, stale_ttl=settings.CACHE_STALE_TTL, backend=backend)
+
+
+
+#A class responsible for making api call via the shared httpx client
 class APIManager:
-    def __init__(self, url, access_token=None):
+    def __init__(self, url, access_token=None, client=None, rate_limiter=None, retry_policy=None, circuit_breakers=None, cache=None):
         self.url = url
         self.access_token = access_token
-    
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.circuit_breakers = circuit_breakers
+        self.cache = cache
 
-    # Make the GET request using the requests library
-    def _get(self):
-        # Construct the Header
-        headers={"Content-Type": "application/json"}
-        #check if access_token is required
-        if self.access_token != None:
-            # Add access token to header
-            headers.update({"Authorization": "Bearer {}".format(self.access_token)})
-        try:
-            response = requests.get(self.url, headers=headers, timeout=20)
-            #Log response from slack
-            logging.info(f"Response status code: {response.status_code} - Response body: {response.text}")
-        except ConnectTimeout:
-            return "ConnectTimeout"
-        return response
 
+    # Name of the slack method being called, e.g. users.list
+    @property
+    def method(self):
+        return self.url.rstrip("/").rsplit("/", 1)[-1]
 
 
-    # Make the POST request using the requests library
-    def _post(self, body_params=None):
-        # Construct the Header
-        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    # Construct the Header
+    def _headers(self, content_type):
+        headers={"Content-Type": content_type}
         #check if access_token is required
         if self.access_token != None:
             # Add access token to header
             headers.update({"Authorization": "Bearer {}".format(self.access_token)})
+        return headers
+
+
+    # Send the request. Calls wait for the rate limiter first and are queued again when slack answers with a 429.
+    # Transport errors and 5xx responses are retried with backoff, and an open circuit breaker fails the call fast.
+    async def _send(self, method, headers, body_params=None):
+        breaker = None if self.circuit_breakers is None else self.circuit_breakers.get(self.method)
+        if self.retry_policy is not None:
+            self.retry_policy.record_call()
+        attempt = 0
+        rate_limited = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                raise SlackUnavailableError("Slack {} is failing, circuit breaker is open".format(self.method))
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(self.access_token, self.method)
+            try:
+                response = await self._request(method, headers, body_params)
+            except httpx.TransportError as e:
+                if breaker is not None:
+                    breaker.record_failure()
+                if self.retry_policy is not None and self.retry_policy.should_retry_error(e, self.method, attempt, method):
+                    attempt += 1
+                    SLACK_RETRIES.inc(self.method, "transport_error")
+                    await asyncio.sleep(self.retry_policy.backoff(attempt))
+                    continue
+                raise SlackUnavailableError("{} while calling slack {}".format(type(e).__name__, self.method)) from e
+            if response.status_code == 429:
+                SLACK_RATE_LIMITED.inc(self.method)
+            if response.status_code == 429 and self.rate_limiter is not None and rate_limited < self.rate_limiter.max_retries:
+                # Slack is up, it is just asking us to slow down
+                if breaker is not None:
+                    breaker.record_success()
+                self.rate_limiter.penalize(self.access_token, self.method, retry_after_seconds(response))
+                rate_limited += 1
+                continue
+            if response.status_code >= 500:
+                if breaker is not None:
+                    breaker.record_failure()
+                if self.retry_policy is not None and self.retry_policy.should_retry_response(response, self.method, attempt, method):
+                    attempt += 1
+                    SLACK_RETRIES.inc(self.method, "server_error")
+                    await asyncio.sleep(self.retry_policy.backoff(attempt))
+                    continue
+            elif breaker is not None:
+                breaker.record_success()
+            return response
+
+
+    # Send the request through the shared client, or a one-off client when none was given
+    async def _request(self, method, headers, body_params=None):
+        started = time.perf_counter()
         try:
-            if body_params == None:
-                response = requests.post(self.url, headers=headers, timeout=20)
+            if self.client is None:
+                async with httpx.AsyncClient(timeout=20) as client:
+                    response = await client.request(method, self.url, data=body_params, headers=headers)
             else:
-                response = requests.post(self.url, data=body_params, headers=headers, timeout=20)
-            #Log response from slack
-            logging.info(f"Response status code: {response.status_code} - Response body: {response.text}")
-        except ConnectTimeout:
-            return "ConnectTimeout"
+                response = await self.client.request(method, self.url, data=body_params, headers=headers)
+        except Exception:
+            SLACK_CALL_SECONDS.observe(time.perf_counter() - started, self.method, "error")
+            raise
+        SLACK_CALL_SECONDS.observe(time.perf_counter() - started, self.method, str(response.status_code))
+        #Log response from slack. Bodies can be large and hold user data, so only their start is logged, and only at DEBUG
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Slack {self.method} response status code: {response.status_code} - Response body: {response.text[:1000]}")
         return response
-    
 
 
+    # Make the GET request using the httpx client
+    async def _get(self):
+        return await self._send("GET", self._headers("application/json"))
+
+
+    # Make the POST request using the httpx client. Read-only slack methods are served from the response cache when one is set
+    async def _post(self, body_params=None):
+        headers = self._headers("application/x-www-form-urlencoded")
+        if self.cache is None or self.method not in CACHEABLE_METHODS:
+            return await self._send("POST", headers, body_params)
+        key = cache_key(self.access_token, self.method, body_params)
+        return await self.cache.get_or_fetch(key, lambda: self._send("POST", headers, body_params))
@@ -0,0 +1,143 @@
+import asyncio
+import collections
+import time
+import orjson
+from compact_models import CompactAppRecord
+from sync_store import record_hash
+
+
+
+#The app requests of one org, mapped to CompactAppRecords and indexed by user and by app.
+#update() diffs a fresh list against the current one, so only the app requests added, changed or removed since the
+#previous refresh touch the indexes
+class AppInventory:
+    def __init__(self):
+        # app request id -> (record, hash of the slack app request)
+        self.records = {}
+        # user_id -> {app request id: record}, and app id -> {app request id: user_id}
+        self.apps_by_user = {}
+        self.users_by_app = {}
+        self.refreshed_at = 0.0
+
+
+    def _add(self, request_id, record):
+        self.apps_by_user.setdefault(record.user_id, {})[request_id] = record
+        self.users_by_app.setdefault(record.int_name, {})[request_id] = record.user_id
+
+
+    def _remove(self, request_id, record):
+        for index, key in ((self.apps_by_user, record.user_id), (self.users_by_app, record.int_name)):
+            entries = index.get(key)
+            if entries is not None:
+                entries.pop(request_id, None)
+                if not entries:
+                    del index[key]
+
+
+    # Replace the inventory with the full list of app requests of the org. Returns (added, changed, removed)
+    def update(self, app_requests):
+        added = changed = 0
+        seen = set()
+        for app_request in app_requests:
+            request_id = app_request.get("id")
+            seen.add(request_id)
+            digest = record_hash(app_request)
+            current = self.records.get(request_id)
+            if current is not None and current[1] == digest:
+                continue
+            record = CompactAppRecord.from_app_request(app_request)
+            if current is None:
+                added += 1
+            else:
+                changed += 1
+                self._remove(request_id, current[0])
+            self.records[request_id] = (record, digest)
+            self._add(request_id, record)
+        removed = [request_id for request_id in self.records if request_id not in seen]
+        for request_id in removed:
+            self._remove(request_id, self.records.pop(request_id)[0])
+        self.refreshed_at = time.monotonic()
+        return added, changed, len(removed)
+
+
+    def apps(self):
+        return [entry[0] for entry in self.records.values()]
+
+
+    def apps_of_user(self, user_id):
+        return list(self.apps_by_user.get(user_id, {}).values())
+
+
+    # Users who requested the app, each listed once
+    def users_of_app(self, app_id):
+        return list(dict.fromkeys(self.users_by_app.get(app_id, {}).values()))
+
+
+
+#Keeps an AppInventory per (token, org), least recently used first, refreshed once older than ttl seconds.
+#Concurrent requests for a stale inventory share a single refresh
+class AppIndex:
+    def __init__(self, ttl=300.0, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.inventories = collections.OrderedDict()
+        # Locks are created lazily, so they belong to the loop serving the requests
+        self.locks = {}
+        self.refreshes = 0
+
+
+    def _fresh(self, inventory):
+        return inventory is not None and time.monotonic() - inventory.refreshed_at < self.ttl
+
+
+    # The inventory of key, refreshed first with fetch when it is stale. fetch is a coroutine function returning
+    # (app requests, error). A failed refresh leaves the inventory as it was and returns (None, error)
+    async def get(self, key, fetch):
+        inventory = self.inventories.get(key)
+        if self._fresh(inventory):
+            self.inventories.move_to_end(key)
+            return inventory, None
+        async with self.locks.setdefault(key, asyncio.Lock()):
+            inventory = self.inventories.get(key)
+            # Another request may have refreshed it while this one was waiting
+            if self._fresh(inventory):
+                return inventory, None
+            app_requests, error = await fetch()
+            if error is not None:
+                if key not in self.inventories:
+                    self.locks.pop(key, None)
+                return None, error
+            self.refreshes += 1
+            inventory = inventory or AppInventory()
+            inventory.update(app_requests)
+            self.inventories[key] = inventory
+            self.inventories.move_to_end(key)
+            while len(self.inventories) > self.max_entries:
+                evicted, _ = self.inventories.popitem(last=False)
+                self.locks.pop(evicted, None)
+            return inventory, None
+
+
+    def stats(self):
+        return {"inventories": len(self.inventories), "apps": sum(len(inventory.records) for inventory in self.inventories.values()), "refreshes": self.refreshes}
+
+
+
+# Stream the apps of each user of the inventory as NDJSON, one {"user_id", "status", "apps"} line per user, as the pages
+# of user ids come in. user_pages is an async iterator of (user ids, error), a page with an error ends the stream with
+# a {"status": false, "detail"} line. The lines of a page are sent as one chunk
+async def stream_apps_per_user(inventory, user_pages):
+    seen = set()
+    async for user_ids, error in user_pages:
+        if error is not None:
+            yield orjson.dumps({"status": False, "detail": "Get list of users failed. Reason: {}".format(error)}, option=orjson.OPT_APPEND_NEWLINE)
+            return
+        lines = []
+        for user_id in user_ids:
+            if user_id in seen:
+                continue
+            seen.add(user_id)
+            apps = [record.to_dict() for record in inventory.apps_of_user(user_id)]
+            lines.append(orjson.dumps({"user_id": user_id, "status": True, "apps": apps}, option=orjson.OPT_APPEND_NEWLINE))
+        if lines:
+            yield b"".join(lines)
@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import collections
+import sys
+import orjson
+import config
+from api_manager import APIManager, SlackUnavailableError, create_http_client, create_rate_limiter, create_retry_policy, create_circuit_breakers, create_response_cache
+from helpers import collect_pages
+
+
+
+#An async limiter handing its slots out strictly in arrival order.
+#A workspace releasing its slot after a page and asking again goes to the back of the line, behind every other
+#workspace already waiting, so a workspace with many pages cannot starve the small ones
+class FairLimiter:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.waiters = collections.deque()
+
+
+    async def acquire(self):
+        if self.in_use < self.limit and not self.waiters:
+            self.in_use += 1
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we got cancelled, pass it on
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+            raise
+
+
+    def release(self):
+        # Hand the slot straight to the next waiter, so nobody can barge in between
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_use -= 1
+
+
+    async def __aenter__(self):
+        await self.acquire()
+
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+
+#Runs the users and apps collection behind /run for many workspaces at once.
+#concurrency caps the slack calls in flight across every workspace, workspace_concurrency the ones of a single workspace,
+#and active_workspaces how many workspaces are collected, and so held in memory, at the same time.
+#Pass a shared limiter to apply the global cap across several batches, and a token health checker to skip dead tokens
+class BatchCollector:
+    def __init__(self, base_url, api_options, concurrency=20, workspace_concurrency=2, active_workspaces=50, page_limit=200, limiter=None, token_health=None):
+        self.base_url = base_url
+        self.api_options = api_options
+        self.workspace_concurrency = workspace_concurrency
+        self.active_workspaces = active_workspaces
+        self.page_limit = page_limit
+        self.limiter = FairLimiter(concurrency) if limiter is None else limiter
+        self.token_health = token_health
+
+
+    # Collect every user and app of a workspace. Apps are best effort like in /run, their error is reported next to them
+    async def collect(self, index, workspace):
+        label = workspace.get("workspace") or str(index)
+        access_token = workspace.get("access_token")
+        if self.token_health is not None and self.token_health.is_dead(access_token):
+            return {"workspace": label, "status": False, "detail": "Token is no longer valid. Reason: {}".format(self.token_health.status(access_token)[1])}
+        try:
+            users_api_manager = APIManager(url=self.base_url + "/users.list", access_token=access_token, **self.api_options)
+            apps_api_manager = APIManager(url=self.base_url + "/admin.apps.requests.list", access_token=access_token, **self.api_options)
+            workspace_limiter = asyncio.Semaphore(self.workspace_concurrency)
+
+            async def walk(api_manager, key):
+                async with workspace_limiter:
+                    return await collect_pages(api_manager, key, self.page_limit, limiter=self.limiter)
+
+            users_result, apps_result = await asyncio.gather(
+                walk(users_api_manager, "members"), walk(apps_api_manager, "app_requests"), return_exceptions=True
+            )
+            if isinstance(users_result, Exception):
+                raise users_result
+            users, error = users_result
+            if error is not None:
+                return {"workspace": label, "status": False, "detail": "Get list of users failed. Reason: {}".format(error)}
+            result = {"workspace": label, "status": True, "users": users, "apps": []}
+            if isinstance(apps_result, Exception):
+                result["apps_error"] = str(apps_result)
+            elif apps_result[1] is not None:
+                result["apps_error"] = apps_result[1]
+            else:
+                result["apps"] = apps_result[0]
+            return result
+        except SlackUnavailableError as e:
+            return {"workspace": label, "status": False, "detail": "Service unavailable: {}".format(str(e))}
+        except Exception as e:
+            return {"workspace": label, "status": False, "detail": "Internal Server Error. Reason: {}".format(str(e))}
+
+
+    # Collect every workspace and yield each result as soon as its workspace is done, whatever the input order
+    async def run(self, workspaces):
+        results = asyncio.Queue()
+        active = asyncio.Semaphore(self.active_workspaces)
+
+        async def collect_one(index, workspace):
+            async with active:
+                result = await self.collect(index, workspace)
+            results.put_nowait(result)
+
+        tasks = [asyncio.ensure_future(collect_one(index, workspace)) for index, workspace in enumerate(workspaces)]
+        try:
+            for _ in tasks:
+                yield await results.get()
+        finally:
+            # Stop collecting if the consumer went away
+            for task in tasks:
+                task.cancel()
+
+
+    # Same as run, as NDJSON lines
+    async def stream(self, workspaces):
+        async for result in self.run(workspaces):
+            yield orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE)
+
+
+
+# Command line entry point: read one {"workspace": ..., "access_token": ...} JSON object per line and write one
+# result per workspace as NDJSON, in the order they finish.
+# Run from the project root with: python -m batch_collector tokens.ndjson > results.ndjson
+async def run_cli(workspaces, output):
+    settings = config.Settings()
+    http_client = create_http_client(settings)
+    api_options = {
+        "client": http_client,
+        "rate_limiter": create_rate_limiter(settings),
+        "retry_policy": create_retry_policy(settings),
+        "circuit_breakers": create_circuit_breakers(settings),
+        "cache": create_response_cache(settings),
+    }
+    collector = BatchCollector(
+        settings.SLACK_API_BASE_URL, api_options, concurrency=settings.BATCH_CONCURRENCY, workspace_concurrency=settings.BATCH_WORKSPACE_CONCURRENCY,
+        active_workspaces=settings.BATCH_ACTIVE_WORKSPACES, page_limit=settings.BATCH_PAGE_LIMIT
+    )
+    try:
+        async for line in collector.stream(workspaces):
+            output.write(line)
+            output.flush()
+    finally:
+        await http_client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect the users and apps of many slack workspaces")
+    parser.add_argument("input", nargs="?", default="-", help="NDJSON file of workspaces, - for stdin")
+    args = parser.parse_args()
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    with source:
+        workspaces = [orjson.loads(line) for line in source if line.strip()]
+    asyncio.run(run_cli(workspaces, sys.stdout.buffer))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# Memory benchmark of holding many users.list members as records, dataclasses versus the slotted compact records.
+# Run from the project root with: python -m benchmarks.bench_record_memory
+import gc
+import tracemalloc
+import orjson
+from benchmarks.bench_users_page import slack_users_page
+from compact_models import compact_users_from_members
+from helpers import parse_get_users_page
+
+
+# Memory still allocated once build(members) returned and the parsed page was dropped, in bytes
+def retained_memory(payload, build):
+    gc.collect()
+    tracemalloc.start()
+    # Parse from bytes, like a real slack response, so every member owns its own strings and profile
+    members = orjson.loads(payload)["members"]
+    records = build(members)
+    del members
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return size
+
+
+def main():
+    print("{:>8} {:>14} {:>14} {:>16}".format("members", "dataclass KiB", "compact KiB", "projected KiB"))
+    for count in (1000, 10000, 50000):
+        payload = orjson.dumps(slack_users_page(count))
+        dataclasses = retained_memory(payload, lambda members: parse_get_users_page({"members": members}, skip_slackbot=False).users)
+        compact = retained_memory(payload, compact_users_from_members)
+        projected = retained_memory(payload, lambda members: compact_users_from_members(members, profile_fields=("title",)))
+        print("{:>8} {:>14.0f} {:>14.0f} {:>16.0f}".format(count, dataclasses / 1024, compact / 1024, projected / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# Microbenchmark of the users.list page conversion behind /get_users_page.
+# Run from the project root with: python -m benchmarks.bench_users_page
+import json
+import timeit
+from fastapi.encoders import jsonable_encoder
+from helpers import parse_get_users_page, users_page_to_json
+
+
+# Build a users.list page with the given number of members
+def slack_users_page(count):
+    members = []
+    for n in range(count):
+        members.append({
+            "id": "U{:08d}".format(n), "team_id": "T01234567", "name": "user{}".format(n), "is_admin": n % 50 == 0, "deleted": n % 20 == 0,
+            "profile": {
+                "display_name": "user{}".format(n), "first_name": "First{}".format(n), "last_name": "Last{}".format(n),
+                "email": "user{}@example.com".format(n), "title": "Engineer", "phone": "", "status_text": "", "status_emoji": "",
+                "image_72": "https://avatars.slack-edge.com/{}_72.png".format(n), "team": "T01234567",
+            },
+        })
+    return {"ok": True, "members": members, "response_metadata": {"next_cursor": "dXNlcjpVMEc5V0ZYTlo="}}
+
+
+# What /get_users_page did before: build the dataclasses, then let FastAPI encode them through response_model
+def legacy_users_page(page):
+    return json.dumps(jsonable_encoder(parse_get_users_page(page))).encode("utf-8")
+
+
+def main():
+    print("{:>8} {:>12} {:>12} {:>12}".format("members", "legacy ms", "validated ms", "trusted ms"))
+    for count in (100, 1000, 5000):
+        page = slack_users_page(count)
+        number = max(3, 2000 // count)
+        legacy = min(timeit.repeat(lambda: legacy_users_page(page), number=number, repeat=3)) / number
+        validated = min(timeit.repeat(lambda: users_page_to_json(page, validate=True), number=number, repeat=3)) / number
+        trusted = min(timeit.repeat(lambda: users_page_to_json(page), number=number, repeat=3)) / number
+        print("{:>8} {:>12.2f} {:>12.2f} {:>12.2f}".format(count, legacy * 1e3, validated * 1e3, trusted * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Microbenchmark of the slack signature verification on large event payloads.
+# Run from the project root with: python -m benchmarks.bench_verify_request
+import hashlib
+import hmac
+import json
+import time
+import timeit
+from helpers import SlackSignatureVerifier
+
+
+SIGNING_SECRET = "8f742231b10e8888abcd99yyyzzz85a5"
+
+
+# The verification as it was before SlackSignatureVerifier: a fresh key per call and the body decoded and re-encoded
+def legacy_verify_request(request_body, signature, timestamp, slack_signing_secret):
+    request_signature = "v0=" + hmac.new(
+        bytes(slack_signing_secret, "utf-8"),
+        msg=bytes(f"v0:{timestamp}:{request_body.decode('utf-8')}", "utf-8"),
+        digestmod=hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(request_signature, signature)
+
+
+# Build a signed event_callback payload of roughly the given size
+def signed_payload(size):
+    file = {"id": "F00000000", "name": "report é.pdf", "url_private": "https://files.slack.com/files-pri/T1-F1/report.pdf"}
+    count = max(1, size // len(json.dumps(file, ensure_ascii=False).encode("utf-8")))
+    body = json.dumps({"type": "event_callback", "event_id": "Ev1", "event": {"type": "message", "files": [file] * count}}, ensure_ascii=False).encode("utf-8")
+    timestamp = str(int(time.time()))
+    signature = "v0=" + hmac.new(SIGNING_SECRET.encode("utf-8"), b"v0:" + timestamp.encode("ascii") + b":" + body, hashlib.sha256).hexdigest()
+    return body, signature, timestamp
+
+
+def main():
+    verifier = SlackSignatureVerifier(SIGNING_SECRET)
+    print("{:>10} {:>14} {:>14} {:>14}".format("payload", "legacy us/req", "new us/req", "stale us/req"))
+    for size in (1024, 64 * 1024, 1024 * 1024, 8 * 1024 * 1024):
+        body, signature, timestamp = signed_payload(size)
+        assert legacy_verify_request(body, signature, timestamp, SIGNING_SECRET)
+        assert verifier.verify(body, signature, timestamp)
+        number = max(5, 20000 * 1024 // len(body))
+        legacy = min(timeit.repeat(lambda: legacy_verify_request(body, signature, timestamp, SIGNING_SECRET), number=number, repeat=3)) / number
+        new = min(timeit.repeat(lambda: verifier.verify(body, signature, timestamp), number=number, repeat=3)) / number
+        # A replayed request is rejected from its headers, whatever the size of its body
+        stale = min(timeit.repeat(lambda: verifier.check_headers(signature, "1500000000"), number=number, repeat=3)) / number
+        print("{:>10} {:>14.2f} {:>14.2f} {:>14.3f}".format(len(body), legacy * 1e6, new * 1e6, stale * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# A local stand-in for the slack api, used by the load tests and the tests that need more than a single mocked answer.
+# It serves users.list, admin.apps.requests.list, oauth.v2.access, auth.test, apps.connections.open and file downloads
+# with configurable payload sizes, latency, 429s and failures.
+# Run from the project root with: python -m benchmarks.slack_standin --port 9000 --users 5000 --latency 0.05
+import argparse
+import asyncio
+import dataclasses
+import random
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+@dataclasses.dataclass
+class StandinConfig:
+    team_id: str = "T0STANDIN"
+    # Number of members and app requests in the workspace, and page size used when the caller sends no limit
+    users: int = 1000
+    apps: int = 100
+    default_limit: int = 200
+    # Seconds added to every answer, plus up to jitter seconds at random
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Share of calls answered with a 429 and its Retry-After in seconds, and share answered with a 500
+    rate_limit_rate: float = 0.0
+    retry_after: int = 1
+    error_rate: float = 0.0
+    # Size in bytes of the downloadable files, sent in chunks of chunk_size bytes
+    file_size: int = 1024 * 1024
+    chunk_size: int = 64 * 1024
+    seed: int = 0
+    # Websocket url handed out by apps.connections.open, e.g. that of benchmarks.socket_mode_standin --serve
+    socket_url: str = "ws://127.0.0.1:9001/link"
+
+
+def standin_member(n, team_id):
+    return {
+        "id": "U{:08d}".format(n), "team_id": team_id, "name": "user{}".format(n), "deleted": n % 20 == 19, "is_admin": n % 50 == 0,
+        "profile": {
+            "display_name": "user{}".format(n), "first_name": "First{}".format(n), "last_name": "Last{}".format(n),
+            "email": "user{}@example.com".format(n), "title": "Engineer", "phone": "", "team": team_id,
+            "image_72": "https://avatars.slack-edge.com/{}_72.png".format(n),
+        },
+    }
+
+
+def standin_app_request(n, team_id):
+    return {
+        "id": "Ar{:08d}".format(n), "team": {"id": team_id}, "scopes": [{"name": "chat:write"}, {"name": "users:read"}],
+        "app": {"id": "A{:06d}".format(n % 50), "name": "App {}".format(n % 50), "is_app_directory_approved": n % 2 == 0},
+        "user": {"id": "U{:08d}".format(n % 1000), "name": "user{}".format(n % 1000), "email": "user{}@example.com".format(n % 1000)},
+        "date_created": 1600000000 + n,
+    }
+
+
+def create_standin_app(config=None):
+    config = config or StandinConfig()
+    randomizer = random.Random(config.seed)
+    # As in slack, the first member of the first page is always the slackbot
+    slackbot = dict(standin_member(0, config.team_id), id="USLACKBOT", name="slackbot", is_admin=False)
+    members = [slackbot] + [standin_member(n, config.team_id) for n in range(config.users)]
+    app_requests = [standin_app_request(n, config.team_id) for n in range(config.apps)]
+    chunk = b"x" * config.chunk_size
+    standin = FastAPI()
+    standin.state.calls = {}
+
+    # Apply the configured latency and failures, returning the failure response if the call fails
+    async def misbehave(name):
+        standin.state.calls[name] = standin.state.calls.get(name, 0) + 1
+        delay = config.latency + (randomizer.random() * config.jitter if config.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        roll = randomizer.random()
+        if roll < config.rate_limit_rate:
+            return JSONResponse({"ok": False, "error": "ratelimited"}, status_code=429, headers={"Retry-After": str(config.retry_after)})
+        if roll < config.rate_limit_rate + config.error_rate:
+            return JSONResponse({"ok": False, "error": "internal_error"}, status_code=500)
+        return None
+
+    # Slack calls send their parameters form encoded, as the APIManager does
+    async def params(request):
+        return dict(await request.form())
+
+    def page(items, key, form):
+        start = int(form.get("cursor") or 0)
+        limit = int(form.get("limit") or config.default_limit)
+        end = start + limit
+        return {"ok": True, key: items[start:end], "response_metadata": {"next_cursor": str(end) if end < len(items) else ""}}
+
+    @standin.post("/api/users.list")
+    async def users_list(request: Request):
+        return await misbehave("users.list") or JSONResponse(page(members, "members", await params(request)))
+
+    @standin.post("/api/admin.apps.requests.list")
+    async def apps_requests_list(request: Request):
+        return await misbehave("admin.apps.requests.list") or JSONResponse(page(app_requests, "app_requests", await params(request)))
+
+    @standin.post("/api/oauth.v2.access")
+    async def oauth_access(request: Request):
+        form = await params(request)
+        return await misbehave("oauth.v2.access") or JSONResponse({
+            "ok": True, "access_token": "xoxb-standin-{}".format(form.get("code", "")), "token_type": "bot", "scope": "users:read",
+            "bot_user_id": "B0STANDIN", "app_id": "A0STANDIN", "team": {"id": config.team_id, "name": "Stand-in"},
+            "authed_user": {"id": "U00000000", "scope": "admin", "access_token": "xoxp-standin", "token_type": "user"},
+        })
+
+    @standin.post("/api/auth.test")
+    async def auth_test(request: Request):
+        revoked = request.headers.get("Authorization", "").endswith("revoked")
+        return await misbehave("auth.test") or JSONResponse({"ok": False, "error": "token_revoked"} if revoked else {"ok": True, "team_id": config.team_id})
+
+    @standin.post("/api/apps.connections.open")
+    async def apps_connections_open(request: Request):
+        return await misbehave("apps.connections.open") or JSONResponse({"ok": True, "url": config.socket_url})
+
+    @standin.get("/files/{file_id}/{name}")
+    async def download(file_id: str, name: str):
+        failure = await misbehave("files")
+        if failure is not None:
+            return failure
+
+        async def body():
+            remaining = config.file_size
+            while remaining > 0:
+                yield chunk[:remaining]
+                remaining -= len(chunk)
+
+        return StreamingResponse(body(), media_type="application/octet-stream", headers={"Content-Length": str(config.file_size)})
+
+    @standin.get("/health")
+    async def health():
+        return Response(b"ok")
+
+    return standin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the slack api")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    for field in dataclasses.fields(StandinConfig):
+        parser.add_argument("--" + field.name.replace("_", "-"), type=type(field.default), default=field.default)
+    args = parser.parse_args()
+    config = StandinConfig(**{field.name: getattr(args, field.name) for field in dataclasses.fields(StandinConfig)})
+    uvicorn.run(create_standin_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
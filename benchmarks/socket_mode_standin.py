@@ -0,0 +1,136 @@
+# A local stand-in for slack's Socket Mode websocket, used by the tests and the Socket Mode throughput benchmark.
+# It says hello on every connection, spreads a fixed number of events_api envelopes over the open connections, and
+# sends envelopes that were not acked again on another connection, as slack does. With disconnect_after it asks each
+# connection to refresh after that many envelopes.
+# Run from the project root with: python -m benchmarks.socket_mode_standin --events 100000 --connections 4
+# to measure the throughput of the SocketModeClient, or add --serve to keep it running for the app itself, pointed at
+# it through benchmarks.slack_standin --socket-url.
+import argparse
+import asyncio
+import time
+import orjson
+import websockets
+from socket_mode import SocketModeClient
+
+
+def standin_event(n, team_id="T0STANDIN"):
+    return {
+        "type": "event_callback", "event_id": "EvStandin{}".format(n), "team_id": team_id, "api_app_id": "A0STANDIN",
+        "event": {"type": "message", "user": "U{:08d}".format(n % 1000), "text": "message {}".format(n), "ts": "{}.000100".format(1600000000 + n)},
+    }
+
+
+class SocketModeStandin:
+    def __init__(self, events=1000, disconnect_after=None, team_id="T0STANDIN"):
+        self.events = events
+        self.disconnect_after = disconnect_after
+        self.team_id = team_id
+        self.connections = 0
+        self.sent = 0
+        self.acked = set()
+        # Created in serve(), so they belong to the running loop
+        self.pending = None
+        self.all_acked = None
+
+
+    async def serve(self, host="127.0.0.1", port=0):
+        self.pending = asyncio.Queue()
+        for n in range(self.events):
+            self.pending.put_nowait(n)
+        self.all_acked = asyncio.Event()
+        if not self.events:
+            self.all_acked.set()
+        server = await websockets.serve(self.handle, host, port, max_size=None)
+        self.url = "ws://{}:{}/link".format(host, server.sockets[0].getsockname()[1])
+        return server
+
+
+    async def handle(self, websocket, path=None):
+        self.connections += 1
+        unacked = {}
+
+        async def read_acks():
+            async for message in websocket:
+                n = unacked.pop(orjson.loads(message).get("envelope_id"), None)
+                if n is not None:
+                    self.acked.add(n)
+                    if len(self.acked) == self.events:
+                        self.all_acked.set()
+
+        reader = asyncio.ensure_future(read_acks())
+        try:
+            await websocket.send(orjson.dumps({"type": "hello", "num_connections": self.connections}).decode("utf-8"))
+            sent_here = 0
+            while not reader.done():
+                get = asyncio.ensure_future(self.pending.get())
+                await asyncio.wait([get, reader], return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    break
+                n = get.result()
+                envelope_id = "env-{}-{}".format(n, self.sent)
+                unacked[envelope_id] = n
+                self.sent += 1
+                sent_here += 1
+                await websocket.send(orjson.dumps({"envelope_id": envelope_id, "type": "events_api", "accepts_response_payload": False, "payload": standin_event(n, self.team_id)}).decode("utf-8"))
+                if self.disconnect_after and sent_here >= self.disconnect_after:
+                    await websocket.send(orjson.dumps({"type": "disconnect", "reason": "refresh_requested"}).decode("utf-8"))
+                    # Give the client a moment to ack what it already received
+                    await asyncio.wait([reader], timeout=0.5)
+                    break
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            reader.cancel()
+            # Slack sends envelopes that were never acked again, on another connection
+            for n in unacked.values():
+                if n not in self.acked:
+                    self.pending.put_nowait(n)
+            await websocket.close()
+
+
+# Measure how many events per second the SocketModeClient acks and hands to a handler doing nothing
+async def benchmark(args):
+    standin = SocketModeStandin(args.events, args.disconnect_after)
+    server = await standin.serve()
+    handled = []
+
+    async def handler(payload):
+        handled.append(payload["event_id"])
+
+    async def open_url():
+        return standin.url
+
+    client = SocketModeClient(handler, open_url, connections=args.connections)
+    started = time.perf_counter()
+    client.start()
+    await standin.all_acked.wait()
+    elapsed = time.perf_counter() - started
+    await client.stop()
+    server.close()
+    await server.wait_closed()
+    print("{} events over {} connections in {:.2f}s: {:.0f} events/s, {} handled, {} reconnects".format(
+        args.events, args.connections, elapsed, args.events / elapsed, len(handled), client.reconnects
+    ))
+
+
+async def serve_forever(args):
+    standin = SocketModeStandin(args.events, args.disconnect_after)
+    await standin.serve(port=args.port)
+    print("Socket Mode stand-in listening on {}".format(standin.url))
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for slack's Socket Mode websocket")
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--connections", type=int, default=2, help="connections opened by the client in the benchmark")
+    parser.add_argument("--disconnect-after", type=int, default=None, help="envelopes sent on a connection before asking it to refresh")
+    parser.add_argument("--serve", action="store_true", help="keep serving instead of running the benchmark")
+    parser.add_argument("--port", type=int, default=9001)
+    args = parser.parse_args()
+    asyncio.run(serve_forever(args) if args.serve else benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
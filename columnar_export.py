@@ -0,0 +1,173 @@
+import datetime
+import io
+import logging
+import os
+import orjson
+from metrics import PHASE_SECONDS
+
+# pyarrow is in the requirements, the columnar export still answers 501 in a setup installed without it
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+# Columns of the export of users, in UserRecord order, as (arrow type, getter of the value from a users.list member and
+# its profile). Only the UserRecord fields filled from slack data are exported
+USER_COLUMNS = {
+    "org_id": ("string", lambda member, profile: member.get("team_id")),
+    "int_name": ("string", lambda member, profile: member.get("name")),
+    "user_id": ("string", lambda member, profile: member["id"]),
+    "primary_email": ("string", lambda member, profile: profile.get("email")),
+    "is_admin": ("bool", lambda member, profile: member.get("is_admin", False)),
+    "suspended": ("bool", lambda member, profile: member.get("deleted", False)),
+    "name": ("name", lambda member, profile: {
+        "givenName": profile.get("display_name") or "",
+        "familyName": profile.get("last_name") or "",
+        "fullName": (profile.get("first_name") or "") + (profile.get("last_name") or ""),
+    }),
+}
+
+# Same for the export of apps, from admin.apps.requests.list app requests, following CompactAppRecord.from_app_request
+APP_COLUMNS = {
+    "org_id": ("string", lambda app_request: (app_request.get("team") or {}).get("id")),
+    "int_name": ("string", lambda app_request: (app_request.get("app") or {}).get("id")),
+    "user_name": ("string", lambda app_request: (app_request.get("user") or {}).get("name")),
+    "user_id": ("string", lambda app_request: (app_request.get("user") or {}).get("id")),
+    "client_id": ("string", lambda app_request: (app_request.get("app") or {}).get("id")),
+    "display_text": ("string", lambda app_request: (app_request.get("app") or {}).get("name")),
+    "native_app": ("bool", lambda app_request: (app_request.get("app") or {}).get("is_internal", False)),
+    "scopes": ("strings", lambda app_request: [scope["name"] for scope in app_request.get("scopes") or ()]),
+    "is_grant_app": ("bool", lambda app_request: False),
+    "record_creation_time": ("timestamp", lambda app_request: None if app_request.get("date_created") is None else datetime.datetime.fromtimestamp(app_request["date_created"], tz=datetime.timezone.utc)),
+    "user_key": ("string", lambda app_request: (app_request.get("user") or {}).get("email")),
+    "verified": ("bool", lambda app_request: (app_request.get("app") or {}).get("is_app_directory_approved")),
+}
+
+# Prefix of the columns flattened from the profile of each user
+EXTRA_DATA_PREFIX = "extra_data."
+
+
+
+class UnknownColumnError(ValueError):
+    pass
+
+
+
+def _arrow_type(name):
+    if name == "string":
+        return pyarrow.string()
+    if name == "bool":
+        return pyarrow.bool_()
+    if name == "strings":
+        return pyarrow.list_(pyarrow.string())
+    if name == "timestamp":
+        return pyarrow.timestamp("s", tz="UTC")
+    return pyarrow.struct([("givenName", pyarrow.string()), ("familyName", pyarrow.string()), ("fullName", pyarrow.string())])
+
+
+
+# Profile values are mostly strings, the few others are kept as their JSON
+def _profile_value(value):
+    if value is None or type(value) is str:
+        return value
+    return orjson.dumps(value).decode("utf-8")
+
+
+
+#Converts pages of slack users or app requests into Arrow record batches of the chosen columns, one batch per page.
+#Users can also get some profile fields flattened into extra_data.<field> string columns
+class ColumnarConverter:
+    def __init__(self, kind="users", columns=None, profile_fields=None):
+        self.kind = kind
+        available = USER_COLUMNS if kind == "users" else APP_COLUMNS
+        columns = list(available) if columns is None else columns
+        unknown = [column for column in columns if column not in available]
+        if unknown:
+            raise UnknownColumnError("Unknown {} columns: {}".format(kind, ", ".join(unknown)))
+        if profile_fields and kind != "users":
+            raise UnknownColumnError("Profile fields only exist for users")
+        self.columns = [(column, available[column][1]) for column in columns]
+        self.profile_fields = list(profile_fields or ())
+        self.schema = pyarrow.schema(
+            [(column, _arrow_type(available[column][0])) for column in columns]
+            + [(EXTRA_DATA_PREFIX + field, pyarrow.string()) for field in self.profile_fields]
+        )
+
+
+    # Build the record batch of one page, column by column
+    def record_batch(self, items):
+        with PHASE_SECONDS.time("columnar_conversion"):
+            arrays = []
+            if self.kind == "users":
+                profiles = [member.get("profile") or {} for member in items]
+                for column, getter in self.columns:
+                    arrays.append([getter(member, profile) for member, profile in zip(items, profiles)])
+                for field in self.profile_fields:
+                    arrays.append([_profile_value(profile.get(field)) for profile in profiles])
+            else:
+                for column, getter in self.columns:
+                    arrays.append([getter(item) for item in items])
+            return pyarrow.RecordBatch.from_arrays([pyarrow.array(values, type=field.type) for values, field in zip(arrays, self.schema)], schema=self.schema)
+
+
+
+# Stream pages of (items, error), as yielded by helpers.iter_pages, as Arrow IPC. Each page is sent as soon as it is
+# converted, so memory stays bounded by one page. A page with an error ends the stream early, without the end marker
+# of the IPC stream, so readers notice the export is incomplete
+async def stream_arrow_ipc(converter, pages, skip_slackbot=False):
+    sink = io.BytesIO()
+    writer = pyarrow.ipc.new_stream(sink, converter.schema)
+    async for items, error in pages:
+        if error is not None:
+            logging.error(f"Columnar export stopped early. Reason: {error}")
+            return
+        if skip_slackbot:
+            # As in /get_users_page, the first member of the first page is always the slackbot
+            items = items[1:]
+            skip_slackbot = False
+        writer.write_batch(converter.record_batch(items))
+        yield _drain(sink)
+    writer.close()
+    yield _drain(sink)
+
+
+def _drain(sink):
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+
+# Write pages of (items, error) to a Parquet file at path, one row group per page. The file is written next to its
+# final path and moved there once complete, so readers never see a partial export. run_in_thread runs the blocking
+# Parquet writes. Returns (rows, row groups)
+async def write_parquet(converter, pages, path, run_in_thread, skip_slackbot=False):
+    partial_path = path + ".partial"
+    writer = await run_in_thread(pyarrow.parquet.ParquetWriter, partial_path, converter.schema)
+    rows = batches = 0
+    try:
+        async for items, error in pages:
+            if error is not None:
+                raise RuntimeError("Columnar export stopped early. Reason: {}".format(error))
+            if skip_slackbot:
+                items = items[1:]
+                skip_slackbot = False
+            batch = converter.record_batch(items)
+            await run_in_thread(writer.write_batch, batch)
+            rows += batch.num_rows
+            batches += 1
+        await run_in_thread(writer.close)
+        os.replace(partial_path, path)
+    except BaseException:
+        writer.close()
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return rows, batches
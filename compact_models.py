@@ -0,0 +1,198 @@
+import dataclasses
+import datetime
+import sys
+import types
+import typing
+from models import UserRecord, UserName, AppRecord
+
+
+# Shared, immutable empty defaults, so records do not each allocate their own empty containers
+EMPTY_DICT = types.MappingProxyType({})
+EMPTY_LIST = ()
+
+USER_RECORD_FIELDS = tuple(field.name for field in dataclasses.fields(UserRecord))
+APP_RECORD_FIELDS = tuple(field.name for field in dataclasses.fields(AppRecord))
+
+
+
+# Intern strings repeated across many records (team ids, app ids, scopes...) so they are stored once
+def intern_str(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+
+# Keep only the requested profile fields, or the whole profile when fields is None
+def project(profile, fields=None):
+    if not profile:
+        return EMPTY_DICT
+    if fields is None:
+        return profile
+    projected = {field: profile[field] for field in fields if field in profile}
+    return projected if projected else EMPTY_DICT
+
+
+
+# Turn a record attribute into something the JSON encoders understand
+def _plain(value):
+    if type(value) is types.MappingProxyType:
+        return dict(value)
+    if type(value) is tuple:
+        return list(value)
+    if type(value) is CompactUserName:
+        return value.to_dict()
+    return value
+
+
+
+#Slotted counterpart of models.UserName
+class CompactUserName:
+    __slots__ = ("givenName", "familyName", "fullName")
+
+    def __init__(self, givenName, familyName, fullName):
+        self.givenName = givenName
+        self.familyName = familyName
+        self.fullName = fullName
+
+
+    def to_dict(self):
+        return {"givenName": self.givenName, "familyName": self.familyName, "fullName": self.fullName}
+
+
+    def to_dataclass(self):
+        return UserName(self.givenName, self.familyName, self.fullName)
+
+
+
+#Slotted counterpart of models.UserRecord for holding many users in memory.
+#Only the fields slack actually fills get a slot, every other field is a read-only class attribute holding its default
+class CompactUserRecord:
+    __slots__ = ("org_id", "int_name", "user_id", "primary_email", "is_admin", "suspended", "name", "extra_data")
+
+    admin_extra_info = EMPTY_DICT
+    archived = False
+    org_unit_path = None
+    is_enrolled_in_2_sv = False
+    is_enforced_in_2_sv = False
+    mail_data = None
+    password_strength = None
+    emails = EMPTY_LIST
+    password_length_compliance = None
+    record_creation_time = None
+    record_last_update_time = None
+    last_login_time = None
+    creation_time = None
+    last_mail_fetch = None
+    groups = EMPTY_LIST
+    recovery_email = None
+    user_photo = None
+    int_groups = EMPTY_LIST
+
+    def __init__(self, org_id, int_name, user_id, primary_email, is_admin, suspended, name, extra_data=EMPTY_DICT):
+        self.org_id = intern_str(org_id)
+        self.int_name = int_name
+        self.user_id = user_id
+        self.primary_email = primary_email
+        self.is_admin = is_admin
+        self.suspended = suspended
+        self.name = name
+        self.extra_data = extra_data
+
+
+    # Build a record from a slack users.list member, keeping only profile_fields of the profile in extra_data when given
+    @classmethod
+    def from_member(cls, member, profile_fields=None):
+        profile = member.get("profile") or EMPTY_DICT
+        last_name = profile.get("last_name") or ""
+        return cls(
+            org_id=member.get("team_id"),
+            int_name=member.get("name"),
+            user_id=member["id"],
+            primary_email=profile.get("email"),
+            is_admin=member.get("is_admin", False),
+            suspended=member.get("deleted", False),
+            name=CompactUserName(profile.get("display_name") or "", last_name, (profile.get("first_name") or "") + last_name),
+            extra_data=project(profile, profile_fields),
+        )
+
+
+    # Same shape as the JSON of models.UserRecord
+    def to_dict(self):
+        return {field: _plain(getattr(self, field)) for field in USER_RECORD_FIELDS}
+
+
+    def to_dataclass(self):
+        values = self.to_dict()
+        values["name"] = self.name.to_dataclass()
+        return UserRecord(**values)
+
+
+
+#Slotted counterpart of models.AppRecord
+class CompactAppRecord:
+    __slots__ = APP_RECORD_FIELDS
+
+    def __init__(self, org_id, int_name, user_name, user_id, client_id, display_text, native_app, scopes, is_grant_app,
+                 record_creation_time=None, record_last_update_time=None, user_key=None, verified=None):
+        self.org_id = intern_str(org_id)
+        self.int_name = intern_str(int_name)
+        self.user_name = user_name
+        self.user_id = user_id
+        self.client_id = intern_str(client_id)
+        self.display_text = intern_str(display_text)
+        self.native_app = native_app
+        # Apps share the same few scopes, so the scope strings are interned and kept in a tuple
+        self.scopes = tuple(intern_str(scope) for scope in scopes) if scopes else EMPTY_LIST
+        self.is_grant_app = is_grant_app
+        self.record_creation_time = record_creation_time
+        self.record_last_update_time = record_last_update_time
+        self.user_key = user_key
+        self.verified = verified
+
+
+    # Map an app request of admin.apps.requests.list. Slack does not expose the client id of the app there,
+    # so the app id stands in for it
+    @classmethod
+    def from_app_request(cls, app_request):
+        app = app_request.get("app") or EMPTY_DICT
+        user = app_request.get("user") or EMPTY_DICT
+        created = app_request.get("date_created")
+        return cls(
+            org_id=(app_request.get("team") or EMPTY_DICT).get("id"),
+            int_name=app.get("id"),
+            user_name=user.get("name"),
+            user_id=user.get("id"),
+            client_id=app.get("id"),
+            display_text=app.get("name"),
+            native_app=app.get("is_internal", False),
+            scopes=[scope["name"] for scope in app_request.get("scopes") or EMPTY_LIST],
+            is_grant_app=False,
+            record_creation_time=None if created is None else datetime.datetime.fromtimestamp(created, tz=datetime.timezone.utc),
+            user_key=user.get("email"),
+            verified=app.get("is_app_directory_approved"),
+        )
+
+
+    @classmethod
+    def from_dataclass(cls, app_record):
+        return cls(*(getattr(app_record, field) for field in APP_RECORD_FIELDS))
+
+
+    # Same shape as the JSON of models.AppRecord
+    def to_dict(self):
+        return {field: _plain(getattr(self, field)) for field in APP_RECORD_FIELDS}
+
+
+    def to_dataclass(self):
+        return AppRecord(**self.to_dict())
+
+
+
+# Convert slack users.list members in bulk
+def compact_users_from_members(members, profile_fields=None) -> typing.List[CompactUserRecord]:
+    return [CompactUserRecord.from_member(member, profile_fields) for member in members]
+
+
+
+# Convert slack admin.apps.requests.list app requests in bulk
+def compact_apps_from_requests(app_requests) -> typing.List[CompactAppRecord]:
+    return [CompactAppRecord.from_app_request(app_request) for app_request in app_requests]
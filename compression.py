@@ -0,0 +1,142 @@
+import zlib
+from starlette.concurrency import run_in_threadpool
+
+# brotli is in the requirements, responses are still gzipped in a setup installed without it
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Only text formats are worth compressing, downloaded files and images already are
+COMPRESSIBLE_TYPES = (b"application/json", b"application/x-ndjson", b"text/")
+# Bodies from this size on are compressed in a worker thread, both zlib and brotli release the GIL meanwhile
+THREADED_COMPRESSION_SIZE = 256 * 1024
+
+
+
+# Pick the encoding of the response from the Accept-Encoding header, brotli first when both are accepted.
+# Returns "br", "gzip" or None
+def negotiate_encoding(accept_encoding, brotli_available=brotli is not None):
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    if brotli_available and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+
+#Incremental compressor of one response. flush() pushes out what was compressed so far, so a streamed chunk reaches
+#the client without waiting for the next one
+class _Compressor:
+    def __init__(self, encoding, gzip_level, brotli_quality):
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=brotli_quality)
+            self.compress = self.compressor.process
+            self.flush = self.compressor.flush
+            self.finish = self.compressor.finish
+        else:
+            # wbits 31 writes the gzip header and trailer
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+            self.compress = self.compressor.compress
+            self.flush = lambda: self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = self.compressor.flush
+
+
+
+#Pure ASGI middleware compressing text responses with brotli or gzip, as negotiated with Accept-Encoding.
+#Responses sent in one piece are compressed when they hold at least minimum_size bytes. Streamed responses are
+#compressed chunk by chunk, each chunk flushed as it is sent. 304s, already encoded responses and other content
+#types pass through untouched
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for name, value in scope.get("headers", ()):
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate_encoding(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        state = {"start": None, "compressor": None, "passthrough": False}
+
+        async def compressing_send(message):
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk tells whether the response is streamed
+                state["start"] = message
+                headers = message.get("headers", ())
+                content_type = b""
+                for name, value in headers:
+                    if name.lower() == b"content-encoding":
+                        state["passthrough"] = True
+                    elif name.lower() == b"content-type":
+                        content_type = value.lower()
+                if message["status"] < 200 or message["status"] in (204, 304) or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    state["passthrough"] = True
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            start = state["start"]
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                state["start"] = None
+                if state["passthrough"] or (not more_body and len(body) < self.minimum_size):
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                state["compressor"] = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                headers = [(name, value) for name, value in start.get("headers", ()) if name.lower() != b"content-length"]
+                headers.append((b"content-encoding", encoding.encode("ascii")))
+                vary = [value for name, value in headers if name.lower() == b"vary"]
+                if not vary:
+                    headers.append((b"vary", b"Accept-Encoding"))
+                elif b"accept-encoding" not in vary[0].lower():
+                    headers = [(name, value + b", Accept-Encoding" if name.lower() == b"vary" else value) for name, value in headers]
+                if not more_body:
+                    compressor = state["compressor"]
+                    if len(body) >= THREADED_COMPRESSION_SIZE:
+                        compressed = await run_in_threadpool(lambda: compressor.compress(body) + compressor.finish())
+                    else:
+                        compressed = compressor.compress(body) + compressor.finish()
+                    headers.append((b"content-length", str(len(compressed)).encode("ascii")))
+                    await send(dict(start, headers=headers))
+                    await send({"type": "http.response.body", "body": compressed, "more_body": False})
+                    return
+                await send(dict(start, headers=headers))
+            if state["passthrough"]:
+                await send(message)
+                return
+            compressor = state["compressor"]
+            if more_body:
+                chunk = compressor.compress(body) + compressor.flush()
+            else:
+                chunk = compressor.compress(body) + compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, compressing_send)
@@ -1,3 +1,4 @@
+import typing
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -13,6 +14,148 @@ class Settings(BaseSettings):
     SCOPE: str
     USER_SCOPE: str
 
-    model_config = SettingsConfigDict(env_file=".env")
+    # Seconds a signed slack request stays valid, older ones are rejected as replays
+    SLACK_REPLAY_WINDOW: int = 300
 
+    # Shared http client tuning for calls made to slack
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_TIMEOUT: float = 20.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP2_ENABLED: bool = False
 
+    # Seconds worth of calls each rate limit bucket may burst, and how many times a 429 is queued again
+    RATE_LIMIT_BURST_SECONDS: float = 10.0
+    RATE_LIMIT_MAX_RETRIES: int = 3
+
+    # Retries of failed slack calls with jittered exponential backoff, capped by a retry budget
+    RETRY_MAX_ATTEMPTS: int = 3
+    RETRY_BASE_DELAY: float = 0.2
+    RETRY_MAX_DELAY: float = 5.0
+    RETRY_BUDGET_RATIO: float = 0.2
+
+    # Consecutive failures after which a slack endpoint fails fast, and for how many seconds
+    CIRCUIT_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_RESET_TIMEOUT: float = 30.0
+
+    # Response cache for users.list and admin.apps.requests.list. Entries are fresh for CACHE_TTL seconds and then
+    # served while being refreshed for CACHE_STALE_TTL more. Set CACHE_BACKEND_DIR to share entries between workers
+    CACHE_ENABLED: bool = True
+    CACHE_MAX_ENTRIES: int = 256
+    CACHE_TTL: float = 30.0
+    CACHE_STALE_TTL: float = 60.0
+    CACHE_BACKEND_DIR: typing.Optional[str] = None
+
+    # Downloads of files shared in slack: token used for url_private, chunk size and size cap in bytes, timeout in seconds
+    SLACK_BOT_TOKEN: typing.Optional[str] = None
+    DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024
+    DOWNLOAD_MAX_SIZE: int = 1024 * 1024 * 1024
+    DOWNLOAD_TIMEOUT: float = 60.0
+    # Root of the content-addressed store for downloaded files, defaults to the media folder of the project
+    MEDIA_STORE_DIR: typing.Optional[str] = None
+
+    # Background work queue for shared files. Set WORK_QUEUE_DB to a SQLite file so queued jobs survive a restart
+    WORK_QUEUE_WORKERS: int = 4
+    WORK_QUEUE_MAXSIZE: int = 1000
+    WORK_QUEUE_ENQUEUE_TIMEOUT: float = 1.0
+    WORK_QUEUE_DRAIN_TIMEOUT: float = 5.0
+    WORK_QUEUE_DB: typing.Optional[str] = None
+    # Times a failed job is retried, with jittered exponential backoff from WORK_QUEUE_RETRY_BASE_DELAY seconds
+    WORK_QUEUE_MAX_RETRIES: int = 3
+    WORK_QUEUE_RETRY_BASE_DELAY: float = 1.0
+
+    # Index of the slack event ids already handled, set EVENT_DEDUP_DB to a SQLite file to keep it across restarts
+    EVENT_DEDUP_TTL: float = 3600.0
+    EVENT_DEDUP_MAX_ENTRIES: int = 100000
+    EVENT_DEDUP_DB: typing.Optional[str] = None
+
+    # Validate users.list pages with the precompiled TypeAdapter before serializing them, instead of trusting slack's data
+    USERS_PAGE_VALIDATE: bool = False
+
+    # Upper bound in seconds for each of the concurrent slack calls made by /run
+    RUN_CALL_TIMEOUT: float = 20.0
+
+    # SQLite file keeping the users and apps snapshot behind /sync, defaults to sync.db in the project folder,
+    # and the page size used to walk users.list and admin.apps.requests.list
+    SYNC_DB: typing.Optional[str] = None
+    SYNC_PAGE_LIMIT: int = 200
+
+    # Batch collection of many workspaces: slack calls in flight across every workspace and per workspace,
+    # workspaces collected at the same time, and page size used to walk the lists
+    BATCH_CONCURRENCY: int = 20
+    BATCH_WORKSPACE_CONCURRENCY: int = 2
+    BATCH_ACTIVE_WORKSPACES: int = 50
+    BATCH_PAGE_LIMIT: int = 200
+
+    # SQLite file keeping the token of every installation, defaults to installations.db in the project folder,
+    # and how long, in seconds, installations stay cached in memory
+    INSTALLATION_DB: typing.Optional[str] = None
+    INSTALLATION_CACHE_TTL: float = 300.0
+    INSTALLATION_CACHE_MAX_ENTRIES: int = 10000
+    # Secret callers send as X-Api-Key to use the token of a stored installation through X-Slack-Team-Id. Team ids are
+    # not secret, so installation tokens cannot be used at all while it is unset
+    SERVICE_API_KEY: typing.Optional[str] = None
+
+    # auth.test validation of the stored installations: seconds a result is trusted, seconds between two background
+    # passes (0 disables them) and auth.test calls in flight at a time
+    TOKEN_HEALTH_TTL: float = 600.0
+    TOKEN_HEALTH_INTERVAL: float = 300.0
+    TOKEN_HEALTH_CONCURRENCY: int = 10
+    # Seconds between two refreshes asked through /token_health, as each one calls auth.test for every installation
+    TOKEN_HEALTH_REFRESH_INTERVAL: float = 60.0
+
+    # In-memory index of the apps of each org behind /get_apps_per_user: seconds before it is refreshed from slack,
+    # orgs kept, and page size used to walk admin.apps.requests.list
+    APP_INDEX_TTL: float = 300.0
+    APP_INDEX_MAX_ENTRIES: int = 1000
+    APP_INDEX_PAGE_LIMIT: int = 200
+    # Slack calls in flight at a time across every /bulk_apps_per_user request
+    BULK_APPS_CONCURRENCY: int = 10
+
+    # Receive events through Socket Mode, on SOCKET_MODE_CONNECTIONS websockets opened with the app-level token
+    # SLACK_APP_TOKEN (xapp-...), as well as through /events. Failed connections are retried with jittered backoff
+    # of up to SOCKET_MODE_MAX_RECONNECT_DELAY seconds. Events whose handling failed are retried, up to
+    # SOCKET_MODE_RETRY_BUFFER_SIZE of them at a time, each up to SOCKET_MODE_RETRY_ATTEMPTS times
+    SOCKET_MODE_ENABLED: bool = False
+    SLACK_APP_TOKEN: typing.Optional[str] = None
+    SOCKET_MODE_CONNECTIONS: int = 2
+    SOCKET_MODE_MAX_RECONNECT_DELAY: float = 30.0
+    SOCKET_MODE_RETRY_BUFFER_SIZE: int = 1000
+    SOCKET_MODE_RETRY_ATTEMPTS: int = 5
+
+    # Folder the Parquet files of /export_columnar are written to, defaults to exports in the project folder
+    EXPORT_DIR: typing.Optional[str] = None
+
+    # The .env file is shared with LoggingSettings and CompressionSettings, so keys of the other classes are ignored
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+
+
+#Access log settings. They are read when the app is created, before the lifespan hook, so they live in their own
+#class with no required field
+class LoggingSettings(BaseSettings):
+    # Write one JSON line per request through the access log middleware
+    LOG_REQUESTS: bool = True
+    # Share of requests logged, server errors are always logged
+    LOG_SAMPLE_RATE: float = 1.0
+    # Share of the logged requests also logged with their redacted headers and bodies, capped to LOG_MAX_BODY_SIZE bytes
+    LOG_BODY_SAMPLE_RATE: float = 0.0
+    LOG_MAX_BODY_SIZE: int = 2048
+    # Access log lines waiting to be written, lines are dropped once the queue is full
+    LOG_QUEUE_SIZE: int = 10000
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+
+
+#Response compression settings, read when the app is created like LoggingSettings
+class CompressionSettings(BaseSettings):
+    # Compress JSON and NDJSON responses with brotli, when installed, or gzip, as accepted by the client
+    COMPRESSION_ENABLED: bool = True
+    # Responses sent in one piece and smaller than this many bytes are sent as they are
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
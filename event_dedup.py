@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import sqlite3
+import threading
+import time
+
+
+
+#Keeps the seen event ids in SQLite so duplicates are still recognised after a restart.
+#Every prune_every inserts, the expired ids are deleted and the table is capped to the max_entries latest ones,
+#so it stays as bounded as the in-memory index while the process runs
+class SQLiteEventStore:
+    def __init__(self, path, max_entries=None, prune_every=1000):
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self.inserts = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS seen_events (event_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS seen_events_expires_at ON seen_events (expires_at)")
+
+
+    def add(self, event_id, expires_at):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO seen_events (event_id, expires_at) VALUES (?, ?)", (event_id, expires_at))
+            self.inserts += 1
+            if self.inserts % self.prune_every == 0:
+                self._prune(time.time())
+
+
+    # Delete the expired ids, then the oldest ones past max_entries. Ids all share the same ttl, so the oldest expire first
+    def _prune(self, now):
+        self.connection.execute("DELETE FROM seen_events WHERE expires_at <= ?", (now,))
+        if self.max_entries is not None:
+            self.connection.execute(
+                "DELETE FROM seen_events WHERE event_id NOT IN (SELECT event_id FROM seen_events ORDER BY expires_at DESC LIMIT ?)", (self.max_entries,)
+            )
+
+
+    def prune(self, now):
+        with self.lock, self.connection:
+            self._prune(now)
+
+
+    def delete(self, event_id):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM seen_events WHERE event_id = ?", (event_id,))
+
+
+    # Drop the expired ids and those past max_entries, and return the others, oldest first
+    def load(self, now):
+        with self.lock, self.connection:
+            self._prune(now)
+            return self.connection.execute("SELECT event_id, expires_at FROM seen_events ORDER BY expires_at").fetchall()
+
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+
+#A time-bounded LRU index of the slack event ids already handled
+class EventDeduplicator:
+    def __init__(self, ttl=3600.0, max_entries=100000, store=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.store = store
+        # event_id -> expiry time, oldest first
+        self.entries = collections.OrderedDict()
+        self.duplicates = 0
+        # A single writer thread keeps the store writes in order, so a release never lands before its claim
+        self.writer = None if store is None else concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-dedup")
+        if store is not None:
+            for event_id, expires_at in store.load(time.time()):
+                self.entries[event_id] = expires_at
+            self._evict(time.time())
+
+
+    def _evict(self, now):
+        while self.entries:
+            event_id, expires_at = next(iter(self.entries.items()))
+            if expires_at > now and len(self.entries) <= self.max_entries:
+                break
+            self.entries.popitem(last=False)
+
+
+    def _persist(self, operation, *args):
+        if self.store is None:
+            return
+        # Writes happen in the writer thread so the event loop never waits on the disk
+        future = asyncio.get_event_loop().run_in_executor(self.writer, getattr(self.store, operation), *args)
+        future.add_done_callback(lambda f: f.exception() and logging.warning(f"Event dedup store write failed: {f.exception()}"))
+
+
+    # Record event_id as being handled. Returns False, without doing anything else, when it was already seen
+    def claim(self, event_id):
+        now = time.time()
+        expires_at = self.entries.get(event_id)
+        if expires_at is not None and expires_at > now:
+            self.duplicates += 1
+            return False
+        expires_at = now + self.ttl
+        self.entries[event_id] = expires_at
+        self.entries.move_to_end(event_id)
+        self._evict(now)
+        self._persist("add", event_id, expires_at)
+        return True
+
+
+    # Forget a claimed event_id whose handling failed, so slack's retry of it is processed
+    def release(self, event_id):
+        if self.entries.pop(event_id, None) is not None:
+            self._persist("delete", event_id)
+
+
+    def close(self):
+        if self.store is not None:
+            # Let the pending writes land first
+            self.writer.shutdown(wait=True)
+            self.store.close()
+
+
+    def stats(self):
+        return {"entries": len(self.entries), "duplicates": self.duplicates}
@@ -1,80 +1,407 @@
 from fastapi import HTTPException
-import requests
+from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
+import httpx
+import asyncio
+import logging
+import orjson
 import os
+import tempfile
+import dataclasses
 import hashlib
 import hmac
+import time
+from functools import lru_cache
+from pydantic import TypeAdapter
 from models import *
+from metrics import PHASE_SECONDS
 
 
 
-def verify_request(request_body, signature, timestamp, slack_signing_secret):
-    print("body{}-signature{}-timestamp{}-slack_signing_secret{}".format(request_body,signature,timestamp,slack_signing_secret))
+#Verifies the X-Slack-Signature of incoming requests.
+#The HMAC key schedule is computed once and copied per request, the body is hashed as raw bytes,
+#and requests outside the replay window are rejected from their headers alone
+class SlackSignatureVerifier:
+    def __init__(self, signing_secret, replay_window=300):
+        self.replay_window = replay_window
+        self._hmac = hmac.new(signing_secret.encode("utf-8"), digestmod=hashlib.sha256)
+
+
+    # Cheap checks on the headers, so a clearly invalid request is rejected before its body is read
+    def check_headers(self, signature, timestamp, now=None):
+        # isdigit() alone also accepts non-ASCII digits such as "\xb2", which int() rejects
+        if not signature or not timestamp or len(signature) != 67 or not signature.startswith("v0=") or not timestamp.isascii() or not timestamp.isdigit():
+            return False
+        now = time.time() if now is None else now
+        return abs(now - int(timestamp)) <= self.replay_window
+
+
+    def verify(self, request_body, signature, timestamp, now=None):
+        if not self.check_headers(signature, timestamp, now):
+            return False
+        mac = self._hmac.copy()
+        mac.update(b"v0:" + timestamp.encode("ascii") + b":")
+        mac.update(request_body)
+        return hmac.compare_digest(b"v0=" + mac.hexdigest().encode("ascii"), signature.encode("utf-8"))
+
+
+
+# One verifier per signing secret and replay window
+@lru_cache()
+def get_signature_verifier(slack_signing_secret, replay_window=300):
+    return SlackSignatureVerifier(slack_signing_secret, replay_window)
+
+
+
+def verify_request(request_body, signature, timestamp, slack_signing_secret, replay_window=300):
     # Verify that the request came from Slack
-    request_signature = "v0=" + hmac.new(
-        bytes(slack_signing_secret, "utf-8"),
-        msg=bytes(f"v0:{timestamp}:{request_body.decode('utf-8')}", "utf-8"),
-        digestmod=hashlib.sha256
-    ).hexdigest()
-    
-    return hmac.compare_digest(request_signature, signature)
+    return get_signature_verifier(slack_signing_secret, replay_window).verify(request_body, signature, timestamp)
+
+
+
+# Whether api_key is the service API key, compared in constant time. Always False while no service API key is configured
+def service_key_matches(service_api_key, api_key):
+    if not service_api_key or not api_key:
+        return False
+    return hmac.compare_digest(api_key.encode("utf-8"), service_api_key.encode("utf-8"))
 
 
 
-def download_and_save_file(file_url):
+# Stream a slack file to the media folder chunk by chunk, hashing it on the way, so memory use is bounded by chunk_size.
+# The data goes to a temp file that is only moved into place once complete. This blocks, so call it from a worker thread.
+# With a media_store the file is kept content-addressed, and a slack file id already in the store is not downloaded again
+def download_and_save_file(file_url, access_token=None, chunk_size=1024 * 1024, max_size=1024 * 1024 * 1024, timeout=60.0, media_folder=None, client=None, media_store=None, file_id=None):
+    temp_path = None
     try:
-        # Download the file
-        response = requests.get(file_url)
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to download file")
-
-        # Define the root directory of your project
-        project_root = os.path.dirname(os.path.abspath(__file__))
-
-        # Define the path to the media folder (create it if it doesn't exist)
-        media_folder = os.path.join(project_root, "media")
-        os.makedirs(media_folder, exist_ok=True)
-
-        # Define the file path within the media folder
-        file_path = os.path.join(media_folder, os.path.basename(file_url))
-
-        # Check if the response content type is an image
-        content_type = response.headers.get('content-type')
-        print(content_type)
-        if content_type and content_type.startswith('image'):
-            # Save the file to the specified path
-            with open(file_path, "wb") as f:
-                f.write(response.content)
-            return file_path
+        if media_store is not None and file_id is not None:
+            stored = media_store.get(file_id)
+            if stored is not None:
+                sha256, size, name, content_type = stored
+                return DownloadedFile(path=media_store.blob_path(sha256), sha256=sha256, size=size, content_type=content_type, file_id=file_id, already_stored=True)
+            download_folder = media_store.tmp_dir
+        else:
+            if media_folder is None:
+                # Define the root directory of your project
+                project_root = os.path.dirname(os.path.abspath(__file__))
+                # Define the path to the media folder
+                media_folder = os.path.join(project_root, "media")
+            # Create the media folder if it doesn't exist
+            os.makedirs(media_folder, exist_ok=True)
+            download_folder = media_folder
+
+        # url_private files require the token of the app
+        headers = {} if access_token is None else {"Authorization": "Bearer {}".format(access_token)}
+        http_client = httpx.Client(timeout=timeout, follow_redirects=True) if client is None else client
+        try:
+            with http_client.stream("GET", file_url, headers=headers) as response:
+                if response.status_code != 200:
+                    raise HTTPException(status_code=500, detail="Failed to download file")
+                content_length = response.headers.get("content-length")
+                if content_length is not None and content_length.isdigit() and int(content_length) > max_size:
+                    raise HTTPException(status_code=413, detail="File is larger than the {} bytes limit".format(max_size))
+                content_type = response.headers.get("content-type")
+                sha256 = hashlib.sha256()
+                size = 0
+                with tempfile.NamedTemporaryFile(dir=download_folder, suffix=".part", delete=False) as f:
+                    temp_path = f.name
+                    for chunk in response.iter_bytes(chunk_size):
+                        size += len(chunk)
+                        # Content-Length may be missing or wrong, so the cap is enforced on the bytes actually received
+                        if size > max_size:
+                            raise HTTPException(status_code=413, detail="File is larger than the {} bytes limit".format(max_size))
+                        sha256.update(chunk)
+                        f.write(chunk)
+        finally:
+            if client is None:
+                http_client.close()
+        if media_store is not None and file_id is not None:
+            file_path = media_store.add(file_id, temp_path, sha256.hexdigest(), size, name=os.path.basename(file_url), content_type=content_type)
         else:
-            # Save the file to the specified path
-            with open(file_path, "wb") as f:
-                f.write(response.content)
-            return file_path
-            raise HTTPException(status_code=400, detail="Not an image file")
+            # Define the file path within the media folder and move the complete file into place in one step
+            file_path = os.path.join(media_folder, os.path.basename(file_url))
+            os.replace(temp_path, file_path)
+        temp_path = None
+        return DownloadedFile(path=file_path, sha256=sha256.hexdigest(), size=size, content_type=content_type, file_id=file_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Never leave a partial download behind
+        if temp_path is not None and os.path.exists(temp_path):
+            os.unlink(temp_path)
     
 
 
+# Download one file shared in slack, this is the job run by the work queue workers.
+# The download blocks, so it runs in a worker thread instead of on the event loop
+async def process_file_share(settings, job, media_store=None):
+    downloaded_file = await run_in_threadpool(
+        download_and_save_file, job["file_url"], access_token=settings.SLACK_BOT_TOKEN, chunk_size=settings.DOWNLOAD_CHUNK_SIZE,
+        max_size=settings.DOWNLOAD_MAX_SIZE, timeout=settings.DOWNLOAD_TIMEOUT, media_store=media_store, file_id=job.get("file_id")
+    )
+    # Log file information
+    logging.info(
+        f"User: {job['user']} - File Size: {job['file_size']} bytes - File Type: {job['file_type']} - Timestamp: {job['timestamp']}"
+        f" - File Path: {downloaded_file.path} - SHA-256: {downloaded_file.sha256} - Already Stored: {downloaded_file.already_stored}"
+    )
+    return downloaded_file
+
+
+
 # Mapping the JSON response to the GetUsersPageRes model
-def parse_get_users_page(slack_response_json):
-    user_records = []
-    # Iterate over "members" starting from the second element (first element is always the slackbot)
-    for member in slack_response_json["members"][1:]:
-        user = UserRecord(
-            org_id=member["team_id"],
-            int_name=member["name"],
-            user_id=member["id"],
-            primary_email=None if not "email" in member["profile"] else member["profile"]["email"],
-            is_admin=member["is_admin"],
-            suspended=member["deleted"],
-            name = UserName(
-                givenName = member["profile"]["display_name"],
-                familyName = member["profile"]["last_name"],
-                fullName = member["profile"]["first_name"] + member["profile"]["last_name"]
-            ),
-            extra_data = member["profile"]
-        )
-        user_records.append(user)
-    result = GetUsersPageRes(page_token=slack_response_json["response_metadata"]["next_cursor"], users=user_records)
-    return result
+def parse_get_users_page(slack_response_json, skip_slackbot=True):
+    with PHASE_SECONDS.time("parse_get_users_page"):
+        user_records = []
+        # Iterate over "members" starting from the second element (first element of the first page is always the slackbot)
+        members = slack_response_json["members"][1:] if skip_slackbot else slack_response_json["members"]
+        for member in members:
+            profile = member.get("profile") or {}
+            user = UserRecord(
+                org_id=member.get("team_id"),
+                int_name=member.get("name"),
+                user_id=member["id"],
+                primary_email=profile.get("email"),
+                is_admin=member.get("is_admin", False),
+                suspended=member.get("deleted", False),
+                name = UserName(
+                    givenName = profile.get("display_name") or "",
+                    familyName = profile.get("last_name") or "",
+                    fullName = (profile.get("first_name") or "") + (profile.get("last_name") or "")
+                ),
+                extra_data = profile
+            )
+            user_records.append(user)
+        result = GetUsersPageRes(page_token=(slack_response_json.get("response_metadata") or {}).get("next_cursor"), users=user_records)
+        return result
+
+
+
+# Default value of every UserRecord field, in declaration order. It is the template of the bulk conversion below
+USER_RECORD_TEMPLATE = {
+    field.name: field.default_factory() if field.default_factory is not dataclasses.MISSING else None if field.default is dataclasses.MISSING else field.default
+    for field in dataclasses.fields(UserRecord)
+}
+
+# Precompiled validator and serializer of GetUsersPageRes
+users_page_adapter = TypeAdapter(GetUsersPageRes)
+
+
+
+# Bulk version of parse_get_users_page: convert slack members straight to plain dicts shaped like UserRecord,
+# without building the dataclasses. The empty defaults are shared between records, so treat the result as read-only
+def members_to_user_dicts(members):
+    template = USER_RECORD_TEMPLATE
+    users = []
+    append = users.append
+    for member in members:
+        profile = member.get("profile") or {}
+        last_name = profile.get("last_name") or ""
+        user = template.copy()
+        user["org_id"] = member.get("team_id")
+        user["int_name"] = member.get("name")
+        user["user_id"] = member["id"]
+        user["primary_email"] = profile.get("email")
+        user["is_admin"] = member.get("is_admin", False)
+        user["suspended"] = member.get("deleted", False)
+        user["name"] = {"givenName": profile.get("display_name") or "", "familyName": last_name, "fullName": (profile.get("first_name") or "") + last_name}
+        user["extra_data"] = profile
+        append(user)
+    return users
+
+
+
+# Convert a users.list response to the serialized GetUsersPageRes in one go.
+# By default slack's data is trusted and dumped with orjson, with validate the precompiled TypeAdapter checks it first
+def users_page_to_json(slack_response_json, skip_slackbot=True, validate=False):
+    members = slack_response_json["members"][1:] if skip_slackbot else slack_response_json["members"]
+    with PHASE_SECONDS.time("users_conversion"):
+        page = {
+            "users": members_to_user_dicts(members),
+            "page_token": (slack_response_json.get("response_metadata") or {}).get("next_cursor"),
+        }
+    if validate:
+        with PHASE_SECONDS.time("validation"):
+            page = users_page_adapter.validate_python(page)
+        with PHASE_SECONDS.time("serialization"):
+            return users_page_adapter.dump_json(page)
+    with PHASE_SECONDS.time("serialization"):
+        return orjson.dumps(page)
+
+
+
+# Weak ETag of a serialized response. Bodies are built from slack's data by a deterministic conversion, so the same
+# users and apps always hash the same. Weak, as the same content may be sent compressed in different encodings
+def body_etag(content):
+    return 'W/"{}"'.format(hashlib.blake2b(content, digest_size=16).hexdigest())
+
+
+
+# Whether an If-None-Match header matches the ETag, using the weak comparison of RFC 9110
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque:
+            return True
+    return False
+
+
+
+# Send the serialized body with its ETag, or an empty 304 when the client already holds the same content.
+# Pollers then only download users and apps again once they changed
+def conditional_response(request, content, media_type="application/json"):
+    etag = body_etag(content)
+    # The data is specific to the caller's token, so shared caches must not keep it, and clients must revalidate it
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+
+# Serialize app records, e.g. those of the app index, as a GetAppsRes
+def apps_to_json(app_records, page_token=None):
+    with PHASE_SECONDS.time("serialization"):
+        return orjson.dumps({"apps": [record.to_dict() for record in app_records], "page_token": page_token})
+
+
+
+# Build the users.list body params for the given cursor and page size
+def users_list_params(cursor=None, limit=None):
+    body_params = {}
+    if cursor:
+        body_params["cursor"] = cursor
+    if limit:
+        body_params["limit"] = limit
+    return body_params or None
+
+
+
+# Walk every users.list cursor starting from an already fetched first page and yield the users as NDJSON lines.
+# The next page is requested before the current one is converted, so the network call overlaps the conversion.
+async def stream_users_export(api_manager, first_page_json, limit=None):
+    response_json = first_page_json
+    skip_slackbot = True
+    next_page = None
+    try:
+        while response_json is not None:
+            cursor = response_json.get("response_metadata", {}).get("next_cursor")
+            next_page = asyncio.ensure_future(api_manager._post(users_list_params(cursor, limit))) if cursor else None
+            # Let the prefetch get on the wire before the conversion holds the event loop
+            await asyncio.sleep(0)
+            members = response_json["members"][1:] if skip_slackbot else response_json["members"]
+            skip_slackbot = False
+            with PHASE_SECONDS.time("users_conversion"):
+                users = members_to_user_dicts(members)
+            # One chunk per page rather than one per user
+            with PHASE_SECONDS.time("serialization"):
+                chunk = b"".join([orjson.dumps(user, option=orjson.OPT_APPEND_NEWLINE) for user in users])
+            yield chunk
+            response_json = None
+            if next_page is not None:
+                try:
+                    response = await next_page
+                except Exception as e:
+                    response = e
+                next_page = None
+                if isinstance(response, Exception):
+                    error = "Service unavailable: {}".format(str(response))
+                elif response.status_code != 200:
+                    error = "Slack responded with status code {}".format(response.status_code)
+                else:
+                    response_json = response.json()
+                    error = None if response_json.get("ok") == True else response_json.get("error", "")
+                if error is not None:
+                    # The response has already started, so report the failure as the last line of the stream
+                    logging.error(f"User export stopped early. Reason: {error}")
+                    yield orjson.dumps({"status": False, "detail": "Get list of users failed. Reason: {}".format(error)}, option=orjson.OPT_APPEND_NEWLINE)
+                    response_json = None
+    finally:
+        # Do not leave the prefetch running if the client went away
+        if next_page is not None:
+            next_page.cancel()
+
+
+
+# Params narrowing the slack lists of an org-wide token down to one workspace of the org. An enterprise id lists them all
+def org_params(org_id):
+    return None if not org_id or org_id.startswith("E") else {"team_id": org_id}
+
+
+
+# Walk every cursor of a paginated slack method and yield (items, error) for each page as it arrives, the items being
+# those listed under key. Each page is fetched holding limiter, an async context manager, when one is given, and sent
+# params along with the cursor. The walk stops after yielding a page with an error
+async def iter_pages(api_manager, key, limit=None, limiter=None, params=None):
+    cursor = None
+    while True:
+        body_params = dict(params or {}, **(users_list_params(cursor, limit) or {})) or None
+        if limiter is None:
+            response = await api_manager._post(body_params)
+        else:
+            async with limiter:
+                response = await api_manager._post(body_params)
+        if response.status_code != 200:
+            yield [], "Slack responded with status code {}".format(response.status_code)
+            return
+        response_json = response.json()
+        if response_json.get("ok") != True:
+            yield [], response_json.get("error", "")
+            return
+        yield response_json.get(key) or [], None
+        cursor = (response_json.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            return
+
+
+
+# Walk every cursor of a paginated slack method and collect the items listed under key.
+# Returns (items, error), error being None on success or the reason the walk stopped
+async def collect_pages(api_manager, key, limit=None, limiter=None, params=None):
+    items = []
+    async for page, error in iter_pages(api_manager, key, limit, limiter, params):
+        if error is not None:
+            return items, error
+        items.extend(page)
+    return items, None
+
+
+
+#Consumes an async iterator in a background task, up to size items ahead of the reader, so its slack calls overlap
+#whatever the reader does in the meantime. Exceptions of the iterator are raised to the reader.
+#cancel() stops the task, e.g. when the reader gives up before the end
+class Prefetcher:
+    def __init__(self, iterator, size=1):
+        self.queue = asyncio.Queue(maxsize=size)
+        self.task = asyncio.ensure_future(self._fill(iterator))
+
+
+    async def _fill(self, iterator):
+        try:
+            async for item in iterator:
+                await self.queue.put((item, None))
+            await self.queue.put((None, StopAsyncIteration()))
+        except Exception as e:
+            await self.queue.put((None, e))
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        item, error = await self.queue.get()
+        if error is not None:
+            # Keep the end marker for any later call
+            self.queue.put_nowait((None, error))
+            raise error
+        return item
+
+
+    def cancel(self):
+        self.task.cancel()
@@ -0,0 +1,139 @@
+import asyncio
+import collections
+import os
+import sqlite3
+import threading
+import time
+from models import Installation
+
+
+INSTALLATION_FIELDS = ("team_id", "app_id", "access_token", "bot_user_id", "scope", "user_id", "user_access_token", "user_scope", "installed_at")
+
+
+
+#Keeps one row per slack installation, keyed by team and app, in SQLite.
+#The file holds access tokens, so it is only readable by the owner
+class SQLiteInstallationBackend:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            os.chmod(path, 0o600)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS installations (team_id TEXT NOT NULL, app_id TEXT NOT NULL, access_token TEXT NOT NULL, "
+                "bot_user_id TEXT, scope TEXT, user_id TEXT, user_access_token TEXT, user_scope TEXT, installed_at REAL NOT NULL, "
+                "PRIMARY KEY (team_id, app_id))"
+            )
+
+
+    def get(self, team_id, app_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT {} FROM installations WHERE team_id = ? AND app_id = ?".format(", ".join(INSTALLATION_FIELDS)), (team_id, app_id)
+            ).fetchone()
+        return None if row is None else Installation(*row)
+
+
+    def save(self, installation):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO installations ({}) VALUES ({})".format(", ".join(INSTALLATION_FIELDS), ", ".join("?" * len(INSTALLATION_FIELDS))),
+                tuple(getattr(installation, field) for field in INSTALLATION_FIELDS)
+            )
+
+
+    def delete(self, team_id, app_id):
+        with self.lock, self.connection:
+            return self.connection.execute("DELETE FROM installations WHERE team_id = ? AND app_id = ?", (team_id, app_id)).rowcount > 0
+
+
+    # Whether there is at least one installation in the team and of the app, either of them matching any when None
+    def any(self, team_id=None, app_id=None):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT 1 FROM installations WHERE (? IS NULL OR team_id = ?) AND (? IS NULL OR app_id = ?) LIMIT 1", (team_id, team_id, app_id, app_id)
+            ).fetchone() is not None
+
+
+    # Every installation of the given app, or of every app when app_id is None
+    def all(self, app_id=None):
+        query = "SELECT {} FROM installations".format(", ".join(INSTALLATION_FIELDS))
+        with self.lock:
+            rows = self.connection.execute(query + " WHERE app_id = ?", (app_id,)).fetchall() if app_id is not None else self.connection.execute(query).fetchall()
+        return [Installation(*row) for row in rows]
+
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+
+#An in-memory read-through cache of the installations in front of the SQLite backend.
+#Lookups of cached installations never leave the event loop. Entries expire after ttl seconds, so an installation
+#saved or deleted by another worker process is picked up at the latest ttl seconds later
+class InstallationStore:
+    def __init__(self, backend, ttl=300.0, max_entries=10000):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (team_id, app_id) -> (installation, expiry time), least recently used first
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    async def _run_in_thread(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+    def _remember(self, key, installation):
+        self.entries[key] = (installation, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+    # The installation of the app in the team, or None when it is not installed there
+    async def get(self, team_id, app_id):
+        key = (team_id, app_id)
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+        self.misses += 1
+        installation = await self._run_in_thread(self.backend.get, team_id, app_id)
+        if installation is None:
+            # Unknown installations are not cached, so a new install by another worker is seen straight away
+            self.entries.pop(key, None)
+        else:
+            self._remember(key, installation)
+        return installation
+
+
+    async def save(self, installation):
+        await self._run_in_thread(self.backend.save, installation)
+        self._remember((installation.team_id, installation.app_id), installation)
+
+
+    async def delete(self, team_id, app_id):
+        self.entries.pop((team_id, app_id), None)
+        return await self._run_in_thread(self.backend.delete, team_id, app_id)
+
+
+    async def any(self, team_id=None, app_id=None):
+        return await self._run_in_thread(self.backend.any, team_id, app_id)
+
+
+    async def all(self, app_id=None):
+        return await self._run_in_thread(self.backend.all, app_id)
+
+
+    def close(self):
+        self.backend.close()
+
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
@@ -1,31 +1,209 @@
 from functools import lru_cache
+from contextlib import asynccontextmanager
 from fastapi import Depends, FastAPI, HTTPException, status, Request, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing_extensions import Annotated
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import config
 from models import *
 from helpers import *
-from middleware import RequestResponseLoggingMiddleware
-from api_manager import APIManager
+from middleware import RequestResponseLoggingMiddleware, create_access_logger
+from api_manager import APIManager, SlackUnavailableError, create_http_client, create_rate_limiter, create_retry_policy, create_circuit_breakers, create_response_cache
+from work_queue import WorkQueue, SQLiteJobStore, QueueFullError
+from event_dedup import EventDeduplicator, SQLiteEventStore
+from media_store import MediaStore
+from sync_store import SQLiteSnapshotStore, InvalidSyncTokenError
+from rate_limiter import token_key
+from batch_collector import BatchCollector, FairLimiter
+from installation_store import InstallationStore, SQLiteInstallationBackend
+from token_health import TokenHealthChecker
+from app_index import AppIndex, stream_apps_per_user
+from socket_mode import SocketModeClient, apps_connections_open
+from metrics import REGISTRY, PHASE_SECONDS, MetricsMiddleware, StatsGauges, http_pool_stats
+from compression import CompressionMiddleware
+import columnar_export
+from columnar_export import ColumnarConverter, UnknownColumnError, stream_arrow_ipc, write_parquet, ARROW_STREAM_MEDIA_TYPE
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
+import asyncio
+import dataclasses
+import functools
+import httpx
 import json
+import orjson
+import os
+import time
+
+
+# Open the shared, pooled http client, rate limiter, retry policy, circuit breakers and response cache on startup,
+# start the media store, the work queue processing shared files, the event dedup index, the sync snapshot store, the
+# limiter shared by batch collections, the installation store, the app index and its limiter, the token health checker
+# and the optional Socket Mode client, and close them all on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = get_settings()
+    app.state.http_client = create_http_client(settings)
+    app.state.rate_limiter = create_rate_limiter(settings)
+    app.state.retry_policy = create_retry_policy(settings)
+    app.state.circuit_breakers = create_circuit_breakers(settings)
+    app.state.response_cache = create_response_cache(settings)
+    app.state.media_store = MediaStore(settings.MEDIA_STORE_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), "media"))
+    # Clean up blobs orphaned since the last run
+    await run_in_threadpool(app.state.media_store.gc)
+    app.state.work_queue = WorkQueue(
+        functools.partial(process_file_share, settings, media_store=app.state.media_store), workers=settings.WORK_QUEUE_WORKERS, maxsize=settings.WORK_QUEUE_MAXSIZE,
+        enqueue_timeout=settings.WORK_QUEUE_ENQUEUE_TIMEOUT, store=None if not settings.WORK_QUEUE_DB else SQLiteJobStore(settings.WORK_QUEUE_DB),
+        max_retries=settings.WORK_QUEUE_MAX_RETRIES, retry_base_delay=settings.WORK_QUEUE_RETRY_BASE_DELAY
+    )
+    await app.state.work_queue.start()
+    app.state.event_dedup = EventDeduplicator(
+        ttl=settings.EVENT_DEDUP_TTL, max_entries=settings.EVENT_DEDUP_MAX_ENTRIES,
+        store=None if not settings.EVENT_DEDUP_DB else SQLiteEventStore(settings.EVENT_DEDUP_DB, max_entries=settings.EVENT_DEDUP_MAX_ENTRIES)
+    )
+    app.state.snapshot_store = SQLiteSnapshotStore(settings.SYNC_DB or os.path.join(os.path.dirname(os.path.abspath(__file__)), "sync.db"))
+    app.state.batch_limiter = FairLimiter(settings.BATCH_CONCURRENCY)
+    app.state.installation_store = InstallationStore(
+        SQLiteInstallationBackend(settings.INSTALLATION_DB or os.path.join(os.path.dirname(os.path.abspath(__file__)), "installations.db")),
+        ttl=settings.INSTALLATION_CACHE_TTL, max_entries=settings.INSTALLATION_CACHE_MAX_ENTRIES
+    )
+    app.state.app_index = AppIndex(ttl=settings.APP_INDEX_TTL, max_entries=settings.APP_INDEX_MAX_ENTRIES)
+    app.state.bulk_apps_limiter = FairLimiter(settings.BULK_APPS_CONCURRENCY)
+    app.state.token_health = TokenHealthChecker(
+        settings.SLACK_API_BASE_URL + "/auth.test", api_options_from_state(app.state), ttl=settings.TOKEN_HEALTH_TTL, concurrency=settings.TOKEN_HEALTH_CONCURRENCY
+    )
+    # Re-validate the stored installations in the background, so dead tokens are known before a request needs them
+    token_health_task = None if settings.TOKEN_HEALTH_INTERVAL <= 0 else asyncio.ensure_future(
+        app.state.token_health.run(app.state.installation_store, interval=settings.TOKEN_HEALTH_INTERVAL)
+    )
+    # Optionally receive events through Socket Mode too, handled like those posted to /events
+    app.state.socket_mode = None
+    if settings.SOCKET_MODE_ENABLED and settings.SLACK_APP_TOKEN:
+        app.state.socket_mode = SocketModeClient(
+            functools.partial(dispatch_event, app.state, settings),
+            apps_connections_open(settings.SLACK_API_BASE_URL + "/apps.connections.open", settings.SLACK_APP_TOKEN, api_options_from_state(app.state)),
+            connections=settings.SOCKET_MODE_CONNECTIONS, max_delay=settings.SOCKET_MODE_MAX_RECONNECT_DELAY,
+            retry_buffer_size=settings.SOCKET_MODE_RETRY_BUFFER_SIZE, retry_attempts=settings.SOCKET_MODE_RETRY_ATTEMPTS
+        )
+        app.state.socket_mode.start()
+    # Expose the figures of every component on /metrics, read when scraped
+    for name, documentation, stats in (
+        ("http_pool", "Pool of connections to slack", lambda: http_pool_stats(app.state.http_client)),
+        ("rate_limiter", "Slack rate limiter", app.state.rate_limiter.stats),
+        ("work_queue", "Shared file work queue", app.state.work_queue.stats),
+        ("event_dedup", "Slack event dedup index", app.state.event_dedup.stats),
+        ("installations", "Installation cache", app.state.installation_store.stats),
+        ("token_health", "Token health checks", app.state.token_health.stats),
+        ("app_index", "App inventory index", app.state.app_index.stats),
+    ) + (() if app.state.response_cache is None else (("response_cache", "Slack response cache", app.state.response_cache.stats),)) + (
+        () if app.state.socket_mode is None else (("socket_mode", "Socket Mode connections", app.state.socket_mode.stats),)
+    ):
+        REGISTRY.register(name, StatsGauges("slack_integration_" + name, documentation, stats))
+    yield
+    for name in ("http_pool", "rate_limiter", "work_queue", "event_dedup", "installations", "token_health", "app_index", "response_cache", "socket_mode"):
+        REGISTRY.unregister(name)
+    # Stop taking events before the work queue they feed is stopped
+    if app.state.socket_mode is not None:
+        await app.state.socket_mode.stop()
+    if token_health_task is not None:
+        token_health_task.cancel()
+        await asyncio.gather(token_health_task, return_exceptions=True)
+    app.state.installation_store.close()
+    app.state.snapshot_store.close()
+    await app.state.work_queue.stop(drain_timeout=settings.WORK_QUEUE_DRAIN_TIMEOUT)
+    app.state.event_dedup.close()
+    app.state.media_store.close()
+    await app.state.http_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Create an instance of HTTPBearer, the bearer token is optional as callers may reference an installation instead
+bearer = HTTPBearer(auto_error=False)
+
+
+# Add the custom middleware to the app. Compression is added first so it sits innermost, and the access log and
+# metrics see the bytes actually sent
+compression_settings = config.CompressionSettings()
+if compression_settings.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware, minimum_size=compression_settings.COMPRESSION_MIN_SIZE, gzip_level=compression_settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=compression_settings.COMPRESSION_BROTLI_QUALITY
+    )
+app.add_middleware(MetricsMiddleware)
+logging_settings = config.LoggingSettings()
+if logging_settings.LOG_REQUESTS:
+    access_logger, _ = create_access_logger(queue_size=logging_settings.LOG_QUEUE_SIZE)
+    app.add_middleware(
+        RequestResponseLoggingMiddleware, sample_rate=logging_settings.LOG_SAMPLE_RATE, body_sample_rate=logging_settings.LOG_BODY_SAMPLE_RATE,
+        max_body_size=logging_settings.LOG_MAX_BODY_SIZE, logger=access_logger
+    )
 
-app = FastAPI()
+@lru_cache()
+def get_settings():
+    return config.Settings()
 
-# Create an instance of HTTPBearer
-bearer = HTTPBearer()
 
+# Return the keyword arguments shared by every APIManager: the http client, rate limiter, retry policy, circuit breakers
+# and response cache opened by the lifespan hook. Each of them is None when the app runs without the lifespan hook
+def api_options_from_state(state):
+    return {
+        "client": getattr(state, "http_client", None),
+        "rate_limiter": getattr(state, "rate_limiter", None),
+        "retry_policy": getattr(state, "retry_policy", None),
+        "circuit_breakers": getattr(state, "circuit_breakers", None),
+        "cache": getattr(state, "response_cache", None),
+    }
 
-# Add the custom middleware to the app
-# app.add_middleware(RequestResponseLoggingMiddleware)
 
-@lru_cache()
-def get_settings():
-    return config.Settings()
+def get_api_options(request: Request):
+    return api_options_from_state(request.app.state)
+
+
+# Return the snapshot store behind /sync, None when the app runs without the lifespan hook
+def get_snapshot_store(request: Request):
+    return getattr(request.app.state, "snapshot_store", None)
+
+
+# Return the installation store opened by the lifespan hook, None when the app runs without it
+def get_installation_store(request: Request):
+    return getattr(request.app.state, "installation_store", None)
+
+
+# Return the token health checker opened by the lifespan hook, None when the app runs without it
+def get_token_health(request: Request):
+    return getattr(request.app.state, "token_health", None)
+
 
 
-# Define a boolean variable to indicate the success of the OAuth connection
-oauth_connection_successful = False
+def get_app_index(request: Request):
+    return getattr(request.app.state, "app_index", None)
+
+
+# Resolve the slack token of a call: the bearer token when one is sent, or else the token of the installation
+# referenced by the X-Slack-Team-Id header, and the X-Slack-App-Id header which defaults to our APP_ID. Team ids are
+# not secret, so installations can only be referenced by callers sending the service API key as X-Api-Key.
+# Tokens auth.test recently found dead are rejected straight away instead of failing at slack
+async def get_access_token(settings: Annotated[config.Settings, Depends(get_settings)], installation_store: Annotated[InstallationStore, Depends(get_installation_store)], token_health: Annotated[TokenHealthChecker, Depends(get_token_health)], credentials: typing.Optional[HTTPAuthorizationCredentials] = Depends(bearer), x_slack_team_id: Annotated[typing.Optional[str], Header()] = None, x_slack_app_id: Annotated[typing.Optional[str], Header()] = None, x_api_key: Annotated[typing.Optional[str], Header()] = None):
+    if credentials is not None:
+        access_token = credentials.credentials
+    elif not x_slack_team_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authenticated")
+    elif not service_key_matches(settings.SERVICE_API_KEY, x_api_key):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Referencing an installation needs a valid X-Api-Key")
+    else:
+        installation = None if installation_store is None else await installation_store.get(x_slack_team_id, x_slack_app_id or settings.APP_ID)
+        if installation is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unknown installation")
+        access_token = installation.access_token
+    if token_health is not None and token_health.is_dead(access_token):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token is no longer valid. Reason: {}".format(token_health.status(access_token)[1]))
+    return access_token
+
+
+# Reject callers not sending the service API key as X-Api-Key, for endpoints reporting on every installation
+def require_service_key(settings: Annotated[config.Settings, Depends(get_settings)], x_api_key: Annotated[typing.Optional[str], Header()] = None):
+    if not service_key_matches(settings.SERVICE_API_KEY, x_api_key):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="A valid X-Api-Key is required")
 
 
 # Build the OAuth 2.0 redirect URL with required parameters (client_id, scope, redirect_uri, etc.)
@@ -50,10 +228,8 @@ def slack_oauth_redirect(settings: Annotated[config.Settings, Depends(get_settin
 
 # Exchange the authorization code for an access token by making a POST request to Slack
 @app.get("/post_authorize", response_model=CallPostAuthorizeRes)
-def slack_oauth_callback(code: str, settings: Annotated[config.Settings, Depends(get_settings)]):
+async def slack_oauth_callback(code: str, settings: Annotated[config.Settings, Depends(get_settings)], api_options: Annotated[dict, Depends(get_api_options)], installation_store: Annotated[InstallationStore, Depends(get_installation_store)]):
     try:
-        # call the global connection variable
-        global oauth_connection_successful
         # Parameters for making the POST request to exchange the code for an access token
         token_request_data = {
             "client_id": settings.CLIENT_ID,
@@ -62,13 +238,10 @@ def slack_oauth_callback(code: str, settings: Annotated[config.Settings, Depends
             "redirect_uri": settings.REDIRECT_URL,
             "grant_type": "authorization_code",
         }
-        print(code)
         #Api manager initialization
-        api_manager = APIManager(url=settings.TOKEN_EXCHANGE_URL)
-        response = api_manager._post(token_request_data)
-        if response == "ConnectTimeout":
-            return JSONResponse(content={"status" : False, "detail" : "Service unavailable: Connection timeout while making an API call."}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        elif response.status_code == 200:
+        api_manager = APIManager(url=settings.TOKEN_EXCHANGE_URL, **api_options)
+        response = await api_manager._post(token_request_data)
+        if response.status_code == 200:
             response_json = response.json()
             # Check if slack response was successful
             if "ok" in response_json and response_json["ok"] == True:
@@ -85,14 +258,29 @@ def slack_oauth_callback(code: str, settings: Annotated[config.Settings, Depends
                         "app_id" : response_json["app_id"]
                     }
                 )
-                # Set oauth_connection_successful to True if successful
-                oauth_connection_successful = True
+                # Keep the installation, keyed by team (or enterprise for org wide installs) and app, so /verify can
+                # report it and later calls can reference it instead of sending the token
+                if installation_store is not None:
+                    authed_user = response_json.get("authed_user") or {}
+                    await installation_store.save(Installation(
+                        team_id=(response_json.get("team") or response_json.get("enterprise") or {}).get("id"),
+                        app_id=response_json["app_id"],
+                        access_token=response_json["access_token"],
+                        bot_user_id=response_json.get("bot_user_id"),
+                        scope=response_json.get("scope"),
+                        user_id=authed_user.get("id"),
+                        user_access_token=authed_user.get("access_token"),
+                        user_scope=authed_user.get("scope"),
+                        installed_at=time.time()
+                    ))
                 return result
             else:
                 error = response_json["error"] if "error" in response_json else ""
                 return JSONResponse(content={"status" : False, "detail" : "OAuth post authorization failed. Reason: {}".format(error)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
         else:
             return JSONResponse(content={"status" : False, "detail" : "OAuth post authorization failed. Please try again"}, status_code=response.status_code)
+    except SlackUnavailableError as e:
+        return JSONResponse(content={"status" : False, "detail" : "Service unavailable: {}".format(str(e))}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -101,114 +289,260 @@ def slack_oauth_callback(code: str, settings: Annotated[config.Settings, Depends
 
 #list all the users in the integration.
 @app.post("/get_users_page", response_model=GetUsersPageRes)
-def get_users_page(settings: Annotated[config.Settings, Depends(get_settings)], credentials: HTTPAuthorizationCredentials = Depends(bearer), request: GetUsersPageReq = None):
+async def get_users_page(http_request: Request, settings: Annotated[config.Settings, Depends(get_settings)], api_options: Annotated[dict, Depends(get_api_options)], access_token: Annotated[str, Depends(get_access_token)], request: GetUsersPageReq = None):
     try:
-        # Extract the token from credentials
-        access_token = credentials.credentials
         # Construct the URL
         url = settings.SLACK_API_BASE_URL + "/users.list"
         #Api manager initialization
-        api_manager = APIManager(url=url, access_token=access_token)
+        api_manager = APIManager(url=url, access_token=access_token, **api_options)
         #check if page_token is sent from the request, this logic is used to set the cursor
         if request == None:
             body_params = None
         else:
             body_params = {"cursor" : request.page_token}
         # Make the POST request to slack api to get list of users
-        response = api_manager._post(body_params)
-        if response == "ConnectTimeout":
-            return JSONResponse(content={"status" : False, "detail" : "Service unavailable: Connection timeout while making an API call."}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        elif response.status_code == 200:
+        response = await api_manager._post(body_params)
+        if response.status_code == 200:
             response_json = response.json()
             # Check if slack response was successful
             if "ok" in response_json and response_json["ok"] == True:
-                #result = GetUsersPageRes(page_token=response_json["response_metadata"]["next_cursor"], users=response_json["members"])
-                result = parse_get_users_page(response_json)
-                return result
+                # Convert and serialize the page in bulk, the bytes are sent as is instead of going through response_model again,
+                # or not at all when the caller already holds the same page
+                # Only the first page starts with the slackbot
+                first_page = body_params is None or not body_params["cursor"]
+                return conditional_response(http_request, users_page_to_json(response_json, skip_slackbot=first_page, validate=settings.USERS_PAGE_VALIDATE))
             else:
                 error = response_json["error"] if "error" in response_json else ""
                 return JSONResponse(content={"status" : False, "detail" : "OAuth post authorization failed. Reason: {}".format(error)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        elif response.status_code == 429 or response.status_code >= 500:
+            # Retries ran out on slack failing or rate limiting the call
+            return JSONResponse(content={"status" : False, "detail" : "Service unavailable: slack users.list responded with status code {}".format(response.status_code)}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
         else:
-            return JSONResponse(content={"status" : False, "details" : "Get list of users failed. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JSONResponse(content={"status" : False, "detail" : "Get list of users failed. Slack responded with status code {}".format(response.status_code)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except SlackUnavailableError as e:
+        return JSONResponse(content={"status" : False, "detail" : "Service unavailable: {}".format(str(e))}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 
 
 
-#list all apps connected to A user..
-@app.post("/get_apps_per_user", response_model=GetAppsRes)
-def get_apps_per_user(request: GetAppsReq, settings: Annotated[config.Settings, Depends(get_settings)], credentials: HTTPAuthorizationCredentials = Depends(bearer)):
+#Export every user of the workspace as NDJSON, following the slack cursors server side
+@app.post("/export_users")
+async def export_users(settings: Annotated[config.Settings, Depends(get_settings)], api_options: Annotated[dict, Depends(get_api_options)], access_token: Annotated[str, Depends(get_access_token)], request: ExportUsersReq = None):
     try:
-        # Extract the token from credentials
-        access_token = credentials.credentials
         # Construct the URL
-        url = settings.SLACK_API_BASE_URL + "/admin.apps.requests.list"
+        url = settings.SLACK_API_BASE_URL + "/users.list"
         #Api manager initialization
-        api_manager = APIManager(url=url, access_token=access_token)
-        # Make the POST request to slack api to get list of apps connected to a user
-        response = api_manager._post()
-        if response == "ConnectTimeout":
-            return JSONResponse(content={"status" : False, "detail" : "Service unavailable: Connection timeout while making an API call."}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        elif response.status_code == 200:
+        api_manager = APIManager(url=url, access_token=access_token, **api_options)
+        # The page size is passed through to slack
+        limit = None if request == None else request.limit
+        # Fetch the first page up front so errors can still be reported with a proper status code
+        response = await api_manager._post(users_list_params(limit=limit))
+        if response.status_code == 200:
             response_json = response.json()
             # Check if slack response was successful
             if "ok" in response_json and response_json["ok"] == True:
-                result = GetAppsRes(page_token=request.page_token, apps=response_json["app_requests"])
-                return result
+                return StreamingResponse(stream_users_export(api_manager, response_json, limit), media_type="application/x-ndjson")
             else:
                 error = response_json["error"] if "error" in response_json else ""
-                return JSONResponse(content={"status" : False, "detail" : "Get list of apps authorization failed. Reason: {}".format(error)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                return JSONResponse(content={"status" : False, "detail" : "Export of users failed. Reason: {}".format(error)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
         else:
-            return JSONResponse(content={"status" : False, "details" : "Get list of apps failed. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JSONResponse(content={"status" : False, "detail" : "Export of users failed. Slack responded with status code {}".format(response.status_code)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except SlackUnavailableError as e:
+        return JSONResponse(content={"status" : False, "detail" : "Service unavailable: {}".format(str(e))}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
+
+
+
+
+#Export the users or the apps of the workspace in columnar form, converted page by page into Arrow record batches.
+#"arrow" streams them as Arrow IPC, "parquet" writes them to a file under EXPORT_DIR, one row group per page
+@app.post("/export_columnar")
+async def export_columnar(request: ColumnarExportReq, settings: Annotated[config.Settings, Depends(get_settings)], api_options: Annotated[dict, Depends(get_api_options)], access_token: Annotated[str, Depends(get_access_token)]):
+    pages = None
+    try:
+        # pyarrow comes with the requirements, but may be left out of a custom install
+        if columnar_export.pyarrow is None:
+            return JSONResponse(content={"status" : False, "detail" : "Columnar export needs pyarrow, install it with pip install -r requirements.txt"}, status_code=status.HTTP_501_NOT_IMPLEMENTED)
+        if request.kind not in ("users", "apps") or request.format not in ("arrow", "parquet"):
+            return JSONResponse(content={"status" : False, "detail" : "kind must be users or apps, and format arrow or parquet"}, status_code=status.HTTP_400_BAD_REQUEST)
+        converter = ColumnarConverter(request.kind, request.columns, request.profile_fields)
+        if request.format == "parquet":
+            export_dir = os.path.realpath(settings.EXPORT_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports"))
+            path = os.path.realpath(os.path.join(export_dir, request.path or ""))
+            # Only plain files inside the export folder can be written
+            if not request.path or os.path.dirname(path) != export_dir:
+                return JSONResponse(content={"status" : False, "detail" : "path must be a file name inside the export folder"}, status_code=status.HTTP_400_BAD_REQUEST)
+        method, key = ("users.list", "members") if request.kind == "users" else ("admin.apps.requests.list", "app_requests")
+        api_manager = APIManager(url=settings.SLACK_API_BASE_URL + "/" + method, access_token=access_token, **api_options)
+        # The next page is fetched while the current one is converted
+        pages = Prefetcher(iter_pages(api_manager, key, request.limit, params=org_params(request.org_id)))
+        # Wait for the first page, so slack errors can still be reported with a proper status code
+        first_page, error = await pages.__anext__()
+        if error is not None:
+            pages.cancel()
+            return JSONResponse(content={"status" : False, "detail" : "Columnar export failed. Reason: {}".format(error)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        async def all_pages():
+            yield first_page, None
+            async for page in pages:
+                yield page
+
+        skip_slackbot = request.kind == "users"
+        if request.format == "arrow":
+            return StreamingResponse(stream_arrow_ipc(converter, all_pages(), skip_slackbot), media_type=ARROW_STREAM_MEDIA_TYPE, background=BackgroundTask(pages.cancel))
+        os.makedirs(export_dir, exist_ok=True)
+        try:
+            rows, row_groups = await write_parquet(converter, all_pages(), path, run_in_threadpool, skip_slackbot)
+        finally:
+            pages.cancel()
+        return {"status": True, "path": path, "rows": rows, "row_groups": row_groups}
+    except UnknownColumnError as e:
+        if pages is not None:
+            pages.cancel()
+        return JSONResponse(content={"status" : False, "detail" : str(e)}, status_code=status.HTTP_400_BAD_REQUEST)
+    except SlackUnavailableError as e:
+        if pages is not None:
+            pages.cancel()
+        return JSONResponse(content={"status" : False, "detail" : "Service unavailable: {}".format(str(e))}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        if pages is not None:
+            pages.cancel()
+        return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+
+#list all apps connected to A user..
+#The apps of the org come from an in-memory index walked over every admin.apps.requests.list cursor and refreshed
+#every APP_INDEX_TTL seconds, so the apps of a user are a lookup rather than a scan of the whole list
+@app.post("/get_apps_per_user", response_model=GetAppsRes)
+async def get_apps_per_user(request: GetAppsReq, settings: Annotated[config.Settings, Depends(get_settings)], api_options: Annotated[dict, Depends(get_api_options)], access_token: Annotated[str, Depends(get_access_token)], app_index: Annotated[AppIndex, Depends(get_app_index)]):
+    try:
+        # Construct the URL
+        url = settings.SLACK_API_BASE_URL + "/admin.apps.requests.list"
+        #Api manager initialization
+        api_manager = APIManager(url=url, access_token=access_token, **api_options)
+        params = org_params(request.org_id)
+        inventory, error = await (app_index or AppIndex(ttl=0)).get(
+            (token_key(access_token), request.org_id), lambda: collect_pages(api_manager, "app_requests", settings.APP_INDEX_PAGE_LIMIT, params=params)
+        )
+        if error is not None:
+            return JSONResponse(content={"status" : False, "detail" : "Get list of apps failed. Reason: {}".format(error)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        apps = inventory.apps() if request.user is None else inventory.apps_of_user(request.user.user_id)
+        return Response(content=apps_to_json(apps), media_type="application/json")
+    except SlackUnavailableError as e:
+        return JSONResponse(content={"status" : False, "detail" : "Service unavailable: {}".format(str(e))}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+
+#Apps of many users of the org at once, streamed as NDJSON, one line per user. admin.apps.requests.list cannot be
+#filtered by user, so every user is served from the same app index walk instead of one walk per user. Without user_ids,
+#users.list is walked alongside the apps and each page of users is streamed as soon as it arrives.
+#Slack calls of every bulk request share a limiter of BULK_APPS_CONCURRENCY slots
+@app.post("/bulk_apps_per_user")
+async def bulk_apps_per_user(request: BulkAppsReq, http_request: Request, settings: Annotated[config.Settings, Depends(get_settings)], api_options: Annotated[dict, Depends(get_api_options)], access_token: Annotated[str, Depends(get_access_token)], app_index: Annotated[AppIndex, Depends(get_app_index)]):
+    user_pages = None
+    try:
+        limiter = getattr(http_request.app.state, "bulk_apps_limiter", None) or FairLimiter(settings.BULK_APPS_CONCURRENCY)
+        params = org_params(request.org_id)
+        apps_api_manager = APIManager(url=settings.SLACK_API_BASE_URL + "/admin.apps.requests.list", access_token=access_token, **api_options)
+        if request.user_ids is None:
+            users_api_manager = APIManager(url=settings.SLACK_API_BASE_URL + "/users.list", access_token=access_token, **api_options)
+
+            async def member_ids():
+                async for members, error in iter_pages(users_api_manager, "members", settings.APP_INDEX_PAGE_LIMIT, limiter=limiter, params=params):
+                    yield [member["id"] for member in members if member["id"] != "USLACKBOT"], error
+
+            # Start walking the users now, so the first pages are there by the time the apps are indexed
+            user_pages = Prefetcher(member_ids(), size=2)
+        inventory, error = await (app_index or AppIndex(ttl=0)).get(
+            (token_key(access_token), request.org_id),
+            lambda: collect_pages(apps_api_manager, "app_requests", settings.APP_INDEX_PAGE_LIMIT, limiter=limiter, params=params)
+        )
+        if error is not None:
+            if user_pages is not None:
+                user_pages.cancel()
+            return JSONResponse(content={"status" : False, "detail" : "Get list of apps failed. Reason: {}".format(error)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        async def given_ids():
+            yield request.user_ids, None
+
+        async def stream():
+            try:
+                async for chunk in stream_apps_per_user(inventory, given_ids() if user_pages is None else user_pages):
+                    yield chunk
+            except SlackUnavailableError as e:
+                yield orjson.dumps({"status": False, "detail": "Service unavailable: {}".format(str(e))}, option=orjson.OPT_APPEND_NEWLINE)
+            except Exception as e:
+                # The status code is already sent, so a failure past this point ends the stream with an error line
+                yield orjson.dumps({"status": False, "detail": "Internal Server Error. Reason: {}".format(str(e))}, option=orjson.OPT_APPEND_NEWLINE)
+
+        # The users walk is stopped once the response is done, even when the client went away before it started
+        return StreamingResponse(stream(), media_type="application/x-ndjson", background=None if user_pages is None else BackgroundTask(user_pages.cancel))
+    except SlackUnavailableError as e:
+        if user_pages is not None:
+            user_pages.cancel()
+        return JSONResponse(content={"status" : False, "detail" : "Service unavailable: {}".format(str(e))}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        if user_pages is not None:
+            user_pages.cancel()
+        return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 
 
 
 #Get All Information
 @app.post("/run", response_model=GetRunRes)
-def get_apps_per_user(settings: Annotated[config.Settings, Depends(get_settings)], credentials: HTTPAuthorizationCredentials = Depends(bearer), request: GetRunReq = None):
+async def get_apps_per_user(http_request: Request, settings: Annotated[config.Settings, Depends(get_settings)], api_options: Annotated[dict, Depends(get_api_options)], access_token: Annotated[str, Depends(get_access_token)], request: GetRunReq = None):
     try:
         final_output = {}
-        # Extract the token from credentials
-        access_token = credentials.credentials
-        # Construct the URL for list of users
-        url = settings.SLACK_API_BASE_URL + "/users.list"
-        #Api manager initialization
-        api_manager = APIManager(url=url, access_token=access_token)
-        # Make the POST request to slack api to get list of users
-        response = api_manager._post()
-        if response == "ConnectTimeout":
-            return JSONResponse(content={"status" : False, "detail" : "Service unavailable: Connection timeout while making an API call."}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        #Api manager initialization for list of users and list of apps
+        users_api_manager = APIManager(url=settings.SLACK_API_BASE_URL + "/users.list", access_token=access_token, **api_options)
+        apps_api_manager = APIManager(url=settings.SLACK_API_BASE_URL + "/admin.apps.requests.list", access_token=access_token, **api_options)
+        # Both slack calls are independent, so make them concurrently, each bounded by its own timeout
+        response, apps_response = await asyncio.gather(
+            asyncio.wait_for(users_api_manager._post(), timeout=settings.RUN_CALL_TIMEOUT),
+            asyncio.wait_for(apps_api_manager._post(), timeout=settings.RUN_CALL_TIMEOUT),
+            return_exceptions=True
+        )
+        if isinstance(response, asyncio.TimeoutError):
+            raise SlackUnavailableError("Timed out while calling slack users.list")
+        elif isinstance(response, Exception):
+            raise response
         if response.status_code == 200:
             response_json = response.json()
             # Check if slack response was successful
             if "ok" in response_json and response_json["ok"] == True:
                 users=response_json["members"]
+                # The list of apps is best effort, it stays empty if that call failed for any reason
                 apps = []
-                # Construct the URL for list of apps to a specific user
-                list_of_app_url = settings.SLACK_API_BASE_URL + "/admin.apps.requests.list"
-                #re-assign url to api manager
-                api_manager.url = list_of_app_url
-                # Make the POST request to slack api to get list of apps
-                response = api_manager._post()
-                if response.status_code == 200:
-                    response_json = response.json()
-                    if "ok" in response_json and response_json["ok"] == True:
-                        apps=response_json["app_requests"]
+                if isinstance(apps_response, httpx.Response) and apps_response.status_code == 200:
+                    apps_response_json = apps_response.json()
+                    if "ok" in apps_response_json and apps_response_json["ok"] == True:
+                        apps=apps_response_json["app_requests"]
                 final_output = {
                     "users" : users,
                     "apps" : apps
                 }
-                result = GetRunRes(page_token=None if request == None else request.page_token, data=final_output)
-                return result
+                with PHASE_SECONDS.time("serialization"):
+                    content = orjson.dumps({"data": final_output, "page_token": None if request == None else request.page_token})
+                return conditional_response(http_request, content)
             else:
                 error = response_json["error"] if "error" in response_json else ""
                 return JSONResponse(content={"status" : False, "detail" : "Get list of comprehensive data failed. Reason: {}".format(error)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        elif response.status_code == 429 or response.status_code >= 500:
+            # Retries ran out on slack failing or rate limiting the call
+            return JSONResponse(content={"status" : False, "detail" : "Service unavailable: slack users.list responded with status code {}".format(response.status_code)}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
         else:
-            return JSONResponse(content={"status" : False, "details" : "Get list of comprehensive data failed. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JSONResponse(content={"status" : False, "detail" : "Get list of comprehensive data failed. Slack responded with status code {}".format(response.status_code)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except SlackUnavailableError as e:
+        return JSONResponse(content={"status" : False, "detail" : "Service unavailable: {}".format(str(e))}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -216,61 +550,235 @@ def get_apps_per_user(settings: Annotated[config.Settings, Depends(get_settings)
 
 
 
-#Verify Connection Status
+#Run the users and apps collection of /run for many workspaces, each with its own token, and stream one NDJSON line per
+#workspace as soon as it is done. Slack calls are capped across all workspaces and per workspace, and handed out in turn
+@app.post("/batch_run")
+async def batch_run(request: BatchRunReq, http_request: Request, settings: Annotated[config.Settings, Depends(get_settings)], api_options: Annotated[dict, Depends(get_api_options)]):
+    try:
+        collector = BatchCollector(
+            settings.SLACK_API_BASE_URL, api_options, concurrency=settings.BATCH_CONCURRENCY, workspace_concurrency=settings.BATCH_WORKSPACE_CONCURRENCY,
+            active_workspaces=settings.BATCH_ACTIVE_WORKSPACES, page_limit=settings.BATCH_PAGE_LIMIT,
+            # Shared by every batch, so concurrent batches stay under the same global cap
+            limiter=getattr(http_request.app.state, "batch_limiter", None), token_health=getattr(http_request.app.state, "token_health", None)
+        )
+        workspaces = [dataclasses.asdict(workspace) for workspace in request.workspaces]
+        return StreamingResponse(collector.stream(workspaces), media_type="application/x-ndjson")
+    except Exception as e:
+        return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+
+#Report the health of many stored installations at once: "healthy", "dead" (with the auth.test error) or "unknown".
+#Results of the background validation are served from the cache, set refresh to validate again right away, which is
+#allowed once every TOKEN_HEALTH_REFRESH_INTERVAL seconds. Only callers with the service API key are answered
+@app.post("/token_health", dependencies=[Depends(require_service_key)])
+async def get_token_health_report(settings: Annotated[config.Settings, Depends(get_settings)], installation_store: Annotated[InstallationStore, Depends(get_installation_store)], token_health: Annotated[TokenHealthChecker, Depends(get_token_health)], request: TokenHealthReq = None):
+    try:
+        if installation_store is None or token_health is None:
+            return JSONResponse(content={"status" : False, "detail" : "Service unavailable: the installation store is not open"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+        request = request or TokenHealthReq()
+        if request.refresh:
+            wait = token_health.claim_refresh(settings.TOKEN_HEALTH_REFRESH_INTERVAL)
+            if wait:
+                return JSONResponse(
+                    content={"status" : False, "detail" : "A refresh already ran recently, try again in {} seconds".format(int(wait) + 1)},
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS, headers={"Retry-After": str(int(wait) + 1)}
+                )
+        installations = await installation_store.all(request.app_id)
+        if request.team_ids is not None:
+            team_ids = set(request.team_ids)
+            installations = [installation for installation in installations if installation.team_id in team_ids]
+        entries = await token_health.check_many([installation.access_token for installation in installations], refresh=request.refresh)
+        report = [
+            {"team_id": installation.team_id, "app_id": installation.app_id, "health": health, "error": error, "checked_at": checked_at}
+            for installation, (health, error, checked_at) in zip(installations, entries)
+        ]
+        return {"status" : True, "installations" : report, "stats" : token_health.stats()}
+    except Exception as e:
+        return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+
+#Incremental sync: return only the users and apps added, changed and deleted since the sync token of the previous call,
+#along with the sync token to send next time. Without a sync token every user and app is returned as added
+@app.post("/sync")
+async def sync_users_and_apps(settings: Annotated[config.Settings, Depends(get_settings)], api_options: Annotated[dict, Depends(get_api_options)], snapshot_store: Annotated[SQLiteSnapshotStore, Depends(get_snapshot_store)], access_token: Annotated[str, Depends(get_access_token)], request: SyncReq = None):
+    try:
+        if snapshot_store is None:
+            return JSONResponse(content={"status" : False, "detail" : "Service unavailable: the sync snapshot store is not open"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+        sync_token = None if request == None else request.sync_token
+        #Api manager initialization for list of users and list of apps
+        users_api_manager = APIManager(url=settings.SLACK_API_BASE_URL + "/users.list", access_token=access_token, **api_options)
+        apps_api_manager = APIManager(url=settings.SLACK_API_BASE_URL + "/admin.apps.requests.list", access_token=access_token, **api_options)
+        # Walk every page of both lists concurrently, a full snapshot is needed to find the deleted records
+        users_result, apps_result = await asyncio.gather(
+            collect_pages(users_api_manager, "members", settings.SYNC_PAGE_LIMIT),
+            collect_pages(apps_api_manager, "app_requests", settings.SYNC_PAGE_LIMIT),
+            return_exceptions=True
+        )
+        if isinstance(users_result, Exception):
+            raise users_result
+        users, error = users_result
+        if error is not None:
+            return JSONResponse(content={"status" : False, "detail" : "Sync of users failed. Reason: {}".format(error)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        records = {"users": users}
+        # Apps are best effort like in /run, but when they could not be listed their snapshot is left untouched
+        # instead of reporting every app as deleted. Their changes are picked up by the next sync
+        apps_synced = not isinstance(apps_result, Exception) and apps_result[1] is None
+        if apps_synced:
+            records["apps"] = apps_result[0]
+        # The snapshot is kept per workspace, falling back to the token when slack did not send the team id
+        workspace = users[0].get("team_id") if users and users[0].get("team_id") else token_key(access_token)
+        # Hashing every record and writing the snapshot is done in a worker thread
+        new_sync_token, changes = await run_in_threadpool(snapshot_store.sync, workspace, records, sync_token)
+        result = {
+            "status" : True,
+            "sync_token" : new_sync_token,
+            "full" : sync_token is None,
+            "users" : changes["users"],
+            "apps" : changes.get("apps", {"added": [], "changed": [], "deleted": []}),
+            "apps_synced" : apps_synced
+        }
+        return Response(content=orjson.dumps(result), media_type="application/json")
+    except InvalidSyncTokenError as e:
+        return JSONResponse(content={"status" : False, "detail" : "Invalid sync token, sync again without one. Reason: {}".format(str(e))}, status_code=status.HTTP_410_GONE)
+    except SlackUnavailableError as e:
+        return JSONResponse(content={"status" : False, "detail" : "Service unavailable: {}".format(str(e))}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+
+#Verify Connection Status of an installation. team_id and app_id narrow it down, without them any installation counts
 @app.get("/verify", response_model=GetVerificationRes)
-def get_apps_per_user():
+async def verify_connection(installation_store: Annotated[InstallationStore, Depends(get_installation_store)], team_id: typing.Optional[str] = None, app_id: typing.Optional[str] = None):
     try:
-        global oauth_connection_successful
-        result = GetVerificationRes(connection_status=oauth_connection_successful)
+        if installation_store is None:
+            connection_status = False
+        elif team_id is not None and app_id is not None:
+            # Served from the in-memory cache once the installation has been looked up
+            connection_status = await installation_store.get(team_id, app_id) is not None
+        else:
+            connection_status = await installation_store.any(team_id, app_id)
+        result = GetVerificationRes(connection_status=connection_status, team_id=team_id, app_id=app_id)
         return result
     except Exception as e:
         return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 
 
+#Report the queue depth and wait time of the slack rate limiter, and the state of the circuit breakers
+@app.get("/rate_limits")
+def get_rate_limits(request: Request):
+    try:
+        rate_limiter = getattr(request.app.state, "rate_limiter", None)
+        circuit_breakers = getattr(request.app.state, "circuit_breakers", None)
+        return {
+            "status" : True,
+            "rate_limits" : {} if rate_limiter is None else rate_limiter.stats(),
+            "circuit_breakers" : {} if circuit_breakers is None else circuit_breakers.stats()
+        }
+    except Exception as e:
+        return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+#Prometheus metrics: request and slack call latencies, retries, rate limits, conversion times and component figures
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+
+#Report the queue depth and processing latency of the shared file work queue
+@app.get("/work_queue")
+def get_work_queue(request: Request):
+    try:
+        work_queue = getattr(request.app.state, "work_queue", None)
+        return {"status" : True, "work_queue" : {} if work_queue is None else work_queue.stats()}
+    except Exception as e:
+        return JSONResponse(content={"status" : False, "detail" : "Internal Server Error. Reason: {}".format(str(e))}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+# Verify the request came from Slack and return its body. A request with missing, malformed or stale
+# signature headers is rejected before its body is even read
+async def verify_slack_request(request: Request, settings: Annotated[config.Settings, Depends(get_settings)]):
+    signature = request.headers.get("X-Slack-Signature")
+    timestamp = request.headers.get("X-Slack-Request-Timestamp")
+    verifier = get_signature_verifier(settings.SIGNING_SECRET, settings.SLACK_REPLAY_WINDOW)
+    if not verifier.check_headers(signature, timestamp):
+        raise HTTPException(status_code=401, detail="Invalid request")
+    request_body = await request.body()
+    if not verifier.verify(request_body, signature, timestamp):
+        raise HTTPException(status_code=401, detail="Invalid request")
+    return request_body
+
+
+# Handle one slack event envelope, whether it came through the /events webhook or Socket Mode.
+# Events already handled are skipped. An event that could not be handled is forgotten, so that slack's retry of it is processed
+async def dispatch_event(state, settings, event_data):
+    if event_data.get("type") != "event_callback":
+        return
+    event_dedup = getattr(state, "event_dedup", None)
+    event_id = event_data.get("event_id")
+    # Slack retries (X-Slack-Retry-Num) and repeated deliveries of an event already handled are acknowledged straight away
+    if event_dedup is not None and event_id is not None and not event_dedup.claim(event_id):
+        return
+    try:
+        event = event_data.get("event")
+        '''
+        A file_share message is sent when a file is shared into a channel,
+        group or direct message. Check if the event type is a message and file is involve 
+        '''
+        if event.get("type") == "message" and "files" in event:
+            # Extract file information
+            files = event.get("files")
+            work_queue = getattr(state, "work_queue", None)
+            for file in files:
+                job = {
+                    "team_id": event_data.get("team_id"),
+                    "user": event.get("user"),
+                    "file_id": file.get("id"),
+                    "file_url": file.get("url_private"),
+                    "file_size": file.get("size"),
+                    "file_type": file.get("filetype"),
+                    "timestamp": file.get("timestamp"),
+                }
+                if work_queue is None:
+                    # Without the lifespan hook there is no work queue, so the file is processed inline
+                    await process_file_share(settings, job)
+                else:
+                    # Slack expects an answer within 3 seconds, so the download happens in the background
+                    await work_queue.put(job)
+        # Forget the installation once the app is uninstalled from the team
+        installation_store = getattr(state, "installation_store", None)
+        if event.get("type") == "app_uninstalled" and installation_store is not None:
+            await installation_store.delete(event_data.get("team_id"), event_data.get("api_app_id"))
+        # A file deleted in slack no longer holds on to its blob in the media store
+        if event.get("type") == "file_deleted" and getattr(state, "media_store", None) is not None:
+            await run_in_threadpool(state.media_store.remove, event.get("file_id"))
+    except Exception:
+        if event_dedup is not None and event_id is not None:
+            event_dedup.release(event_id)
+        raise
+
+
 #Slack Event wehook
 @app.post("/events")
-async def slack_event(request: Request, settings: Annotated[config.Settings, Depends(get_settings)]):
+async def slack_event(request: Request, settings: Annotated[config.Settings, Depends(get_settings)], request_body: Annotated[bytes, Depends(verify_slack_request)]):
     try:
-        # Verify the request came from Slack
-        signature = request.headers.get("X-Slack-Signature")
-        timestamp = request.headers.get("X-Slack-Request-Timestamp")
-        request_body = await request.body()
-        slack_signing_secret = settings.SIGNING_SECRET
-        is_valid_request = verify_request(request_body, signature, timestamp, slack_signing_secret)
-        if not is_valid_request:
-            raise HTTPException(status_code=401, detail="Invalid request")
         event_data = json.loads(request_body.decode("utf-8"))
-        event_type = event_data.get("type")
-        if event_type == "event_callback":
-            event = event_data.get("event")
-            '''
-            A file_share message is sent when a file is shared into a channel,
-            group or direct message. Check if the event type is a message and file is involve 
-            '''
-            if event.get("type") == "message" and "files" in event:
-                # Extract file information
-                files = event.get("files")
-                for file in files:
-                    user = event.get("user")
-                    file_size = file.get("size")
-                    file_type = file.get("filetype")
-                    timestamp = file.get("timestamp")
-                    # Download and save the file
-                    file_url = file.get("url_private")
-                    try:
-                        file_path = download_and_save_file(file_url)
-                    except Exception as e:
-                        raise HTTPException(status_code=500, detail=f"Error encounter while downloading and saving file due to {e}")
-                    # Print file information
-                    print(f"User: {user}")
-                    print(f"File Size: {file_size} bytes")
-                    print(f"File Type: {file_type}")
-                    print(f"Timestamp: {timestamp}")
-                    print(f"File Path: {file_path}")
-        if event_type == "url_verification":
+        if event_data.get("type") == "url_verification":
             return event_data.get("challenge")
+        await dispatch_event(request.app.state, settings, event_data)
         return {"status": "ok"}
+    except QueueFullError as e:
+        # Slack retries the event later, by which time the queue has hopefully drained
+        raise HTTPException(status_code=503, detail=f"Service unavailable due to {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error due to {e}")
     
@@ -0,0 +1,117 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+
+#A content-addressed store for downloaded slack files.
+#Each distinct content is kept once as a blob under blobs/<aa>/<bb>/<sha256>, and a SQLite index maps slack file ids
+#to blobs. Blobs are reference counted, the gc pass deletes the ones no file id points to anymore.
+#Every method blocks on the disk, so call them from a worker thread
+class MediaStore:
+    def __init__(self, root):
+        self.root = root
+        self.blobs_dir = os.path.join(root, "blobs")
+        # Downloads in progress, on the same filesystem as the blobs so they can be renamed into place
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (file_id TEXT PRIMARY KEY, sha256 TEXT NOT NULL, name TEXT, content_type TEXT, created_at REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE TABLE IF NOT EXISTS blobs (sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL, refcount INTEGER NOT NULL)")
+
+
+    # Sharded path of the blob holding the given content
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_dir, sha256[:2], sha256[2:4], sha256)
+
+
+    # Return (sha256, size, name, content_type) of a stored slack file, or None when it has not been downloaded yet
+    def get(self, file_id):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT files.sha256, blobs.size, files.name, files.content_type FROM files JOIN blobs ON files.sha256 = blobs.sha256 WHERE files.file_id = ?",
+                (file_id,)
+            ).fetchone()
+
+
+    # Move a downloaded temp file into the store and point file_id at it. Returns the blob path
+    def add(self, file_id, temp_path, sha256, size, name=None, content_type=None):
+        path = self.blob_path(sha256)
+        with self.lock, self.connection:
+            if os.path.exists(path):
+                # Same content already stored for another file id, keep the existing blob
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            previous = self.connection.execute("SELECT sha256 FROM files WHERE file_id = ?", (file_id,)).fetchone()
+            if previous is not None and previous[0] == sha256:
+                return path
+            if previous is not None:
+                self.connection.execute("UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ?", (previous[0],))
+            self.connection.execute(
+                "INSERT INTO blobs (sha256, size, refcount) VALUES (?, ?, 1) ON CONFLICT(sha256) DO UPDATE SET refcount = refcount + 1",
+                (sha256, size)
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (file_id, sha256, name, content_type, created_at) VALUES (?, ?, ?, ?, ?)",
+                (file_id, sha256, name, content_type, time.time())
+            )
+        return path
+
+
+    # Forget a slack file id, e.g. once the file was deleted in slack. Its blob is deleted by the next gc pass if unused
+    def remove(self, file_id):
+        with self.lock, self.connection:
+            previous = self.connection.execute("SELECT sha256 FROM files WHERE file_id = ?", (file_id,)).fetchone()
+            if previous is None:
+                return False
+            self.connection.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+            self.connection.execute("UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ?", (previous[0],))
+        return True
+
+
+    # Delete unreferenced blobs, blob files missing from the index and temp files left by interrupted downloads.
+    # Temp files younger than temp_max_age seconds may belong to a download in progress and are kept
+    def gc(self, temp_max_age=3600.0):
+        removed = 0
+        with self.lock, self.connection:
+            unused = [row[0] for row in self.connection.execute("SELECT sha256 FROM blobs WHERE refcount <= 0")]
+            self.connection.executemany("DELETE FROM blobs WHERE sha256 = ?", [(sha256,) for sha256 in unused])
+            known = set(row[0] for row in self.connection.execute("SELECT sha256 FROM blobs"))
+            for directory, _, names in os.walk(self.blobs_dir):
+                for name in names:
+                    if name not in known:
+                        os.unlink(os.path.join(directory, name))
+                        removed += 1
+        now = time.time()
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            try:
+                if now - os.path.getmtime(path) > temp_max_age:
+                    os.unlink(path)
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            logging.info(f"Media store gc removed {removed} files")
+        return removed
+
+
+    def stats(self):
+        with self.lock:
+            files = self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            blobs, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"files": files, "blobs": blobs, "bytes": size}
+
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,216 @@
+import bisect
+import time
+
+
+#Minimal Prometheus metrics, kept per worker process.
+#Metrics are only updated from the event loop thread, so recording one is a dict lookup and an addition, without locks.
+#With several uvicorn workers each of them reports its own figures
+
+# Latency buckets in seconds, from sub-millisecond conversions to slow slack calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(extra[0], extra[1]))
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} counter".format(self.name)]
+        for labels, value in list(self.values.items()):
+            lines.append("{}{} {}".format(self.name, _format_labels(self.labelnames, labels), _format_value(value)))
+        return lines
+
+
+
+#Times the block it wraps and records the duration in a histogram
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self.values = {}
+
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} histogram".format(self.name)]
+        for labels, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(self.name, _format_labels(self.labelnames, labels, ("le", _format_value(bound))), cumulative))
+            lines.append("{}_sum{} {}".format(self.name, _format_labels(self.labelnames, labels), _format_value(total)))
+            lines.append("{}_count{} {}".format(self.name, _format_labels(self.labelnames, labels), cumulative))
+        return lines
+
+
+
+#Gauges read at scrape time from a function returning {metric suffix: number}, e.g. the stats() of a component
+class StatsGauges:
+    def __init__(self, prefix, documentation, stats_func):
+        self.prefix = prefix
+        self.documentation = documentation
+        self.stats_func = stats_func
+
+
+    def render(self):
+        lines = []
+        for key, value in self.stats_func().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = "{}_{}".format(self.prefix, key)
+            lines.extend(["# HELP {} {} {}".format(name, self.documentation, key), "# TYPE {} gauge".format(name), "{} {}".format(name, _format_value(value))])
+        return lines
+
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+
+    def register(self, name, metric):
+        # Registering the same name again replaces the metric, e.g. when the app starts again in tests
+        self.metrics[name] = metric
+        return metric
+
+
+    def unregister(self, name):
+        self.metrics.pop(name, None)
+
+
+    # Prometheus text exposition format, version 0.0.4
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # A component closed while being scraped must not fail the whole scrape
+                continue
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register("http_request", Histogram(
+    "slack_integration_http_request_duration_seconds", "Time spent serving requests, per route", ("method", "route", "status")
+))
+SLACK_CALL_SECONDS = REGISTRY.register("slack_call", Histogram(
+    "slack_integration_slack_call_duration_seconds", "Latency of each call made to slack, per method and status", ("method", "status")
+))
+SLACK_RETRIES = REGISTRY.register("slack_retries", Counter(
+    "slack_integration_slack_retries_total", "Slack calls sent again after a transport error or a 5xx", ("method", "reason")
+))
+SLACK_RATE_LIMITED = REGISTRY.register("slack_rate_limited", Counter(
+    "slack_integration_slack_rate_limited_total", "Slack calls answered with a 429 and queued again", ("method",)
+))
+PHASE_SECONDS = REGISTRY.register("phase", Histogram(
+    "slack_integration_phase_duration_seconds", "Time spent converting and serializing slack data, per phase", ("phase",)
+))
+
+
+
+# Connections of the pool of an httpx client. Reads httpcore internals, so it reports nothing if they change
+def http_pool_stats(client):
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {"connections": len(connections), "idle_connections": idle, "active_connections": len(connections) - idle}
+
+
+
+#Pure ASGI middleware recording the latency of every request in HTTP_REQUEST_SECONDS.
+#Requests are labelled with the path template of their route, so path parameters do not multiply the series
+class MetricsMiddleware:
+    def __init__(self, app, histogram=HTTP_REQUEST_SECONDS):
+        self.app = app
+        self.histogram = histogram
+        self.routes = None
+
+
+    def _route(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self.routes is None:
+            self.routes = {getattr(route, "endpoint", None): route.path for route in getattr(scope.get("app"), "routes", [])}
+        return self.routes.get(endpoint, "unmatched")
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        state = {"status": 500}
+
+        async def measured_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, measured_send)
+        finally:
+            # Streaming responses are measured until their last chunk was sent
+            self.histogram.observe(time.perf_counter() - started, scope["method"], self._route(scope), str(state["status"]))
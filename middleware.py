@@ -1,46 +1,155 @@
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+import atexit
 import logging
-import json  # Import the json module for parsing JSON
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+import orjson
+from urllib.parse import parse_qsl, urlencode
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Custom middleware for logging requests and responses
-class RequestResponseLoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(
-        self, request, call_next: RequestResponseEndpoint
-    ):
-        # Log the incoming request
-        logging.info(f"Incoming Request: {request.method} {request.url}")
-        logging.info(f"Headers: {request.headers}")
-
-        # Check if the request has a body
-        if hasattr(request, 'body'):
-            request_body = await request.body()
-            if request_body:
-                try:
-                    # Parse the JSON request body
-                    json_data = json.loads(request_body.decode('utf-8'))
-                    logging.info(f"JSON Body: {json_data}")
-                except json.JSONDecodeError:
-                    logging.info("Body: (Not JSON)")
-
-        # Call the next middleware or route handler
-        response = await call_next(request)
-
-        # Log the outgoing response
-        logging.info(f"Outgoing Response: {response.status_code}")
-        logging.info(f"Headers: {response.headers}")
-
-        # Check if the response has a body
-        if hasattr(response, 'body'):
-            response_body = await response.body()
-            if response_body:
-                # Assuming the response is also JSON
-                try:
-                    json_data = json.loads(response_body.decode('utf-8'))
-                    logging.info(f"JSON Response Body: {json_data}")
-                except json.JSONDecodeError:
-                    logging.info("Response Body: (Not JSON)")
-
-        return response
\ No newline at end of file
+
+# Headers never written to the logs as they are, including those picking or unlocking a stored installation token
+REDACTED_HEADERS = {"authorization", "cookie", "set-cookie", "x-slack-signature", "proxy-authorization", "x-api-key", "x-slack-team-id", "x-slack-app-id"}
+# Query parameters and JSON keys holding secrets
+REDACTED_FIELDS = {"code", "token", "access_token", "client_secret", "refresh_token", "user_access_token"}
+# Slack tokens anywhere in a captured body
+SLACK_TOKEN_PATTERN = re.compile(rb"xox[abposre]-[A-Za-z0-9-]+")
+SECRET_FIELD_PATTERN = re.compile(rb'("(?:' + b"|".join(field.encode() for field in REDACTED_FIELDS) + rb')"\s*:\s*)"[^"]*"')
+REDACTED = "[redacted]"
+REDACTED_HEADERS_BYTES = {name.encode() for name in REDACTED_HEADERS}
+
+
+
+#A QueueHandler dropping records rather than blocking, or raising, when its queue is full
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+
+# Build the access logger: request handlers only put records on a bounded queue, a background thread formats them
+# and writes them to stderr, so a slow log sink never holds the event loop
+def create_access_logger(name="access", queue_size=10000, stream=None):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    logger.handlers = [handler]
+    listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(listener.stop)
+    return logger, listener
+
+
+
+def redact_headers(headers):
+    return {
+        name.decode("latin-1"): REDACTED if name.lower() in REDACTED_HEADERS_BYTES else value.decode("latin-1")
+        for name, value in headers
+    }
+
+
+def redact_query(query_string):
+    if not query_string:
+        return ""
+    params = parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)
+    return urlencode([(key, REDACTED if key in REDACTED_FIELDS else value) for key, value in params])
+
+
+
+# Decode a captured body for the logs, with slack tokens and secret JSON fields masked
+def redact_body(body):
+    body = SLACK_TOKEN_PATTERN.sub(b"xox?-" + REDACTED.encode(), body)
+    body = SECRET_FIELD_PATTERN.sub(rb'\1"' + REDACTED.encode() + b'"', body)
+    return body.decode("utf-8", errors="replace")
+
+
+
+#Pure ASGI middleware writing one JSON line per request to the access logger.
+#sample_rate is the share of requests logged, server errors are always logged. body_sample_rate is the share of them
+#logged along with their headers and the first max_body_size bytes of both bodies. Bodies are copied as they pass
+#through, so nothing is buffered and streaming responses keep streaming
+class RequestResponseLoggingMiddleware:
+    def __init__(self, app, sample_rate=1.0, body_sample_rate=0.0, max_body_size=2048, logger=None):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.body_sample_rate = body_sample_rate
+        self.max_body_size = max_body_size
+        self.logger = logger or logging.getLogger("access")
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        capture = sampled and self.body_sample_rate > 0 and (self.body_sample_rate >= 1.0 or random.random() < self.body_sample_rate)
+        state = {"status": None, "response_headers": (), "request_bytes": 0, "response_bytes": 0}
+        request_body = bytearray()
+        response_body = bytearray()
+        max_body_size = self.max_body_size
+
+        async def logged_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                state["request_bytes"] += len(chunk)
+                if capture and len(request_body) < max_body_size:
+                    request_body.extend(chunk[:max_body_size - len(request_body)])
+            return message
+
+        async def logged_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["response_headers"] = message.get("headers", ())
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                state["response_bytes"] += len(chunk)
+                if capture and len(response_body) < max_body_size:
+                    response_body.extend(chunk[:max_body_size - len(response_body)])
+            await send(message)
+
+        try:
+            await self.app(scope, logged_receive, logged_send)
+        except Exception:
+            state["status"] = 500
+            raise
+        finally:
+            status = state["status"]
+            if sampled or status is None or status >= 500:
+                line = {
+                    "ts": time.time(),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": redact_query(scope.get("query_string")),
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                    "request_bytes": state["request_bytes"],
+                    "response_bytes": state["response_bytes"],
+                    "client": (scope.get("client") or (None,))[0],
+                }
+                if capture:
+                    line["request_headers"] = redact_headers(scope.get("headers", ()))
+                    line["response_headers"] = redact_headers(state["response_headers"])
+                    line["request_body"] = redact_body(bytes(request_body))
+                    line["response_body"] = redact_body(bytes(response_body))
+                    line["truncated"] = state["request_bytes"] > max_body_size or state["response_bytes"] > max_body_size
+                self.logger.info(orjson.dumps(line).decode("utf-8"))
@@ -22,6 +22,12 @@ class GetUsersPageReq:
 
 
 
+@dataclass
+class ExportUsersReq:
+    limit: typing.Optional[int] = None
+
+
+
 @dataclass
 class UserMailData:
     is_enabled: typing.Optional[bool] = None
@@ -66,16 +72,16 @@ class UserRecord:
     org_id: str
     int_name: str
     user_id: str
-    primary_email: str
+    primary_email: typing.Optional[str]
     is_admin: bool
     suspended: bool
     name: UserName
     admin_extra_info: typing.Dict = dataclasses.field(default_factory=dict)
     archived: bool = False
-    org_unit_path: str = None
+    org_unit_path: typing.Optional[str] = None
     is_enrolled_in_2_sv: bool = False
     is_enforced_in_2_sv: bool = False
-    mail_data: UserMailData = None
+    mail_data: typing.Optional[UserMailData] = None
     password_strength: typing.Optional[str] = None
     emails: typing.List[UserEmail] = dataclasses.field(default_factory=list)
     password_length_compliance: typing.Optional[str] = None
@@ -130,6 +136,28 @@ class GetAppsRes:
     page_token: typing.Optional[str] = None
 
 
+@dataclass
+class BulkAppsReq:
+    org_id: str
+    # Every member of users.list when None
+    user_ids: typing.Optional[typing.List[str]] = None
+
+
+@dataclass
+class ColumnarExportReq:
+    # "users" or "apps"
+    kind: str = "users"
+    # "arrow" streams Arrow IPC, "parquet" writes the file path under EXPORT_DIR
+    format: str = "arrow"
+    # Every column when None
+    columns: typing.Optional[typing.List[str]] = None
+    # Profile fields of the users flattened into extra_data.<field> columns
+    profile_fields: typing.Optional[typing.List[str]] = None
+    path: typing.Optional[str] = None
+    org_id: typing.Optional[str] = None
+    limit: typing.Optional[int] = None
+
+
 @dataclass
 class GetRunReq:
     page_token: typing.Optional[str] = None
@@ -142,6 +170,34 @@ class GetRunRes:
 
 
 
+@dataclass
+class SyncReq:
+    sync_token: typing.Optional[str] = None
+
+
+
+@dataclass
+class BatchWorkspace:
+    access_token: str
+    workspace: typing.Optional[str] = None
+
+
+@dataclass
+class BatchRunReq:
+    workspaces: typing.List[BatchWorkspace]
+
+
+
+@dataclass
+class DownloadedFile:
+    path: str
+    sha256: str
+    size: int
+    content_type: typing.Optional[str] = None
+    file_id: typing.Optional[str] = None
+    already_stored: bool = False
+
+
 @dataclass
 class GetVerificationReq:
     access_token: typing.Optional[str] = None
@@ -150,6 +206,30 @@ class GetVerificationReq:
 @dataclass
 class GetVerificationRes:
     connection_status: bool
+    team_id: typing.Optional[str] = None
+    app_id: typing.Optional[str] = None
+
+
+
+@dataclass
+class TokenHealthReq:
+    team_ids: typing.Optional[typing.List[str]] = None
+    app_id: typing.Optional[str] = None
+    refresh: bool = False
+
+
+
+@dataclass
+class Installation:
+    team_id: str
+    app_id: str
+    access_token: str
+    bot_user_id: typing.Optional[str] = None
+    scope: typing.Optional[str] = None
+    user_id: typing.Optional[str] = None
+    user_access_token: typing.Optional[str] = None
+    user_scope: typing.Optional[str] = None
+    installed_at: float = 0.0
 
 
 
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+
+# Slack web api rate limit tier of each method we call, anything else falls back to DEFAULT_TIER.
+# See https://api.slack.com/docs/rate-limits
+METHOD_TIERS = {
+    "users.list": 2,
+    "admin.apps.requests.list": 2,
+    "oauth.v2.access": 4,
+    "auth.test": 4,
+}
+DEFAULT_TIER = 3
+
+# Number of calls per minute allowed by each tier
+TIER_LIMITS = {
+    1: 1,
+    2: 20,
+    3: 50,
+    4: 100,
+}
+
+
+
+# Return a short, non reversible key for an access token so raw tokens are never used as keys or logged
+def token_key(access_token):
+    if access_token is None:
+        return "anonymous"
+    return hashlib.sha256(access_token.encode("utf-8")).hexdigest()[:16]
+
+
+
+#A token bucket that queues callers instead of failing them when it is empty
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        # Tokens added per second and the maximum burst size
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Set when slack answered with a 429, nothing is let through before this time
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self.lock = None
+
+
+    def _refill(self, now):
+        if now <= self.updated:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    # Wait for a token and return how long the caller was queued for
+    async def acquire(self):
+        # The lock is created lazily so it belongs to the running event loop
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            # asyncio.Lock wakes its waiters in order, so queued calls are served first come first served
+            async with self.lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self.blocked_until - now
+                    if delay <= 0:
+                        if self.tokens >= 1:
+                            self.tokens -= 1
+                            break
+                        delay = (1 - self.tokens) / self.rate
+                    await asyncio.sleep(delay)
+        finally:
+            self.waiting -= 1
+        return time.monotonic() - started
+
+
+    # Stop handing out tokens for retry_after seconds, then allow a single call through to probe slack again
+    def block(self, retry_after):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        self.tokens = 1
+        self.updated = self.blocked_until
+
+
+
+#A scheduler keeping one token bucket per (access token, slack method tier) pair
+class SlackRateLimiter:
+    def __init__(self, tier_limits=None, burst_seconds=10.0, max_retries=3, max_buckets=10000):
+        self.tier_limits = TIER_LIMITS if tier_limits is None else tier_limits
+        self.burst_seconds = burst_seconds
+        # How many times a call answered with a 429 is queued again before the 429 is handed back
+        self.max_retries = max_retries
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.calls = 0
+        self.queued_calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.rate_limited = 0
+
+
+    def _bucket(self, access_token, method):
+        tier = METHOD_TIERS.get(method, DEFAULT_TIER)
+        key = (token_key(access_token), tier)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_buckets:
+                self._prune()
+            rate = self.tier_limits[tier] / 60.0
+            bucket = TokenBucket(rate, max(1.0, rate * self.burst_seconds))
+            self.buckets[key] = bucket
+        return bucket
+
+
+    # Drop the buckets nobody is waiting on and that have fully refilled, they hold no state worth keeping
+    def _prune(self):
+        now = time.monotonic()
+        for key, bucket in list(self.buckets.items()):
+            bucket._refill(now)
+            if bucket.waiting == 0 and bucket.tokens >= bucket.capacity and bucket.blocked_until <= now:
+                del self.buckets[key]
+
+
+    # Wait until a call to the given slack method is allowed for this token
+    async def acquire(self, access_token, method):
+        wait = await self._bucket(access_token, method).acquire()
+        self.calls += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait > 0.001:
+            self.queued_calls += 1
+            logging.info(f"Slack call to {method} was queued for {wait:.3f}s by the rate limiter")
+        return wait
+
+
+    # Record a 429 from slack, holding back every call of the same tier for this token
+    def penalize(self, access_token, method, retry_after):
+        self.rate_limited += 1
+        self._bucket(access_token, method).block(retry_after)
+        logging.warning(f"Slack rate limited {method}, holding calls for {retry_after}s")
+
+
+    # Current queue depth and wait time figures
+    def stats(self):
+        return {
+            "queue_depth": sum(bucket.waiting for bucket in self.buckets.values()),
+            "buckets": len(self.buckets),
+            "calls": self.calls,
+            "queued_calls": self.queued_calls,
+            "rate_limited": self.rate_limited,
+            "average_wait": self.total_wait / self.calls if self.calls else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+
+# Parse the Retry-After header of a 429 response, in seconds
+def retry_after_seconds(response, default=1.0):
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", default)))
+    except ValueError:
+        return default
@@ -0,0 +1,231 @@
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import httpx
+import orjson
+
+
+# Slack methods whose responses are cached, both only read data
+CACHEABLE_METHODS = {
+    "users.list",
+    "admin.apps.requests.list",
+}
+
+
+
+# Build the cache key from a hash of the access token, the slack method and the cursor (plus any other body param)
+def cache_key(access_token, slack_method, body_params=None):
+    token_hash = hashlib.sha256((access_token or "").encode("utf-8")).hexdigest()
+    params = "&".join("{}={}".format(key, value) for key, value in sorted((body_params or {}).items()))
+    return "{}:{}:{}".format(token_hash, slack_method, params)
+
+
+
+# Only successful slack responses are worth keeping
+def is_cacheable(response):
+    if response.status_code != 200:
+        return False
+    try:
+        response_json = orjson.loads(response.content)
+    except ValueError:
+        return False
+    return isinstance(response_json, dict) and response_json.get("ok") == True
+
+
+
+#A cached slack response, rebuilt into an httpx.Response on every hit
+class CachedResponse:
+    __slots__ = ("stored_at", "status_code", "content", "content_type")
+
+    def __init__(self, stored_at, status_code, content, content_type="application/json"):
+        self.stored_at = stored_at
+        self.status_code = status_code
+        self.content = content
+        self.content_type = content_type
+
+
+    def to_response(self):
+        return httpx.Response(self.status_code, content=self.content, headers={"content-type": self.content_type})
+
+
+
+#Stores cache entries as files in a shared directory so several uvicorn workers can reuse each other's responses.
+#Entries hold slack user data, so files older than max_age seconds are deleted when read, and every sweep_every writes
+#(and on startup) a sweep deletes the expired files and the oldest ones past max_entries
+class FileCacheBackend:
+    def __init__(self, directory, max_age=None, max_entries=None, sweep_every=100):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.sweep_every = sweep_every
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+        self.sweep()
+
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # Already removed by another worker
+            pass
+
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                entry = CachedResponse(header["stored_at"], header["status_code"], f.read(), header["content_type"])
+        except (OSError, ValueError, KeyError):
+            return None
+        if self.max_age is not None and time.time() - entry.stored_at >= self.max_age:
+            self._remove(path)
+            return None
+        return entry
+
+
+    # Delete the expired entry files, then the least recently written ones past max_entries. Returns the files deleted
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for dir_entry in scan:
+                # Entry files are named after a sha256, temp files being written are left alone
+                if len(dir_entry.name) != 64 or not dir_entry.is_file():
+                    continue
+                try:
+                    entries.append((dir_entry.stat().st_mtime, dir_entry.path))
+                except FileNotFoundError:
+                    continue
+        entries.sort()
+        expired = 0 if self.max_age is None else sum(1 for mtime, _ in entries if now - mtime >= self.max_age)
+        excess = 0 if self.max_entries is None else len(entries) - expired - self.max_entries
+        removed = entries[:expired + max(excess, 0)]
+        for _, path in removed:
+            self._remove(path)
+        return len(removed)
+
+
+    # Write to a temp file first and rename it, so readers never see a partial entry
+    def set(self, key, entry):
+        header = json.dumps({"stored_at": entry.stored_at, "status_code": entry.status_code, "content_type": entry.content_type})
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header.encode("utf-8") + b"\n")
+                f.write(entry.content)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            os.unlink(temp_path)
+            raise
+        self.writes += 1
+        if self.writes % self.sweep_every == 0:
+            self.sweep()
+
+
+
+#An in-process LRU cache of slack responses with a TTL, stale-while-revalidate and single-flight coalescing
+class ResponseCache:
+    def __init__(self, max_entries=256, ttl=30.0, stale_ttl=60.0, backend=None):
+        self.max_entries = max_entries
+        # Entries are served as is for ttl seconds, then served while being refreshed in the background for stale_ttl more
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.backend = backend
+        self.entries = collections.OrderedDict()
+        # In flight upstream calls, so concurrent identical requests share one of them
+        self.inflight = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+    async def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+        if self.backend is not None:
+            try:
+                entry = await asyncio.get_event_loop().run_in_executor(None, self.backend.get, key)
+            except Exception as e:
+                logging.warning(f"Response cache backend read failed: {e}")
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+        return entry
+
+
+    # Make the upstream call, keeping successful slack responses
+    async def _fetch(self, key, fetch):
+        response = await fetch()
+        if is_cacheable(response):
+            entry = CachedResponse(time.time(), response.status_code, response.content, response.headers.get("content-type", "application/json"))
+            self._remember(key, entry)
+            if self.backend is not None:
+                try:
+                    await asyncio.get_event_loop().run_in_executor(None, self.backend.set, key, entry)
+                except Exception as e:
+                    logging.warning(f"Response cache backend write failed: {e}")
+        return response
+
+
+    # Start the upstream call for key unless one is already running, and return its task
+    def _single_flight(self, key, fetch):
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return task
+        task = asyncio.ensure_future(self._fetch(key, fetch))
+        self.inflight[key] = task
+        task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return task
+
+
+    # Return the cached response for key, calling fetch (a coroutine function returning an httpx.Response) when needed
+    async def get_or_fetch(self, key, fetch):
+        entry = await self._lookup(key)
+        if entry is not None:
+            age = time.time() - entry.stored_at
+            if age < self.ttl:
+                self.hits += 1
+                return entry.to_response()
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                task = self._single_flight(key, fetch)
+                # Nobody awaits the background refresh, so retrieve its error to keep asyncio quiet
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                return entry.to_response()
+        if key not in self.inflight:
+            self.misses += 1
+        # Shielded so a caller going away does not cancel the call other callers are waiting on
+        return await asyncio.shield(self._single_flight(key, fetch))
+
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self.inflight),
+        }
@@ -0,0 +1,125 @@
+import random
+import time
+import httpx
+
+
+# Slack methods that only read data and can safely be sent again after any failure
+IDEMPOTENT_METHODS = {
+    "users.list",
+    "admin.apps.requests.list",
+    "auth.test",
+}
+
+# Errors raised before the request reached slack, these are safe to retry for every method
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+
+#Decides whether a failed slack call is retried and how long to back off before doing so
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=0.2, max_delay=5.0, budget_ratio=0.2, min_budget=10.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Retry budget: every call deposits budget_ratio of a retry and every retry spends a whole one,
+        # so retries stay a bounded fraction of the traffic while slack is struggling
+        self.budget_ratio = budget_ratio
+        self.max_budget = min_budget
+        self.budget = min_budget
+        self.retries = 0
+
+
+    # Record a first attempt, topping up the retry budget
+    def record_call(self):
+        self.budget = min(self.max_budget, self.budget + self.budget_ratio)
+
+
+    def _spend(self, attempt):
+        if attempt + 1 >= self.max_attempts or self.budget < 1:
+            return False
+        self.budget -= 1
+        self.retries += 1
+        return True
+
+
+    # A transport error is retried when the request never left, or when the slack method is idempotent
+    def should_retry_error(self, error, slack_method, attempt, http_method="POST"):
+        if not isinstance(error, NOT_SENT_ERRORS) and http_method != "GET" and slack_method not in IDEMPOTENT_METHODS:
+            return False
+        return self._spend(attempt)
+
+
+    # A 5xx response means slack received the request, so it is only retried for idempotent methods
+    def should_retry_response(self, response, slack_method, attempt, http_method="POST"):
+        if response.status_code < 500:
+            return False
+        if http_method != "GET" and slack_method not in IDEMPOTENT_METHODS:
+            return False
+        return self._spend(attempt)
+
+
+    # Exponential backoff with full jitter for the given retry number (starting at 1)
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+
+#A circuit breaker failing calls fast after too many consecutive failures of one slack endpoint
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+
+    # Whether a call may go through. Once reset_timeout has passed an open breaker lets a single probe call through
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            # Re-arm the timer so only one probe is let through per reset_timeout
+            self.state = self.HALF_OPEN
+            self.opened_at = now
+            return True
+        return False
+
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+
+#One circuit breaker per slack endpoint, created on first use
+class CircuitBreakers:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+
+
+    def get(self, slack_method):
+        breaker = self.breakers.get(slack_method)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            self.breakers[slack_method] = breaker
+        return breaker
+
+
+    # State of every breaker, keyed by slack method
+    def stats(self):
+        return {slack_method: {"state": breaker.state, "failures": breaker.failures} for slack_method, breaker in self.breakers.items()}
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import random
+import orjson
+import websockets
+from api_manager import APIManager
+
+
+
+# Build the coroutine function asking slack for a new Socket Mode url with the app-level token (xapp-...)
+def apps_connections_open(url, app_token, api_options):
+    async def open_url():
+        response = await APIManager(url=url, access_token=app_token, **api_options)._post()
+        response_json = response.json() if response.status_code == 200 else {}
+        if response_json.get("ok") != True:
+            raise RuntimeError("apps.connections.open failed. Reason: {}".format(response_json.get("error") or "Slack responded with status code {}".format(response.status_code)))
+        return response_json["url"]
+
+    return open_url
+
+
+
+#Slack Socket Mode ingester: keeps connections websockets open to slack at a time and hands the payload of every
+#events_api envelope to handler, a coroutine function. Envelopes are acked as soon as they arrive, before being handled,
+#as slack redelivers envelopes not acked within a few seconds. Handling happens on the connection's own reader, so a
+#slow handler holds back its connection only, and slack spreads the events over the other ones.
+#An acked event is never sent again, so one whose handling failed, e.g. on a full work queue, is retried on its own
+#schedule, up to retry_attempts times with jittered exponential backoff. At most retry_buffer_size events wait for a
+#retry at a time, beyond that the reader waits, leaving the next envelopes unacked for slack to send again.
+#Each connection reconnects on its own, straight away when slack asks for it and with jittered exponential backoff,
+#up to max_delay seconds, after a failure
+class SocketModeClient:
+    def __init__(self, handler, open_url, connections=2, base_delay=1.0, max_delay=30.0, ping_interval=20.0, retry_buffer_size=1000, retry_attempts=5):
+        self.handler = handler
+        self.open_url = open_url
+        self.connections = connections
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.ping_interval = ping_interval
+        self.retry_buffer_size = retry_buffer_size
+        self.retry_attempts = retry_attempts
+        # Created by start(), so it belongs to the loop running the connections
+        self.retry_slots = None
+        self.retrying = set()
+        self.tasks = []
+        self.open_connections = 0
+        self.envelopes = 0
+        self.acks = 0
+        self.reconnects = 0
+        self.errors = 0
+        self.deferred_events = 0
+        self.retried_events = 0
+        self.failed_events = 0
+
+
+    def start(self):
+        self.retry_slots = asyncio.Semaphore(self.retry_buffer_size)
+        self.tasks = [asyncio.ensure_future(self._run(number)) for number in range(self.connections)]
+
+
+    async def stop(self):
+        if self.retrying:
+            logging.warning(f"Socket Mode stopped with {len(self.retrying)} events left to retry")
+        tasks = self.tasks + list(self.retrying)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+        self.retrying = set()
+
+
+    # Keep one connection open until cancelled
+    async def _run(self, number):
+        failures = 0
+        while True:
+            try:
+                url = await self.open_url()
+                async with websockets.connect(url, ping_interval=self.ping_interval, max_size=None) as websocket:
+                    self.open_connections += 1
+                    try:
+                        greeted = await self._receive(websocket)
+                    finally:
+                        self.open_connections -= 1
+                # A connection closed before slack's hello counts as a failure, so a refused connection is not retried in a tight loop
+                failures = 0 if greeted else failures + 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                self.errors += 1
+                logging.warning(f"Socket Mode connection {number} failed. Reason: {e!r}")
+            self.reconnects += 1
+            if failures:
+                await asyncio.sleep(random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (failures - 1)))))
+
+
+    # Read envelopes until slack asks to reconnect or closes the connection. Returns whether slack said hello
+    async def _receive(self, websocket):
+        greeted = False
+        async for message in websocket:
+            envelope = orjson.loads(message)
+            envelope_id = envelope.get("envelope_id")
+            if envelope_id is not None:
+                await websocket.send(orjson.dumps({"envelope_id": envelope_id}).decode("utf-8"))
+                self.acks += 1
+            envelope_type = envelope.get("type")
+            if envelope_type == "hello":
+                greeted = True
+            elif envelope_type == "disconnect":
+                # Sent before slack refreshes or moves the connection, the next one is opened right away
+                logging.info(f"Socket Mode connection refresh requested. Reason: {envelope.get('reason')}")
+                return greeted
+            if envelope_type != "events_api":
+                continue
+            self.envelopes += 1
+            payload = envelope.get("payload") or {}
+            try:
+                await self.handler(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Already acked, so slack does not send the event again, it is retried here instead
+                self.deferred_events += 1
+                logging.warning(f"Socket Mode event {envelope_id} could not be handled, retrying it later. Reason: {e!r}")
+                await self.retry_slots.acquire()
+                task = asyncio.ensure_future(self._retry(envelope_id, payload))
+                self.retrying.add(task)
+                task.add_done_callback(self.retrying.discard)
+        return greeted
+
+
+    # Handle one failed event again until it succeeds or retry_attempts run out, then free its retry slot
+    async def _retry(self, envelope_id, payload):
+        try:
+            error = None
+            for attempt in range(self.retry_attempts):
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+                try:
+                    await self.handler(payload)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    error = e
+                    continue
+                self.retried_events += 1
+                return
+            self.failed_events += 1
+            logging.error(f"Socket Mode event {envelope_id} could not be handled after {self.retry_attempts} retries. Reason: {error!r}")
+        finally:
+            self.retry_slots.release()
+
+
+    def stats(self):
+        return {
+            "connections": self.open_connections, "envelopes": self.envelopes, "acks": self.acks,
+            "reconnects": self.reconnects, "errors": self.errors, "deferred_events": self.deferred_events,
+            "retry_buffer": len(self.retrying), "retried_events": self.retried_events,
+            "failed_events": self.failed_events,
+        }
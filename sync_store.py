@@ -0,0 +1,124 @@
+import base64
+import hashlib
+import sqlite3
+import threading
+import orjson
+
+
+# Raised when a sync token was not issued by this store for the workspace, or is ahead of its snapshot
+class InvalidSyncTokenError(Exception):
+    pass
+
+
+
+# Hash of a record's content, the same record always gives the same hash whatever the order of its keys
+def record_hash(record):
+    return hashlib.sha256(orjson.dumps(record, option=orjson.OPT_SORT_KEYS)).hexdigest()[:32]
+
+
+
+# Sync tokens are opaque to callers, they carry the workspace and the snapshot version they were issued at
+def encode_sync_token(workspace, version):
+    return base64.urlsafe_b64encode(orjson.dumps({"w": workspace, "v": version})).decode("ascii")
+
+
+def decode_sync_token(sync_token, workspace):
+    try:
+        token = orjson.loads(base64.urlsafe_b64decode(sync_token.encode("ascii")))
+        version = int(token["v"])
+    except Exception:
+        raise InvalidSyncTokenError("Malformed sync token")
+    if token.get("w") != workspace:
+        raise InvalidSyncTokenError("Sync token was issued for another workspace")
+    return version
+
+
+
+#Keeps, per workspace, the id and content hash of every user and app seen by the last sync, in SQLite.
+#Every sync that finds a difference bumps the workspace version, and each record remembers the version it was
+#created and last changed (or deleted) at, so the changes since any earlier version can be told apart.
+#Every method blocks on the disk, so call them from a worker thread
+class SQLiteSnapshotStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS workspaces (workspace TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS records (workspace TEXT NOT NULL, kind TEXT NOT NULL, record_id TEXT NOT NULL, hash TEXT, "
+                "created_version INTEGER NOT NULL, changed_version INTEGER NOT NULL, deleted INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (workspace, kind, record_id))"
+            )
+
+
+    # Compare the records just fetched from slack with the snapshot and store them as the new snapshot.
+    # records maps a kind ("users", "apps") to the list of its records, a kind left out keeps its snapshot untouched.
+    # Returns the new sync token and, per kind, the added and changed records and the ids of the deleted ones since
+    # sync_token, or every current record as added when there is no sync token
+    def sync(self, workspace, records, sync_token=None, id_field="id"):
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT version FROM workspaces WHERE workspace = ?", (workspace,)).fetchone()
+            current_version = 0 if row is None else row[0]
+            since = 0 if sync_token is None else decode_sync_token(sync_token, workspace)
+            if since > current_version:
+                raise InvalidSyncTokenError("Sync token is ahead of the snapshot")
+            new_version = current_version + 1
+            changed_anything = False
+            changes = {}
+            for kind, items in records.items():
+                snapshot = {
+                    record_id: (record_hash, created_version, changed_version, deleted)
+                    for record_id, record_hash, created_version, changed_version, deleted in self.connection.execute(
+                        "SELECT record_id, hash, created_version, changed_version, deleted FROM records WHERE workspace = ? AND kind = ?", (workspace, kind)
+                    )
+                }
+                added, changed, upserts = [], [], []
+                seen = set()
+                for item in items:
+                    record_id = item.get(id_field)
+                    if record_id is None or record_id in seen:
+                        continue
+                    seen.add(record_id)
+                    content_hash = record_hash(item)
+                    previous = snapshot.get(record_id)
+                    if previous is None or previous[3]:
+                        # New, or back after having been deleted
+                        created_version = changed_version = new_version
+                        upserts.append((workspace, kind, record_id, content_hash, created_version, changed_version))
+                    elif previous[0] != content_hash:
+                        created_version, changed_version = previous[1], new_version
+                        upserts.append((workspace, kind, record_id, content_hash, created_version, changed_version))
+                    else:
+                        created_version, changed_version = previous[1], previous[2]
+                    if created_version > since:
+                        added.append(item)
+                    elif changed_version > since:
+                        changed.append(item)
+                deletes = [
+                    (new_version, workspace, kind, record_id)
+                    for record_id, (_, _, _, deleted) in snapshot.items() if not deleted and record_id not in seen
+                ]
+                # Deletions recorded by earlier syncs the caller has not seen yet, skipping records it never saw
+                deleted_ids = [
+                    record_id for record_id, (_, created_version, changed_version, deleted) in snapshot.items()
+                    if (deleted and changed_version > since and created_version <= since) or (not deleted and record_id not in seen and created_version <= since)
+                ]
+                if upserts or deletes:
+                    changed_anything = True
+                    self.connection.executemany(
+                        "INSERT OR REPLACE INTO records (workspace, kind, record_id, hash, created_version, changed_version, deleted) VALUES (?, ?, ?, ?, ?, ?, 0)", upserts
+                    )
+                    self.connection.executemany(
+                        "UPDATE records SET deleted = 1, hash = NULL, changed_version = ? WHERE workspace = ? AND kind = ? AND record_id = ?", deletes
+                    )
+                changes[kind] = {"added": added, "changed": changed, "deleted": deleted_ids}
+            if changed_anything:
+                self.connection.execute("INSERT OR REPLACE INTO workspaces (workspace, version) VALUES (?, ?)", (workspace, new_version))
+            else:
+                new_version = current_version
+        return encode_sync_token(workspace, new_version), changes
+
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
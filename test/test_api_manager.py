@@ -0,0 +1,106 @@
+import asyncio
+import httpx
+import pytest
+from api_manager import APIManager, SlackUnavailableError
+from retry_policy import RetryPolicy, CircuitBreakers
+
+
+# Build a client whose transport answers every request with the given handler
+def mock_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+# Test that the shared client is used and the bearer token is sent
+def test_post_uses_shared_client():
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json={"ok": True})
+
+    async def run():
+        async with mock_client(handler) as client:
+            api_manager = APIManager(url="https://slack.test/api/users.list", access_token="xoxb-test", client=client)
+            first = await api_manager._post({"cursor": "abc"})
+            second = await api_manager._post()
+            return first, second
+
+    first, second = asyncio.run(run())
+    assert first.json() == {"ok": True} and second.status_code == 200
+    assert len(seen) == 2
+    assert seen[0].headers["Authorization"] == "Bearer xoxb-test"
+    assert seen[0].content == b"cursor=abc"
+
+
+# Test that a connect timeout is reported as slack being unavailable
+def test_post_connect_timeout():
+    def handler(request):
+        raise httpx.ConnectTimeout("timed out", request=request)
+
+    async def run():
+        async with mock_client(handler) as client:
+            return await APIManager(url="https://slack.test/api/users.list", client=client)._post()
+
+    with pytest.raises(SlackUnavailableError):
+        asyncio.run(run())
+
+
+# Test that read timeouts and 5xx responses of idempotent methods are retried
+def test_idempotent_call_is_retried():
+    outcomes = ["read_timeout", 503, 200]
+
+    def handler(request):
+        outcome = outcomes.pop(0)
+        if outcome == "read_timeout":
+            raise httpx.ReadTimeout("timed out", request=request)
+        return httpx.Response(outcome, json={"ok": outcome == 200})
+
+    async def run():
+        async with mock_client(handler) as client:
+            api_manager = APIManager(url="https://slack.test/api/users.list", client=client, retry_policy=RetryPolicy(max_attempts=3, base_delay=0.001))
+            return await api_manager._post()
+
+    assert asyncio.run(run()).status_code == 200
+    assert outcomes == []
+
+
+# Test that a read timeout of a non idempotent method is not sent again
+def test_non_idempotent_call_is_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    async def run():
+        async with mock_client(handler) as client:
+            api_manager = APIManager(url="https://slack.test/api/oauth.v2.access", client=client, retry_policy=RetryPolicy(base_delay=0.001))
+            return await api_manager._post({"code": "abc"})
+
+    with pytest.raises(SlackUnavailableError):
+        asyncio.run(run())
+    assert len(calls) == 1
+
+
+# Test that the circuit breaker fails fast once an endpoint keeps failing
+def test_circuit_breaker_opens():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(502)
+
+    async def run():
+        circuit_breakers = CircuitBreakers(failure_threshold=2, reset_timeout=60)
+        async with mock_client(handler) as client:
+            api_manager = APIManager(url="https://slack.test/api/users.list", client=client, circuit_breakers=circuit_breakers)
+            first = await api_manager._post()
+            second = await api_manager._post()
+            with pytest.raises(SlackUnavailableError):
+                await api_manager._post()
+        return first, second, circuit_breakers.stats()
+
+    first, second, stats = asyncio.run(run())
+    assert first.status_code == 502 and second.status_code == 502
+    assert len(calls) == 2
+    assert stats["users.list"]["state"] == "open"
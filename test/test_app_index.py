@@ -0,0 +1,57 @@
+import asyncio
+import datetime
+from app_index import AppIndex, AppInventory
+
+
+def app_request(request_id, user_id, app_id, name="App"):
+    return {
+        "id": request_id, "team": {"id": "T1"}, "scopes": [{"name": "chat:write"}], "date_created": 1600000000,
+        "app": {"id": app_id, "name": name, "is_app_directory_approved": True}, "user": {"id": user_id, "name": user_id.lower(), "email": "{}@example.com".format(user_id)},
+    }
+
+
+# Test that app requests are mapped to app records and indexed by user and by app
+def test_inventory_indexes_apps():
+    inventory = AppInventory()
+    assert inventory.update([app_request("Ar1", "U1", "A1"), app_request("Ar2", "U1", "A2"), app_request("Ar3", "U2", "A1")]) == (3, 0, 0)
+    assert [record.int_name for record in inventory.apps_of_user("U1")] == ["A1", "A2"]
+    assert inventory.users_of_app("A1") == ["U1", "U2"] and inventory.apps_of_user("U3") == []
+    record = inventory.apps_of_user("U2")[0].to_dataclass()
+    assert (record.org_id, record.user_key, record.display_text, record.scopes, record.verified) == ("T1", "U2@example.com", "App", ["chat:write"], True)
+    assert record.record_creation_time == datetime.datetime(2020, 9, 13, 12, 26, 40, tzinfo=datetime.timezone.utc)
+
+
+# Test that a refresh only touches the app requests added, changed or removed
+def test_inventory_updates_incrementally():
+    inventory = AppInventory()
+    inventory.update([app_request("Ar1", "U1", "A1"), app_request("Ar2", "U2", "A2")])
+    unchanged = inventory.apps_of_user("U1")[0]
+    assert inventory.update([app_request("Ar1", "U1", "A1"), app_request("Ar2", "U3", "A2"), app_request("Ar4", "U3", "A4")]) == (1, 1, 0)
+    assert inventory.apps_of_user("U1")[0] is unchanged
+    assert inventory.apps_of_user("U2") == [] and inventory.users_of_app("A2") == ["U3"]
+    assert inventory.update([app_request("Ar4", "U3", "A4")]) == (0, 0, 2)
+    assert "U1" not in inventory.apps_by_user and inventory.users_of_app("A1") == [] and len(inventory.apps()) == 1
+
+
+# Test that concurrent requests share one refresh, and a failed refresh keeps the previous inventory
+def test_index_refreshes_once():
+    index = AppIndex(ttl=60)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return [app_request("Ar1", "U1", "A1")], None
+
+    async def failing_fetch():
+        return [], "ratelimited"
+
+    async def run():
+        results = await asyncio.gather(*(index.get(("token", "T1"), fetch) for _ in range(5)))
+        index.inventories[("token", "T1")].refreshed_at = 0.0
+        failed = await index.get(("token", "T1"), failing_fetch)
+        return results, failed
+
+    results, failed = asyncio.run(run())
+    assert len(calls) == 1 and all(inventory is results[0][0] for inventory, _ in results)
+    assert failed == (None, "ratelimited") and len(index.inventories[("token", "T1")].apps()) == 1
@@ -0,0 +1,61 @@
+import asyncio
+import httpx
+from batch_collector import BatchCollector, FairLimiter
+
+
+# Build the api options of a collector talking to a mocked slack api
+def mocked_options(handler):
+    return {"client": httpx.AsyncClient(transport=httpx.MockTransport(handler))}
+
+
+# Test that a task asking again for the limiter goes behind the ones already waiting
+def test_fair_limiter_hands_out_slots_in_turn():
+    order = []
+
+    async def worker(name, rounds, limiter):
+        for _ in range(rounds):
+            async with limiter:
+                order.append(name)
+                await asyncio.sleep(0)
+
+    async def run():
+        limiter = FairLimiter(1)
+        await asyncio.gather(worker("big", 4, limiter), worker("a", 2, limiter), worker("b", 2, limiter))
+
+    asyncio.run(run())
+    assert order == ["big", "a", "b", "big", "a", "b", "big", "big"]
+
+
+# Test that a workspace with many pages neither exceeds the caps nor holds back the small workspaces
+def test_batch_is_capped_and_fair():
+    in_flight = {"total": 0, "max": 0, "max_per_token": 0}
+    per_token = {}
+
+    async def handler(request):
+        token = request.headers["Authorization"].split()[-1]
+        in_flight["total"] += 1
+        per_token[token] = per_token.get(token, 0) + 1
+        in_flight["max"] = max(in_flight["max"], in_flight["total"])
+        in_flight["max_per_token"] = max(in_flight["max_per_token"], per_token[token])
+        await asyncio.sleep(0.01)
+        in_flight["total"] -= 1
+        per_token[token] -= 1
+        if request.url.path.endswith("/admin.apps.requests.list"):
+            if token == "xoxp-broken":
+                return httpx.Response(200, json={"ok": False, "error": "not_allowed_token_type"})
+            return httpx.Response(200, json={"ok": True, "app_requests": [{"id": "Ar1"}]})
+        page = int(dict(httpx.QueryParams(request.content.decode())).get("cursor") or 0)
+        pages = 10 if token == "xoxp-big" else 1
+        next_cursor = str(page + 1) if page + 1 < pages else ""
+        return httpx.Response(200, json={"ok": True, "members": [{"id": "U{}".format(page)}], "response_metadata": {"next_cursor": next_cursor}})
+
+    async def run():
+        collector = BatchCollector("https://slack.test/api", mocked_options(handler), concurrency=2, workspace_concurrency=1)
+        workspaces = [{"workspace": "big", "access_token": "xoxp-big"}] + [{"access_token": "xoxp-broken"}] + [{"workspace": "w{}".format(n), "access_token": "xoxp-{}".format(n)} for n in range(3)]
+        return [result async for result in collector.run(workspaces)]
+
+    results = asyncio.run(run())
+    assert in_flight["max"] == 2 and in_flight["max_per_token"] == 1
+    assert results[-1]["workspace"] == "big" and len(results[-1]["users"]) == 10
+    broken = [result for result in results if result["workspace"] == "1"][0]
+    assert broken["status"] == True and broken["apps"] == [] and broken["apps_error"] == "not_allowed_token_type"
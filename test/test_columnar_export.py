@@ -0,0 +1,57 @@
+import asyncio
+import datetime
+import pytest
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+from columnar_export import ColumnarConverter, UnknownColumnError, stream_arrow_ipc, write_parquet
+
+
+MEMBERS = [
+    {"id": "U1", "team_id": "T1", "name": "ada", "is_admin": True, "profile": {"display_name": "ada", "first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com", "title": "Engineer", "is_custom_image": True}},
+    {"id": "U2", "team_id": "T1", "name": "bob", "deleted": True},
+]
+
+
+async def pages_of(*pages):
+    for page in pages:
+        yield page, None
+
+
+# Test that users are converted with the chosen columns and the flattened profile fields
+def test_users_record_batch():
+    converter = ColumnarConverter("users", ["user_id", "name", "suspended"], ["title", "is_custom_image"])
+    batch = converter.record_batch(MEMBERS)
+    assert batch.schema.names == ["user_id", "name", "suspended", "extra_data.title", "extra_data.is_custom_image"]
+    assert batch.to_pylist() == [
+        {"user_id": "U1", "name": {"givenName": "ada", "familyName": "Lovelace", "fullName": "AdaLovelace"}, "suspended": False, "extra_data.title": "Engineer", "extra_data.is_custom_image": "true"},
+        {"user_id": "U2", "name": {"givenName": "", "familyName": "", "fullName": ""}, "suspended": True, "extra_data.title": None, "extra_data.is_custom_image": None},
+    ]
+    with pytest.raises(UnknownColumnError):
+        ColumnarConverter("users", ["user_id", "password"])
+
+
+# Test that app requests keep their scopes as lists and their creation date as a timestamp
+def test_apps_record_batch():
+    app_request = {"id": "Ar1", "team": {"id": "T1"}, "app": {"id": "A1", "name": "Jira"}, "user": {"id": "U1"}, "scopes": [{"name": "chat:write"}], "date_created": 1600000000}
+    row = ColumnarConverter("apps", ["int_name", "scopes", "record_creation_time"]).record_batch([app_request]).to_pylist()[0]
+    assert row == {"int_name": "A1", "scopes": ["chat:write"], "record_creation_time": datetime.datetime(2020, 9, 13, 12, 26, 40, tzinfo=datetime.timezone.utc)}
+
+
+# Test that the IPC stream holds one batch per page, the slackbot skipped, and that parquet gets one row group per page
+def test_stream_and_parquet(tmp_path):
+    converter = ColumnarConverter("users", ["user_id"])
+    slackbot = {"id": "USLACKBOT", "profile": {}}
+
+    async def stream():
+        return b"".join([chunk async for chunk in stream_arrow_ipc(converter, pages_of([slackbot] + MEMBERS[:1], MEMBERS[1:]), skip_slackbot=True)])
+
+    async def run_in_thread(func, *args):
+        return func(*args)
+
+    table = pyarrow.ipc.open_stream(asyncio.run(stream())).read_all()
+    assert table.column("user_id").to_pylist() == ["U1", "U2"] and len(table.to_batches()) == 2
+    path = str(tmp_path / "users.parquet")
+    assert asyncio.run(write_parquet(converter, pages_of(MEMBERS[:1], MEMBERS[1:]), path, run_in_thread)) == (2, 2)
+    assert pyarrow.parquet.ParquetFile(path).metadata.num_row_groups == 2
+    assert pyarrow.parquet.read_table(path).column("user_id").to_pylist() == ["U1", "U2"]
@@ -0,0 +1,33 @@
+import dataclasses
+from compact_models import CompactAppRecord, compact_users_from_members, EMPTY_DICT
+from helpers import parse_get_users_page
+from models import AppRecord
+
+
+MEMBERS = [
+    {"id": "U1", "team_id": "T1", "name": "ada", "is_admin": True, "profile": {"display_name": "ada", "first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com", "title": "Engineer"}},
+    {"id": "U2", "team_id": "T1", "name": "bob", "deleted": True},
+]
+
+
+# Test that compact records serialize exactly like the dataclasses they replace
+def test_compact_user_matches_dataclass():
+    expected = [dataclasses.asdict(user) for user in parse_get_users_page({"members": MEMBERS}, skip_slackbot=False).users]
+    records = compact_users_from_members(MEMBERS)
+    assert [record.to_dict() for record in records] == expected
+    assert [dataclasses.asdict(record.to_dataclass()) for record in records] == expected
+    assert not hasattr(records[0], "__dict__")
+
+
+# Test that extra_data keeps only the projected profile fields and empty ones share the same default
+def test_compact_user_projection():
+    first, second = compact_users_from_members(MEMBERS, profile_fields=("title", "phone"))
+    assert first.extra_data == {"title": "Engineer"}
+    assert second.extra_data is EMPTY_DICT and second.emails is first.emails
+
+
+# Test that repeated strings of app records are interned
+def test_compact_app_interns_strings():
+    apps = [CompactAppRecord.from_dataclass(AppRecord("T1", "slack", "ada", "U1", "".join(["A", "123"]), "Jira", False, ["".join(["chat", ":write"])], True)) for _ in range(2)]
+    assert apps[0].client_id is apps[1].client_id and apps[0].scopes[0] is apps[1].scopes[0]
+    assert apps[0].to_dataclass() == AppRecord("T1", "slack", "ada", "U1", "A123", "Jira", False, ["chat:write"], True)
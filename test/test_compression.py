@@ -0,0 +1,80 @@
+import asyncio
+import zlib
+import brotli
+from compression import CompressionMiddleware, negotiate_encoding
+
+
+# An app answering with the given chunks, the last one ending the body
+def chunked_app(chunks, status=200, content_type=b"application/json"):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type), (b"content-length", str(sum(map(len, chunks))).encode())]})
+        for n, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": n < len(chunks) - 1})
+
+    return app
+
+
+# Run one request through the middleware and return the messages sent
+def call(inner_app, accept_encoding=b"gzip", minimum_size=64):
+    middleware = CompressionMiddleware(inner_app, minimum_size=minimum_size)
+    scope = {"type": "http", "method": "GET", "path": "/run", "headers": [(b"accept-encoding", accept_encoding)]}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+# Test the Accept-Encoding negotiation, with and without brotli
+def test_negotiate_encoding():
+    assert negotiate_encoding("gzip, deflate, br", brotli_available=True) == "br"
+    assert negotiate_encoding("gzip, deflate, br", brotli_available=False) == "gzip"
+    assert negotiate_encoding("br;q=0, gzip;q=0.5", brotli_available=True) == "gzip"
+    assert negotiate_encoding("identity", brotli_available=True) is None
+    assert negotiate_encoding("*", brotli_available=False) == "gzip"
+
+
+# Test that large responses are gzipped with their length fixed up, while small ones and 304s pass through
+def test_compresses_above_threshold():
+    body = b'{"users": [' + b",".join(b'{"id": "U%d"}' % n for n in range(100)) + b"]}"
+    start, message = call(chunked_app([body]))
+    headers = dict(start["headers"])
+    assert headers[b"content-encoding"] == b"gzip" and headers[b"vary"] == b"Accept-Encoding"
+    assert int(headers[b"content-length"]) == len(message["body"]) < len(body)
+    assert zlib.decompress(message["body"], 31) == body
+
+    start, message = call(chunked_app([b'{"ok": true}']))
+    assert b"content-encoding" not in dict(start["headers"]) and message["body"] == b'{"ok": true}'
+    start, message = call(chunked_app([b""], status=304))
+    assert b"content-encoding" not in dict(start["headers"])
+    start, _ = call(chunked_app([body]), accept_encoding=b"identity")
+    assert b"content-encoding" not in dict(start["headers"])
+
+
+# Test that streamed responses are compressed chunk by chunk, each chunk decodable as soon as it arrives
+def test_compresses_streams_incrementally():
+    chunks = [b'{"user_id": "U1"}\n', b'{"user_id": "U2"}\n', b""]
+    sent = call(chunked_app(chunks, content_type=b"application/x-ndjson"))
+    headers = dict(sent[0]["headers"])
+    assert headers[b"content-encoding"] == b"gzip" and b"content-length" not in headers
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(sent[1]["body"]) == chunks[0]
+    assert decompressor.decompress(sent[2]["body"]) == chunks[1]
+    assert decompressor.decompress(sent[3]["body"]) == b"" and decompressor.eof
+
+
+# Test that streamed responses are compressed with brotli when preferred, each chunk decodable as soon as it arrives
+def test_compresses_streams_with_brotli():
+    chunks = [b'{"user_id": "U1"}\n', b'{"user_id": "U2"}\n', b""]
+    sent = call(chunked_app(chunks, content_type=b"application/x-ndjson"), accept_encoding=b"gzip, br")
+    headers = dict(sent[0]["headers"])
+    assert headers[b"content-encoding"] == b"br" and b"content-length" not in headers
+    decompressor = brotli.Decompressor()
+    assert decompressor.process(sent[1]["body"]) == chunks[0]
+    assert decompressor.process(sent[2]["body"]) == chunks[1]
+    assert decompressor.process(sent[3]["body"]) == b"" and decompressor.is_finished()
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from event_dedup import EventDeduplicator, SQLiteEventStore
+
+
+# Test that an event id is only claimed once, and can be claimed again once released
+def test_claim_and_release():
+    async def run():
+        event_dedup = EventDeduplicator()
+        results = [event_dedup.claim("Ev1"), event_dedup.claim("Ev1")]
+        event_dedup.release("Ev1")
+        results.append(event_dedup.claim("Ev1"))
+        return results, event_dedup.stats()
+
+    results, stats = asyncio.run(run())
+    assert results == [True, False, True]
+    assert stats == {"entries": 1, "duplicates": 1}
+
+
+# Test that the index is bounded in size and in time
+def test_entries_expire_and_are_bounded():
+    async def run():
+        event_dedup = EventDeduplicator(ttl=0.05, max_entries=2)
+        for event_id in ("Ev1", "Ev2", "Ev3"):
+            event_dedup.claim(event_id)
+        bounded = list(event_dedup.entries)
+        await asyncio.sleep(0.06)
+        return bounded, event_dedup.claim("Ev3")
+
+    bounded, reclaimed = asyncio.run(run())
+    assert bounded == ["Ev2", "Ev3"]
+    assert reclaimed
+
+
+# Test that seen event ids survive a restart when persisted
+def test_persisted_ids_survive_restart(tmp_path):
+    path = str(tmp_path / "events.db")
+
+    async def run():
+        event_dedup = EventDeduplicator(store=SQLiteEventStore(path))
+        event_dedup.claim("Ev1")
+        # Let the background write land
+        await asyncio.sleep(0.05)
+        event_dedup.close()
+        return EventDeduplicator(store=SQLiteEventStore(path)).claim("Ev1")
+
+    assert asyncio.run(run()) is False
+
+
+# Test that the persisted ids are pruned while running, expired ones first and then the oldest past max_entries
+def test_store_is_pruned_while_running(tmp_path):
+    store = SQLiteEventStore(str(tmp_path / "events.db"), max_entries=3, prune_every=5)
+    now = time.time()
+    store.add("Expired", now - 1)
+    for n in range(4):
+        store.add("Ev{}".format(n), now + 60 + n)
+    remaining = [event_id for event_id, _ in store.connection.execute("SELECT event_id, expires_at FROM seen_events ORDER BY expires_at")]
+    store.close()
+    assert remaining == ["Ev1", "Ev2", "Ev3"]
+
+
+# Test that a release is written after its claim, so a failed event is not seen again after a restart
+def test_release_is_persisted_after_claim(tmp_path):
+    path = str(tmp_path / "events.db")
+
+    async def run():
+        event_dedup = EventDeduplicator(store=SQLiteEventStore(path))
+        for n in range(50):
+            event_dedup.claim("Ev{}".format(n))
+            event_dedup.release("Ev{}".format(n))
+        event_dedup.close()
+        return EventDeduplicator(store=SQLiteEventStore(path)).entries
+
+    assert list(asyncio.run(run())) == []
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+import httpx
+import orjson
+import pytest
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from helpers import download_and_save_file, verify_request, SlackSignatureVerifier, parse_get_users_page, users_page_to_json, Prefetcher
+
+
+# Build a sync client serving the given body for every request
+def file_client(body, seen=None, headers=None):
+    def handler(request):
+        if seen is not None:
+            seen.append(request)
+        return httpx.Response(200, content=body, headers=headers)
+
+    return httpx.Client(transport=httpx.MockTransport(handler))
+
+
+# Test that the file is streamed to disk, hashed and fetched with the token
+def test_download_streams_and_hashes(tmp_path):
+    body = os.urandom(300 * 1024)
+    seen = []
+    downloaded_file = download_and_save_file(
+        "https://files.slack.test/files-pri/T1-F1/report.pdf", access_token="xoxb-test",
+        chunk_size=64 * 1024, media_folder=str(tmp_path), client=file_client(body, seen, {"content-type": "application/pdf"})
+    )
+    assert downloaded_file.path == os.path.join(str(tmp_path), "report.pdf")
+    assert downloaded_file.sha256 == hashlib.sha256(body).hexdigest()
+    assert downloaded_file.size == len(body) and downloaded_file.content_type == "application/pdf"
+    with open(downloaded_file.path, "rb") as f:
+        assert f.read() == body
+    assert seen[0].headers["Authorization"] == "Bearer xoxb-test"
+
+
+# Test that a file over the size cap is rejected and leaves nothing behind
+def test_download_enforces_max_size(tmp_path):
+    with pytest.raises(HTTPException) as error:
+        download_and_save_file(
+            "https://files.slack.test/files-pri/T1-F1/big.bin", chunk_size=1024, max_size=4096,
+            media_folder=str(tmp_path), client=file_client(os.urandom(10000))
+        )
+    assert error.value.status_code == 413
+    assert os.listdir(str(tmp_path)) == []
+
+
+# Sign a body the way slack does
+def slack_signature(body, timestamp, signing_secret="signing"):
+    return "v0=" + hmac.new(signing_secret.encode("utf-8"), b"v0:" + timestamp.encode("ascii") + b":" + body, hashlib.sha256).hexdigest()
+
+
+# Test that the verifier accepts genuine requests and rejects tampered, replayed and malformed ones
+def test_signature_verifier():
+    verifier = SlackSignatureVerifier("signing", replay_window=300)
+    body = '{"type": "event_callback", "text": "héllo"}'.encode("utf-8")
+    timestamp = str(int(time.time()))
+    signature = slack_signature(body, timestamp)
+    assert verifier.verify(body, signature, timestamp)
+    assert verify_request(body, signature, timestamp, "signing")
+    assert not verifier.verify(body + b" ", signature, timestamp)
+    assert not verifier.verify(body, slack_signature(body, timestamp, "other"), timestamp)
+    stale = str(int(time.time()) - 301)
+    assert not verifier.verify(body, slack_signature(body, stale), stale)
+    assert not verifier.check_headers(None, timestamp)
+    assert not verifier.check_headers("v0=abc", timestamp)
+    assert not verifier.check_headers(signature, "not-a-number")
+    assert not verifier.check_headers(signature, "\xb2")
+
+
+SLACK_USERS_PAGE = {
+    "ok": True,
+    "members": [
+        {"id": "USLACKBOT", "team_id": "T1", "name": "slackbot", "is_admin": False, "deleted": False, "profile": {"display_name": "", "first_name": "slack", "last_name": "bot"}},
+        {"id": "U1", "team_id": "T1", "name": "ada", "is_admin": True, "deleted": False, "profile": {"display_name": "ada", "first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com"}},
+        {"id": "U2", "team_id": "T1", "name": "bot", "is_admin": False, "deleted": True, "profile": {"display_name": "bot", "first_name": "Bot"}},
+    ],
+    "response_metadata": {"next_cursor": "page2"},
+}
+
+
+# Test that the bulk conversion produces the same JSON as the dataclasses, with or without validation
+def test_users_page_to_json_matches_dataclasses():
+    expected = jsonable_encoder(parse_get_users_page(SLACK_USERS_PAGE))
+    assert orjson.loads(users_page_to_json(SLACK_USERS_PAGE)) == expected
+    assert orjson.loads(users_page_to_json(SLACK_USERS_PAGE, validate=True)) == expected
+    # Missing email and last_name do not raise
+    assert expected["users"][1]["primary_email"] is None
+    assert expected["users"][1]["name"] == {"givenName": "bot", "familyName": "", "fullName": "Bot"}
+
+
+
+# Test that the prefetcher reads ahead of its reader, by at most size items, and hands the iterator's error over
+def test_prefetcher_reads_ahead():
+    produced = []
+
+    async def pages():
+        for n in range(4):
+            produced.append(n)
+            yield n
+        raise ValueError("slack went away")
+
+    async def run():
+        prefetcher = Prefetcher(pages(), size=2)
+        await asyncio.sleep(0.01)
+        ahead = list(produced)
+        read = []
+        with pytest.raises(ValueError):
+            async for item in prefetcher:
+                read.append(item)
+        return ahead, read
+
+    ahead, read = asyncio.run(run())
+    # Two items queued and a third one waiting to be put
+    assert ahead == [0, 1, 2] and read == [0, 1, 2, 3]
@@ -0,0 +1,48 @@
+import asyncio
+import os
+import stat
+from installation_store import InstallationStore, SQLiteInstallationBackend
+from models import Installation
+
+
+# Test that installations are read through the cache and survive a new store on the same file
+def test_installations_are_cached_and_persisted(tmp_path):
+    path = str(tmp_path / "installations.db")
+
+    async def run():
+        store = InstallationStore(SQLiteInstallationBackend(path))
+        await store.save(Installation("T1", "A1", "xoxb-1", installed_at=1.0))
+        assert (await store.get("T1", "A1")).access_token == "xoxb-1"
+        assert await store.get("T2", "A1") is None
+        stats = store.stats()
+        store.close()
+        other = InstallationStore(SQLiteInstallationBackend(path))
+        found = await other.get("T1", "A1")
+        assert await other.any(app_id="A1") and not await other.any(team_id="T2")
+        other.close()
+        return stats, found
+
+    stats, found = asyncio.run(run())
+    assert stats == {"entries": 1, "hits": 1, "misses": 1}
+    assert found == Installation("T1", "A1", "xoxb-1", installed_at=1.0)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+# Test that an installation deleted by another process is seen once the cache entry expires, and at once locally
+def test_deleted_installations_expire(tmp_path):
+    path = str(tmp_path / "installations.db")
+
+    async def run():
+        store = InstallationStore(SQLiteInstallationBackend(path), ttl=0.05)
+        other = InstallationStore(SQLiteInstallationBackend(path))
+        await store.save(Installation("T1", "A1", "xoxb-1"))
+        await other.delete("T1", "A1")
+        cached = await store.get("T1", "A1")
+        await asyncio.sleep(0.06)
+        expired = await store.get("T1", "A1")
+        store.close()
+        other.close()
+        return cached, expired
+
+    cached, expired = asyncio.run(run())
+    assert cached is not None and expired is None
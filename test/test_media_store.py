@@ -0,0 +1,40 @@
+import os
+import httpx
+from helpers import download_and_save_file
+from media_store import MediaStore
+
+
+# Build a sync client serving the given body and counting the downloads
+def file_client(body, seen):
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, content=body, headers={"content-type": "image/png"})
+
+    return httpx.Client(transport=httpx.MockTransport(handler))
+
+
+# Test that a file id already in the store is not downloaded again and that identical content is stored once
+def test_downloads_are_deduplicated(tmp_path):
+    media_store = MediaStore(str(tmp_path))
+    seen = []
+    client = file_client(b"same bytes", seen)
+    first = download_and_save_file("https://files.slack.test/files-pri/T1-F1/a.png", media_store=media_store, file_id="F1", client=client)
+    again = download_and_save_file("https://files.slack.test/files-pri/T1-F1/a.png", media_store=media_store, file_id="F1", client=client)
+    other = download_and_save_file("https://files.slack.test/files-pri/T1-F2/a.png", media_store=media_store, file_id="F2", client=client)
+    assert len(seen) == 2
+    assert again.already_stored and again.path == first.path
+    assert other.path == first.path == media_store.blob_path(first.sha256)
+    assert media_store.stats() == {"files": 2, "blobs": 1, "bytes": len(b"same bytes")}
+    assert os.listdir(media_store.tmp_dir) == []
+
+
+# Test that the gc pass deletes a blob once no file id points to it
+def test_gc_removes_orphaned_blobs(tmp_path):
+    media_store = MediaStore(str(tmp_path))
+    seen = []
+    first = download_and_save_file("https://files.slack.test/files-pri/T1-F1/a.png", media_store=media_store, file_id="F1", client=file_client(b"one", seen))
+    download_and_save_file("https://files.slack.test/files-pri/T1-F2/b.png", media_store=media_store, file_id="F2", client=file_client(b"two", seen))
+    assert media_store.remove("F1")
+    assert media_store.gc() == 1
+    assert not os.path.exists(first.path)
+    assert media_store.stats()["blobs"] == 1
@@ -0,0 +1,55 @@
+import asyncio
+from metrics import Counter, Histogram, Registry, StatsGauges, MetricsMiddleware
+
+
+# Test the Prometheus text rendering of counters, cumulative histograms and stats gauges
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    calls = registry.register("calls", Counter("calls_total", "Calls", ("method",)))
+    latency = registry.register("latency", Histogram("latency_seconds", "Latency", ("method",), buckets=(0.1, 1.0)))
+    registry.register("queue", StatsGauges("queue", "Queue", lambda: {"depth": 3, "name": "ignored", "busy": True}))
+    calls.inc("users.list")
+    calls.inc("users.list", amount=2)
+    latency.observe(0.05, "users.list")
+    latency.observe(0.5, "users.list")
+    latency.observe(5.0, "users.list")
+    lines = registry.render().decode().splitlines()
+    assert 'calls_total{method="users.list"} 3' in lines
+    assert [line for line in lines if line.startswith("latency_seconds_bucket")] == [
+        'latency_seconds_bucket{method="users.list",le="0.1"} 1',
+        'latency_seconds_bucket{method="users.list",le="1.0"} 2',
+        'latency_seconds_bucket{method="users.list",le="+Inf"} 3',
+    ]
+    assert 'latency_seconds_count{method="users.list"} 3' in lines and 'latency_seconds_sum{method="users.list"} 5.55' in lines
+    assert "queue_depth 3" in lines and not any(line.startswith("queue_name") or line.startswith("queue_busy") for line in lines)
+
+
+# Test that requests are labelled with their route template, and unrouted ones are grouped
+def test_middleware_labels_routes():
+    histogram = Histogram("requests", "Requests", ("method", "route", "status"))
+
+    def endpoint():
+        pass
+
+    class Route:
+        path = "/files/{file_id}"
+
+    Route.endpoint = staticmethod(endpoint)
+
+    class App:
+        routes = [Route()]
+
+    async def inner(scope, receive, send):
+        if scope["path"].startswith("/files/"):
+            scope["endpoint"] = endpoint
+        await send({"type": "http.response.start", "status": 200 if "endpoint" in scope else 404, "headers": []})
+
+    async def send(message):
+        pass
+
+    middleware = MetricsMiddleware(inner, histogram)
+    for path in ("/files/F1", "/files/F2", "/nope"):
+        asyncio.run(middleware({"type": "http", "method": "GET", "path": path, "app": App()}, None, send))
+    assert {labels: entry[0][-1] + sum(entry[0][:-1]) for labels, entry in histogram.values.items()} == {
+        ("GET", "/files/{file_id}", "200"): 2, ("GET", "unmatched", "404"): 1
+    }
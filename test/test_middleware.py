@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import orjson
+from middleware import RequestResponseLoggingMiddleware, redact_body, redact_query
+
+
+# Collect the log records of a logger in a list
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(orjson.loads(record.getMessage()))
+
+
+# Run one http request through the middleware and return the messages sent and the log lines written
+def call(inner_app, sample_rate=1.0, body_sample_rate=1.0, max_body_size=16, headers=(), query_string=b"", body=b""):
+    logger = logging.getLogger("test_access")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = ListHandler()
+    logger.handlers = [handler]
+    middleware = RequestResponseLoggingMiddleware(inner_app, sample_rate=sample_rate, body_sample_rate=body_sample_rate, max_body_size=max_body_size, logger=logger)
+    scope = {"type": "http", "method": "POST", "path": "/run", "query_string": query_string, "headers": list(headers), "client": ("127.0.0.1", 1)}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent, handler.lines
+
+
+# A streaming app echoing the request body in several chunks
+async def streaming_app(scope, receive, send):
+    message = await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/x-ndjson")]})
+    for n in range(3):
+        await send({"type": "http.response.body", "body": message["body"] + b"\n", "more_body": n < 2})
+
+
+# Test that streamed chunks pass through untouched while the captured bodies are capped and redacted
+def test_streaming_passes_through_and_is_redacted():
+    body = b'{"access_token": "xoxb-123-abc"}'
+    sent, lines = call(streaming_app, headers=[(b"authorization", b"Bearer xoxp-1"), (b"x-slack-team-id", b"T1"), (b"x-api-key", b"service-key"), (b"accept", b"*/*")], query_string=b"code=secret&team=T1", body=body, max_body_size=64)
+    assert [message.get("body") for message in sent[1:]] == [body + b"\n"] * 3
+    line = lines[0]
+    assert line["status"] == 200 and line["request_bytes"] == len(body) and line["response_bytes"] == 3 * (len(body) + 1)
+    assert line["request_headers"] == {"authorization": "[redacted]", "x-slack-team-id": "[redacted]", "x-api-key": "[redacted]", "accept": "*/*"}
+    assert line["query"] == "code=%5Bredacted%5D&team=T1"
+    assert "xoxb" not in line["request_body"] and line["truncated"] == True
+
+
+# Test that unsampled requests are not logged, unless they fail
+def test_sampling_keeps_errors():
+    async def failing_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 503, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    assert call(streaming_app, sample_rate=0.0)[1] == []
+    lines = call(failing_app, sample_rate=0.0)[1]
+    assert lines[0]["status"] == 503 and "request_body" not in lines[0]
+
+
+def test_redaction_helpers():
+    assert redact_body(b'{"client_secret":"s3cr3t","user":"xoxp-9-z"}') == '{"client_secret":"[redacted]","user":"xox?-[redacted]"}'
+    assert redact_query(b"") == ""
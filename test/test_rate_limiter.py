@@ -0,0 +1,52 @@
+import asyncio
+import time
+import httpx
+from api_manager import APIManager
+from rate_limiter import SlackRateLimiter, TokenBucket
+
+
+# Test that an empty bucket queues the caller until a token is refilled
+def test_bucket_queues_instead_of_failing():
+    async def run():
+        bucket = TokenBucket(rate=20.0, capacity=1)
+        first = await bucket.acquire()
+        second = await bucket.acquire()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first < 0.01
+    assert 0.03 < second < 0.5
+
+
+# Test that a 429 is queued again after Retry-After and the limiter reports it
+def test_429_is_retried_after_retry_after():
+    responses = [httpx.Response(429, headers={"Retry-After": "0.05"}), httpx.Response(200, json={"ok": True})]
+
+    def handler(request):
+        return responses.pop(0)
+
+    async def run():
+        rate_limiter = SlackRateLimiter()
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            api_manager = APIManager(url="https://slack.test/api/users.list", access_token="xoxp-test", client=client, rate_limiter=rate_limiter)
+            started = time.monotonic()
+            response = await api_manager._post()
+            return response, time.monotonic() - started, rate_limiter.stats()
+
+    response, elapsed, stats = asyncio.run(run())
+    assert response.status_code == 200
+    assert elapsed >= 0.05
+    assert stats["rate_limited"] == 1 and stats["calls"] == 2 and stats["queue_depth"] == 0
+
+
+# Test that tokens and tiers get their own buckets
+def test_buckets_per_token_and_tier():
+    async def run():
+        rate_limiter = SlackRateLimiter()
+        await rate_limiter.acquire("xoxp-a", "users.list")
+        await rate_limiter.acquire("xoxp-a", "admin.apps.requests.list")
+        await rate_limiter.acquire("xoxp-b", "users.list")
+        await rate_limiter.acquire("xoxp-a", "auth.test")
+        return rate_limiter.stats()
+
+    assert asyncio.run(run())["buckets"] == 3
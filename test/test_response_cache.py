@@ -0,0 +1,84 @@
+import asyncio
+import os
+import time
+import httpx
+from api_manager import APIManager
+from response_cache import ResponseCache, FileCacheBackend, CachedResponse, cache_key
+
+
+# Build an APIManager for users.list whose transport counts the upstream calls
+def counting_api_manager(calls, cache, delay=0.0):
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json={"ok": True, "members": [], "call": len(calls)})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return APIManager(url="https://slack.test/api/users.list", access_token="xoxp-test", client=client, cache=cache)
+
+
+# Test that concurrent identical requests cause a single upstream call
+def test_concurrent_requests_are_coalesced():
+    calls = []
+
+    async def run():
+        cache = ResponseCache(ttl=60)
+        api_manager = counting_api_manager(calls, cache, delay=0.05)
+        responses = await asyncio.gather(*[api_manager._post({"cursor": "abc"}) for _ in range(10)])
+        # A later call is served from the cache
+        responses.append(await api_manager._post({"cursor": "abc"}))
+        return responses, cache.stats()
+
+    responses, stats = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(response.json()["call"] == 1 for response in responses)
+    assert stats["misses"] == 1 and stats["coalesced"] == 9 and stats["hits"] == 1
+
+
+# Test that a stale entry is served while it is refreshed in the background, and that the LRU is bounded
+def test_stale_while_revalidate_and_eviction():
+    calls = []
+
+    async def run():
+        cache = ResponseCache(max_entries=2, ttl=0.0, stale_ttl=60)
+        api_manager = counting_api_manager(calls, cache)
+        await api_manager._post({"cursor": "a"})
+        stale = await api_manager._post({"cursor": "a"})
+        await asyncio.sleep(0.01)
+        await api_manager._post({"cursor": "b"})
+        await api_manager._post({"cursor": "c"})
+        return stale, list(cache.entries)
+
+    stale, keys = asyncio.run(run())
+    assert stale.json()["call"] == 1
+    assert len(calls) == 4
+    assert keys == [cache_key("xoxp-test", "users.list", {"cursor": c}) for c in ("b", "c")]
+
+
+# Test that a second cache sharing the file backend reuses the stored entry
+def test_file_backend_is_shared(tmp_path):
+    calls = []
+
+    async def run():
+        first = counting_api_manager(calls, ResponseCache(ttl=60, backend=FileCacheBackend(str(tmp_path))))
+        second = counting_api_manager(calls, ResponseCache(ttl=60, backend=FileCacheBackend(str(tmp_path))))
+        await first._post()
+        return await second._post()
+
+    assert asyncio.run(run()).json()["call"] == 1
+    assert len(calls) == 1
+
+
+# Test that expired entry files are deleted when read and by the sweep, which also caps the number of files
+def test_file_backend_deletes_expired_and_excess_files(tmp_path):
+    backend = FileCacheBackend(str(tmp_path), max_age=60, max_entries=2, sweep_every=1000)
+    now = time.time()
+    backend.set("old", CachedResponse(now - 120, 200, b"{}"))
+    assert backend.get("old") is None and not os.path.exists(backend._path("old"))
+
+    for n, key in enumerate(("expired", "a", "b", "c")):
+        backend.set(key, CachedResponse(now, 200, b"{}"))
+        age = 120 if key == "expired" else 3 - n
+        os.utime(backend._path(key), (now - age, now - age))
+    assert backend.sweep(now) == 2
+    assert sorted(os.listdir(str(tmp_path))) == sorted(os.path.basename(backend._path(key)) for key in ("b", "c"))
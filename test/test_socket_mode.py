@@ -0,0 +1,129 @@
+import asyncio
+from benchmarks.socket_mode_standin import SocketModeStandin
+from socket_mode import SocketModeClient
+from work_queue import QueueFullError
+
+
+# Run the client against the stand-in until every event was acked, and return the handled event ids and the client
+def run_against_standin(standin, connections, handler=None):
+    handled = []
+
+    async def record(payload):
+        handled.append(payload["event_id"])
+        if handler is not None:
+            await handler(payload)
+
+    async def run():
+        server = await standin.serve()
+
+        async def open_url():
+            return standin.url
+
+        client = SocketModeClient(record, open_url, connections=connections, base_delay=0.01)
+        client.start()
+        try:
+            await asyncio.wait_for(standin.all_acked.wait(), timeout=10)
+        finally:
+            await client.stop()
+            server.close()
+            await server.wait_closed()
+        return client
+
+    client = asyncio.run(run())
+    return handled, client
+
+
+# Test that every envelope is acked and handled once, spread over several connections
+def test_events_spread_over_connections():
+    standin = SocketModeStandin(events=200)
+    handled, client = run_against_standin(standin, connections=3)
+    assert sorted(handled) == sorted("EvStandin{}".format(n) for n in range(200))
+    assert standin.connections == 3 and client.acks == 200 and client.open_connections == 0
+
+
+# Test that connections reconnect when slack asks them to refresh, and that a failing handler does not stop the connection
+def test_reconnects_on_disconnect():
+    async def flaky(payload):
+        if payload["event_id"] == "EvStandin5":
+            raise ValueError("boom")
+
+    standin = SocketModeStandin(events=50, disconnect_after=10)
+    handled, client = run_against_standin(standin, connections=1, handler=flaky)
+    assert len(set(handled)) == 50 and client.deferred_events == 1
+    assert standin.connections >= 5 and client.reconnects >= 4
+
+
+# Test that events failing after their ack, e.g. on a full work queue, are retried from the buffer instead of being lost
+def test_failed_events_are_retried():
+    failures = {"EvStandin3": 2, "EvStandin7": 1}
+    handled = []
+
+    async def busy(payload):
+        if failures.get(payload["event_id"], 0) > 0:
+            failures[payload["event_id"]] -= 1
+            raise QueueFullError("Work queue is full (1000 jobs)")
+        handled.append(payload["event_id"])
+
+    async def run():
+        standin = SocketModeStandin(events=20)
+        server = await standin.serve()
+
+        async def open_url():
+            return standin.url
+
+        client = SocketModeClient(busy, open_url, connections=1, base_delay=0.01, retry_buffer_size=1)
+        client.start()
+        try:
+            await asyncio.wait_for(standin.all_acked.wait(), timeout=10)
+            while client.retried_events < 2:
+                await asyncio.sleep(0.01)
+        finally:
+            await client.stop()
+            server.close()
+            await server.wait_closed()
+        return client
+
+    client = asyncio.run(asyncio.wait_for(run(), timeout=10))
+    assert sorted(handled) == sorted("EvStandin{}".format(n) for n in range(20))
+    assert client.deferred_events == 2 and client.retried_events == 2 and client.failed_events == 0
+
+
+# Test that an event that keeps failing is retried on its own schedule, without holding back the retries of the others
+def test_failing_event_does_not_hold_back_retries():
+    failed_once = set()
+    handled = []
+
+    async def handler(payload):
+        event_id = payload["event_id"]
+        if event_id == "EvStandin0" or event_id not in failed_once:
+            failed_once.add(event_id)
+            raise QueueFullError("Work queue is full (1000 jobs)")
+        handled.append(event_id)
+
+    async def run():
+        standin = SocketModeStandin(events=10)
+        server = await standin.serve()
+
+        async def open_url():
+            return standin.url
+
+        client = SocketModeClient(handler, open_url, connections=1, base_delay=0.5, retry_attempts=5)
+        client.start()
+        try:
+            await asyncio.wait_for(standin.all_acked.wait(), timeout=10)
+
+            async def others_retried():
+                while client.retried_events < 9:
+                    await asyncio.sleep(0.01)
+
+            # The always failing event alone waits 0.25 to 0.5 + 0.5 to 1 + 1 to 2... seconds between its retries
+            await asyncio.wait_for(others_retried(), timeout=2)
+            return client.stats()
+        finally:
+            await client.stop()
+            server.close()
+            await server.wait_closed()
+
+    stats = asyncio.run(run())
+    assert sorted(handled) == sorted("EvStandin{}".format(n) for n in range(1, 10))
+    assert stats["deferred_events"] == 10 and stats["retry_buffer"] == 1 and stats["failed_events"] == 0
@@ -0,0 +1,44 @@
+import pytest
+from sync_store import SQLiteSnapshotStore, InvalidSyncTokenError, encode_sync_token
+
+
+# Test that the first sync returns everything as added and later ones only what changed since their token
+def test_sync_reports_changes_since_token(tmp_path):
+    store = SQLiteSnapshotStore(str(tmp_path / "sync.db"))
+    token, changes = store.sync("T1", {"users": [{"id": "U1", "name": "ada"}, {"id": "U2", "name": "bob"}]})
+    assert [user["id"] for user in changes["users"]["added"]] == ["U1", "U2"]
+
+    same_token, changes = store.sync("T1", {"users": [{"name": "bob", "id": "U2"}, {"id": "U1", "name": "ada"}]}, token)
+    assert same_token == token
+    assert changes["users"] == {"added": [], "changed": [], "deleted": []}
+
+    second_token, changes = store.sync("T1", {"users": [{"id": "U1", "name": "ada l"}, {"id": "U3", "name": "cy"}]}, token)
+    assert changes["users"] == {"added": [{"id": "U3", "name": "cy"}], "changed": [{"id": "U1", "name": "ada l"}], "deleted": ["U2"]}
+
+    # A caller still holding the first token sees every change since then, an up to date one sees none
+    _, changes = store.sync("T1", {"users": [{"id": "U1", "name": "ada l"}, {"id": "U3", "name": "cy"}]}, token)
+    assert changes["users"]["deleted"] == ["U2"] and len(changes["users"]["added"]) == 1
+    _, changes = store.sync("T1", {"users": [{"id": "U1", "name": "ada l"}, {"id": "U3", "name": "cy"}]}, second_token)
+    assert changes["users"] == {"added": [], "changed": [], "deleted": []}
+    store.close()
+
+
+# Test that a kind left out of a sync keeps its snapshot, e.g. when slack could not list the apps
+def test_sync_skipped_kind_is_untouched(tmp_path):
+    store = SQLiteSnapshotStore(str(tmp_path / "sync.db"))
+    token, _ = store.sync("T1", {"users": [], "apps": [{"id": "A1"}]})
+    token, changes = store.sync("T1", {"users": [{"id": "U1"}]}, token)
+    assert "apps" not in changes
+    _, changes = store.sync("T1", {"users": [{"id": "U1"}], "apps": [{"id": "A1"}]}, token)
+    assert changes["apps"] == {"added": [], "changed": [], "deleted": []}
+    store.close()
+
+
+# Test that tokens of another workspace, from the future or malformed are rejected
+def test_sync_rejects_invalid_tokens(tmp_path):
+    store = SQLiteSnapshotStore(str(tmp_path / "sync.db"))
+    store.sync("T1", {"users": [{"id": "U1"}]})
+    for token in (encode_sync_token("T2", 1), encode_sync_token("T1", 5), "not-a-token"):
+        with pytest.raises(InvalidSyncTokenError):
+            store.sync("T1", {"users": []}, token)
+    store.close()
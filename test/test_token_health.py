@@ -0,0 +1,48 @@
+import asyncio
+import httpx
+from token_health import TokenHealthChecker, HEALTHY, DEAD, UNKNOWN
+
+
+# Build a checker talking to a mocked auth.test answering from a token -> response json map
+def mocked_checker(responses, calls, **kwargs):
+    async def handler(request):
+        token = request.headers["Authorization"].split()[-1]
+        calls.append(token)
+        await asyncio.sleep(0.01)
+        if responses[token] is None:
+            return httpx.Response(503)
+        return httpx.Response(200, json=responses[token])
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return TokenHealthChecker("https://slack.test/api/auth.test", {"client": client}, **kwargs)
+
+
+# Test that dead and healthy tokens are cached, while slack failures are reported as unknown and not cached
+def test_check_many_classifies_and_caches():
+    calls = []
+    responses = {"good": {"ok": True}, "revoked": {"ok": False, "error": "token_revoked"}, "flaky": None}
+    checker = mocked_checker(responses, calls, concurrency=2)
+
+    async def run():
+        first = await checker.check_many(["good", "revoked", "flaky"])
+        second = await checker.check_many(["good", "revoked", "flaky"])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert [entry[0] for entry in first] == [HEALTHY, DEAD, UNKNOWN] and first[1][1] == "token_revoked"
+    assert [entry[0] for entry in second] == [HEALTHY, DEAD, UNKNOWN]
+    assert sorted(calls) == ["flaky", "flaky", "good", "revoked"]
+    assert checker.is_dead("revoked") and not checker.is_dead("good") and not checker.is_dead("flaky")
+
+
+# Test that cached results expire after the ttl
+def test_results_expire():
+    checker = mocked_checker({"revoked": {"ok": False, "error": "invalid_auth"}}, [], ttl=0.05)
+
+    async def run():
+        await checker.check("revoked")
+        dead = checker.is_dead("revoked")
+        await asyncio.sleep(0.06)
+        return dead, checker.is_dead("revoked")
+
+    assert asyncio.run(run()) == (True, False)
@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+from work_queue import WorkQueue, SQLiteJobStore, QueueFullError
+
+
+# Test that jobs are processed by the workers and reported in the stats
+def test_jobs_are_processed():
+    processed = []
+
+    async def handler(payload):
+        processed.append(payload["n"])
+
+    async def run():
+        work_queue = WorkQueue(handler, workers=2)
+        await work_queue.start()
+        for n in range(5):
+            await work_queue.put({"n": n})
+        await work_queue.stop()
+        return work_queue.stats()
+
+    stats = asyncio.run(run())
+    assert sorted(processed) == [0, 1, 2, 3, 4]
+    assert stats["processed"] == 5 and stats["queue_depth"] == 0 and stats["workers"] == 0
+
+
+# Test that a full queue pushes back on callers once the enqueue timeout runs out
+def test_full_queue_rejects():
+    async def handler(payload):
+        await asyncio.sleep(10)
+
+    async def run():
+        work_queue = WorkQueue(handler, workers=1, maxsize=1, enqueue_timeout=0.1)
+        await work_queue.start()
+        await work_queue.put({"n": 1})
+        # Let the worker take the first job off the queue
+        await asyncio.sleep(0)
+        await work_queue.put({"n": 2})
+        try:
+            with pytest.raises(QueueFullError):
+                await work_queue.put({"n": 3})
+        finally:
+            await work_queue.stop(drain_timeout=0)
+        return work_queue.stats()
+
+    assert asyncio.run(run())["rejected"] == 1
+
+
+# Test that jobs persisted in SQLite are picked up again after a restart
+def test_persisted_jobs_survive_restart(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    processed = []
+
+    async def stuck(payload):
+        await asyncio.sleep(10)
+
+    async def handler(payload):
+        processed.append(payload["n"])
+
+    async def run():
+        first = WorkQueue(stuck, workers=1, store=SQLiteJobStore(path))
+        await first.start()
+        await first.put({"n": 1})
+        await first.put({"n": 2})
+        await first.stop(drain_timeout=0)
+        second = WorkQueue(handler, workers=1, store=SQLiteJobStore(path))
+        await second.start()
+        await second.stop()
+        return SQLiteJobStore(path).pending()
+
+    assert asyncio.run(run()) == []
+    assert processed == [1, 2]
+
+
+# Test that a job failing once is retried after a backoff and only then deleted from the store
+def test_failed_job_is_retried(tmp_path):
+    attempts = []
+
+    async def flaky(payload):
+        attempts.append(payload["n"])
+        if len(attempts) == 1:
+            raise OSError("connection reset")
+
+    async def run():
+        store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+        work_queue = WorkQueue(flaky, workers=1, store=store, retry_base_delay=0.01)
+        await work_queue.start()
+        await work_queue.put({"n": 1})
+        while work_queue.stats()["processed"] < 1:
+            await asyncio.sleep(0.01)
+        pending = store.pending()
+        await work_queue.stop()
+        return work_queue.stats(), pending
+
+    stats, pending = asyncio.run(asyncio.wait_for(run(), timeout=5))
+    assert attempts == [1, 1] and pending == []
+    assert stats["retried"] == 1 and stats["failed"] == 0 and stats["retrying"] == 0
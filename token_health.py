@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from api_manager import APIManager
+from rate_limiter import token_key
+
+
+# auth.test errors meaning the token will never work again, as opposed to slack being unavailable
+DEAD_TOKEN_ERRORS = {
+    "invalid_auth",
+    "not_authed",
+    "token_revoked",
+    "token_expired",
+    "account_inactive",
+}
+
+HEALTHY = "healthy"
+DEAD = "dead"
+UNKNOWN = "unknown"
+
+
+
+#Validates tokens with auth.test and caches the outcome for ttl seconds, keyed by a hash of the token.
+#Request handlers look the cache up to reject dead tokens without calling slack, and a background loop re-validates
+#every stored installation each interval seconds, at most concurrency calls at a time
+class TokenHealthChecker:
+    def __init__(self, url, api_options, ttl=600.0, concurrency=10):
+        self.url = url
+        self.api_options = api_options
+        self.ttl = ttl
+        self.concurrency = concurrency
+        # token key -> (status, error, checked_at)
+        self.entries = {}
+        self.checks = 0
+        # When a refresh of every installation was last asked for, on the monotonic clock
+        self.refresh_requested_at = None
+
+
+    # Cached (status, error, checked_at) of the token, or None when it was not checked within ttl seconds
+    def status(self, access_token):
+        entry = self.entries.get(token_key(access_token))
+        if entry is None or time.time() - entry[2] > self.ttl:
+            return None
+        return entry
+
+
+    # Whether the token is known to be dead. Cheap enough to be called on every request
+    def is_dead(self, access_token):
+        entry = self.status(access_token)
+        return entry is not None and entry[0] == DEAD
+
+
+    # Call auth.test with the token and cache the outcome. A failure to reach slack is reported as unknown
+    # and not cached, so it never gets a working token rejected
+    async def check(self, access_token):
+        self.checks += 1
+        api_manager = APIManager(url=self.url, access_token=access_token, **self.api_options)
+        try:
+            response = await api_manager._post()
+            response_json = response.json() if response.status_code == 200 else {}
+        except Exception as e:
+            return (UNKNOWN, str(e), time.time())
+        if response_json.get("ok") == True:
+            entry = (HEALTHY, None, time.time())
+        elif response_json.get("error") in DEAD_TOKEN_ERRORS:
+            entry = (DEAD, response_json["error"], time.time())
+        else:
+            return (UNKNOWN, response_json.get("error") or "Slack responded with status code {}".format(response.status_code), time.time())
+        self.entries[token_key(access_token)] = entry
+        return entry
+
+
+    # Check many tokens, at most concurrency at a time. Tokens checked within ttl seconds are served from the cache
+    # unless refresh is set. Returns the entries in the order of the tokens
+    async def check_many(self, access_tokens, refresh=False):
+        limiter = asyncio.Semaphore(self.concurrency)
+
+        async def check_one(access_token):
+            entry = None if refresh else self.status(access_token)
+            if entry is not None:
+                return entry
+            async with limiter:
+                return await self.check(access_token)
+
+        return await asyncio.gather(*(check_one(access_token) for access_token in access_tokens))
+
+
+    # Whether a refresh asked for by a caller may run, at most one every min_interval seconds. Returns the seconds
+    # left to wait, 0 when the refresh may run
+    def claim_refresh(self, min_interval):
+        now = time.monotonic()
+        if self.refresh_requested_at is not None and now - self.refresh_requested_at < min_interval:
+            return min_interval - (now - self.refresh_requested_at)
+        self.refresh_requested_at = now
+        return 0
+
+
+    # Re-validate every stored installation each interval seconds, until cancelled
+    async def run(self, installation_store, interval=300.0):
+        while True:
+            try:
+                installations = await installation_store.all()
+                entries = await self.check_many([installation.access_token for installation in installations], refresh=True)
+                dead = sum(1 for entry in entries if entry[0] == DEAD)
+                if dead:
+                    logging.warning(f"Token health check found {dead} dead tokens out of {len(entries)} installations")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Token health check failed. Reason: {e!r}")
+            await asyncio.sleep(interval)
+
+
+    def stats(self):
+        statuses = [entry[0] for entry in self.entries.values()]
+        return {"tokens": len(statuses), "healthy": statuses.count(HEALTHY), "dead": statuses.count(DEAD), "checks": self.checks}
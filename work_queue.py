@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+
+# Raised when a job could not be queued in time because the queue is full
+class QueueFullError(Exception):
+    pass
+
+
+
+#Keeps queued jobs in SQLite so they survive a restart, a job is deleted once it has been processed or given up on
+class SQLiteJobStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, created_at REAL NOT NULL)")
+
+
+    def add(self, payload, created_at):
+        with self.lock, self.connection:
+            cursor = self.connection.execute("INSERT INTO jobs (payload, created_at) VALUES (?, ?)", (json.dumps(payload), created_at))
+            return cursor.lastrowid
+
+
+    def delete(self, job_id):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+    # Jobs left over by a previous run, oldest first
+    def pending(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT id, payload, created_at FROM jobs ORDER BY id").fetchall()
+        return [(job_id, json.loads(payload), created_at) for job_id, payload, created_at in rows]
+
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+
+#An in-process async work queue processed by a bounded pool of workers.
+#Callers have already answered slack by the time a job runs, so a failing job is queued again after a jittered
+#exponential backoff of retry_base_delay seconds and more, up to max_retries times, before being given up on
+class WorkQueue:
+    def __init__(self, handler, workers=4, maxsize=1000, enqueue_timeout=1.0, store=None, max_retries=3, retry_base_delay=1.0, retry_max_delay=60.0):
+        # handler is a coroutine function called with the payload of each job
+        self.handler = handler
+        self.worker_count = workers
+        self.maxsize = maxsize
+        # How long put waits for room in a full queue before giving up, this is the backpressure seen by callers
+        self.enqueue_timeout = enqueue_timeout
+        self.store = store
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.queue = None
+        self.workers = []
+        # Jobs waiting for their next attempt
+        self.retrying = set()
+        self.in_progress = 0
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_processing_time = 0.0
+
+
+    async def _run_in_thread(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+    # Create the queue and workers, re-queueing the jobs persisted by a previous run
+    async def start(self):
+        # The queue is created here so it belongs to the running event loop
+        self.queue = asyncio.Queue()
+        if self.store is not None:
+            pending = await self._run_in_thread(self.store.pending)
+            for job_id, payload, created_at in pending:
+                self.queue.put_nowait((job_id, payload, created_at, 0))
+            if pending:
+                logging.info(f"Work queue restored {len(pending)} pending jobs")
+        self.workers = [asyncio.ensure_future(self._worker()) for _ in range(self.worker_count)]
+
+
+    # Wait up to drain_timeout for the queued jobs to finish, then stop the workers. Jobs still queued or waiting for
+    # a retry are kept by the store, if there is one, and picked up again on the next start
+    async def stop(self, drain_timeout=5.0):
+        if self.queue is not None and drain_timeout > 0:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Work queue stopped with {self.queue.qsize()} jobs still queued")
+        if self.retrying:
+            logging.warning(f"Work queue stopped with {len(self.retrying)} jobs waiting for a retry")
+        tasks = self.workers + list(self.retrying)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers = []
+        self.retrying = set()
+        if self.store is not None:
+            self.store.close()
+
+
+    # Queue a job, waiting up to enqueue_timeout for room. Raises QueueFullError when there is none
+    async def put(self, payload):
+        deadline = time.monotonic() + self.enqueue_timeout
+        while self.queue.qsize() >= self.maxsize:
+            if time.monotonic() >= deadline:
+                self.rejected += 1
+                raise QueueFullError("Work queue is full ({} jobs)".format(self.queue.qsize()))
+            await asyncio.sleep(0.05)
+        created_at = time.time()
+        job_id = None if self.store is None else await self._run_in_thread(self.store.add, payload, created_at)
+        self.queue.put_nowait((job_id, payload, created_at, 0))
+
+
+    # Queue the job again once its backoff is over. Retries skip maxsize, the job was already accepted
+    async def _retry_later(self, job_id, payload, created_at, retries):
+        delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** (retries - 1)))
+        await asyncio.sleep(random.uniform(delay / 2, delay))
+        self.queue.put_nowait((job_id, payload, created_at, retries))
+
+
+    async def _worker(self):
+        while True:
+            job_id, payload, created_at, retries = await self.queue.get()
+            self.in_progress += 1
+            started = time.monotonic()
+            done = True
+            try:
+                await self.handler(payload)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if retries < self.max_retries:
+                    done = False
+                    self.retried += 1
+                    logging.warning(f"Work queue job failed, retrying it ({retries + 1}/{self.max_retries}). Reason: {e!r}")
+                    task = asyncio.ensure_future(self._retry_later(job_id, payload, created_at, retries + 1))
+                    self.retrying.add(task)
+                    task.add_done_callback(self.retrying.discard)
+                else:
+                    # Given up on rather than retried forever
+                    self.failed += 1
+                    logging.error(f"Work queue job failed after {retries} retries. Reason: {e!r}")
+            finally:
+                self.in_progress -= 1
+                self.total_processing_time += time.monotonic() - started
+                if done:
+                    latency = time.time() - created_at
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+                self.queue.task_done()
+            # A job waiting for a retry stays in the store, so a restart in the meantime still runs it
+            if done and job_id is not None:
+                await self._run_in_thread(self.store.delete, job_id)
+
+
+    # Queue depth and processing latency figures, latency is measured from the time a job was queued
+    def stats(self):
+        done = self.processed + self.failed
+        return {
+            "queue_depth": 0 if self.queue is None else self.queue.qsize(),
+            "in_progress": self.in_progress,
+            "workers": len(self.workers),
+            "processed": self.processed,
+            "retrying": len(self.retrying),
+            "retried": self.retried,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "average_latency": self.total_latency / done if done else 0.0,
+            "max_latency": self.max_latency,
+            "average_processing_time": self.total_processing_time / done if done else 0.0,
+        }